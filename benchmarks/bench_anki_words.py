@@ -0,0 +1,96 @@
+"""
+Measure the cost of filling the Word/Reading/Base form fields of the Anki cards, as a share of the job time:
+from the rubies of the annotation and a MeCab pass over the paragraphs that have one, or by annotating
+each sentence again.
+
+Usage: python -m benchmarks.bench_anki_words --chapters 20 --paragraphs 500
+"""
+import os
+import random
+import time
+import zipfile
+from tempfile import TemporaryDirectory
+from typing import Iterable
+
+import typer
+from furigana.furigana import split_furigana
+
+from furiganalyse.apkg_format import AnkiDeckSink, extract_sentences
+from furiganalyse.epub_format import process_epub_archive
+from furiganalyse.params import FuriganaMode
+from furiganalyse.parsing import Paragraph, format_tokens, reading_cache
+
+WORDS = ["漢字", "東京", "大学", "人生", "世界一", "成功体験", "自己", "理解", "猫", "名前"]
+
+
+class EmptyWordsSink(AnkiDeckSink):
+    """
+    Cards without target word.
+    """
+
+    def add_document(self, name: str, paragraphs: Iterable[Paragraph]):
+        for tokens in paragraphs:
+            for sentence in extract_sentences(format_tokens(tokens)):
+                self.add_note([sentence, "", "", ""])
+
+
+class RetokenizingSink(AnkiDeckSink):
+    """
+    Target word found by annotating each sentence again (only its kanji and reading).
+    """
+
+    def add_document(self, name: str, paragraphs: Iterable[Paragraph]):
+        for tokens in paragraphs:
+            for sentence in extract_sentences("".join(token[0] for token in tokens)):
+                word = next((pair for pair in split_furigana(sentence) if len(pair) == 2), ("", ""))
+                self.add_note([sentence, *word, word[0]])
+
+
+def write_book(filepath: str, chapters: int, paragraphs: int):
+    rng = random.Random(0)
+    with zipfile.ZipFile(filepath, "w") as zip_out:
+        zip_out.writestr("mimetype", "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        for i in range(chapters):
+            body = "".join(
+                f"<p>{rng.choice(WORDS)}は{i}の{j}番目の{rng.choice(WORDS)}である。{rng.choice(WORDS)}だ。</p>\n"
+                for j in range(paragraphs)
+            )
+            zip_out.writestr(
+                f"OEBPS/chapter{i}.xhtml", f'<html xmlns="http://www.w3.org/1999/xhtml"><body>{body}</body></html>'
+            )
+
+
+def run(inputfile: str, outputfile: str, sink_class) -> float:
+    reading_cache.clear()
+    start = time.perf_counter()
+    with sink_class("Benchmark", outputfile) as sink:
+        process_epub_archive(inputfile, None, FuriganaMode.add, txt_sink=sink)
+    elapsed = time.perf_counter() - start
+    os.remove(outputfile)
+    return elapsed
+
+
+def main(chapters: int = 20, paragraphs: int = 500, repeat: int = 3):
+    with TemporaryDirectory() as td:
+        inputfile = os.path.join(td, "input.epub")
+        write_book(inputfile, chapters, paragraphs)
+
+        sinks = [
+            ("no target word", EmptyWordsSink),
+            ("rubies and MeCab words", AnkiDeckSink),
+            ("annotating sentences again", RetokenizingSink),
+        ]
+        outputfile = os.path.join(td, "output.apkg")
+        # Warm up (imports, tokenizer)
+        run(inputfile, outputfile, EmptyWordsSink)
+
+        baseline = None
+        for name, sink_class in sinks:
+            elapsed = min(run(inputfile, outputfile, sink_class) for _ in range(repeat))
+            baseline = baseline or elapsed
+            overhead = (elapsed - baseline) / elapsed
+            print(f"{name:>28}: {elapsed:.2f}s, target words {overhead:.1%} of the job time")
+
+
+if __name__ == "__main__":
+    typer.run(main)
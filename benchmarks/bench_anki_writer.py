@@ -0,0 +1,67 @@
+"""
+Compare the time and peak memory taken to build the Anki deck of a long book,
+with genanki notes kept on the deck (previous writer) and with the batched writer.
+
+Usage: python -m benchmarks.bench_anki_writer --sentences 50000
+"""
+import os
+import random
+import time
+import tracemalloc
+from tempfile import TemporaryDirectory
+
+import genanki
+import typer
+
+from furiganalyse.apkg_format import AnkiDeckSink, create_model
+
+KANJI = "吾輩猫名前無何処生頓見当薄暗所泣記憶人間始"
+
+
+def generate_lines(sentences: int):
+    rng = random.Random(0)
+    lines = []
+    for i in range(sentences):
+        words = "".join(rng.choice(KANJI) + "(よみ)" for _ in range(10))
+        lines.append(f"{words}は{i}番目の文である。\n")
+    return lines
+
+
+def write_with_genanki(lines, outputfile: str):
+    model = create_model()
+    deck = genanki.Deck(1 << 30, "Benchmark")
+    for idx, line in enumerate(lines):
+        deck.add_note(genanki.Note(model=model, fields=[line.strip(), "", ""], due=idx))
+    genanki.Package(deck).write_to_file(outputfile)
+
+
+def write_with_sink(lines, outputfile: str):
+    with AnkiDeckSink("Benchmark", outputfile) as sink:
+        sink.add_document("book", lines)
+
+
+def main(sentences: int = 50_000):
+    lines = generate_lines(sentences)
+    with TemporaryDirectory() as td:
+        writers = [
+            ("genanki notes on the deck", write_with_genanki),
+            ("AnkiDeckSink", write_with_sink),
+        ]
+        for name, write in writers:
+            outputfile = os.path.join(td, "output.apkg")
+            start = time.perf_counter()
+            write(lines, outputfile)
+            elapsed = time.perf_counter() - start
+            os.remove(outputfile)
+
+            # Measured apart, tracing slows down the allocations
+            tracemalloc.start()
+            write(lines, outputfile)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"{name:>26}: {elapsed:.2f}s, peak {peak / 1e6:.1f} MB, {os.path.getsize(outputfile) / 1e6:.1f} MB")
+            os.remove(outputfile)
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,64 @@
+"""
+Compare annotating each text segment on its own with `annotate_segments`, on XHTML chapters made of many short
+text nodes: the latter goes through the caches and calls the tokenizer once per distinct text, instead of once
+per segment.
+
+Usage: python -m benchmarks.bench_annotate_segments --chapters 20 --nodes 3000
+"""
+import random
+import time
+from xml.etree import ElementTree as ET
+
+import typer
+
+from furiganalyse.parsing import annotate_segments, collect_segments, create_parsed_furigana_html, reading_cache
+
+NAMES = ["太郎", "花子", "先生", "王女", "魔法使い"]
+LINES = ["「行くぞ」", "と言った。", "彼は笑った。", "第一章", "静かな夜だった。", "窓の外を見た。"]
+
+
+def generate_chapter(nodes: int, seed: int) -> str:
+    rng = random.Random(seed)
+    paragraphs = []
+    for _ in range(nodes // 2):
+        paragraphs.append(f"<p><span>{rng.choice(NAMES)}</span>{rng.choice(LINES)}</p>")
+    return (
+        '<html xmlns="http://www.w3.org/1999/xhtml"><head><title>第一章</title></head><body>'
+        + "".join(paragraphs)
+        + "</body></html>"
+    )
+
+
+def annotate_each_segment(texts: list) -> list:
+    return [create_parsed_furigana_html(text) for text in texts]
+
+
+def run(chapters: list, annotate) -> tuple:
+    outputs = []
+    start = time.perf_counter()
+    for chapter in chapters:
+        # Only measure the lookups within a chapter, not the cross-document memoization
+        reading_cache.clear()
+        texts = [text for _, _, _, text in collect_segments(ET.fromstring(chapter))]
+        outputs.append([
+            (head, [ET.tostring(elem, encoding="unicode") for elem in children], tail)
+            for head, children, tail in annotate(texts)
+        ])
+    return time.perf_counter() - start, outputs
+
+
+def main(chapters: int = 20, nodes: int = 3000, cache_size: int = 0):
+    reading_cache.maxsize = cache_size
+    docs = [generate_chapter(nodes, seed) for seed in range(chapters)]
+
+    elapsed_before, outputs_before = run(docs, annotate_each_segment)
+    elapsed_after, outputs_after = run(docs, annotate_segments)
+
+    assert outputs_before == outputs_after, "annotate_segments output differs from per-segment output"
+    print(f"per-segment:       {chapters / elapsed_before:8.2f} chapters/sec ({elapsed_before:.2f}s)")
+    print(f"annotate_segments: {chapters / elapsed_after:8.2f} chapters/sec ({elapsed_after:.2f}s)")
+    print(f"speedup:           {elapsed_before / elapsed_after:8.2f}x")
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,70 @@
+"""
+Compare the archive build time of an illustrated EPUB with the different writers.
+
+Usage: python -m benchmarks.bench_archive_writer --images-mb 190 --text-mb 10
+"""
+import os
+import time
+import zipfile
+from tempfile import TemporaryDirectory
+
+import typer
+
+from furiganalyse.archive import ArchiveWriter
+
+PARAGRAPH = "<p>吾輩は<ruby>猫<rt>ねこ</rt></ruby>である。名前はまだ無い。</p>\n"
+
+
+def write_illustrated_book(folder: str, images_mb: int, text_mb: int):
+    os.makedirs(os.path.join(folder, "OEBPS", "images"))
+    with open(os.path.join(folder, "mimetype"), "w") as fd:
+        fd.write("application/epub+zip")
+    for i in range(images_mb):
+        # Random bytes, like compressed image data
+        with open(os.path.join(folder, "OEBPS", "images", f"{i}.jpg"), "wb") as fd:
+            fd.write(os.urandom(1_000_000))
+    paragraphs = 1_000_000 // len(PARAGRAPH.encode("utf-8"))
+    for i in range(text_mb):
+        with open(os.path.join(folder, "OEBPS", f"chapter{i}.xhtml"), "w", encoding="utf-8") as fd:
+            fd.write(PARAGRAPH * paragraphs)
+
+
+def write_with_zipfile(folder: str, outputfile: str, compression: int):
+    with zipfile.ZipFile(outputfile, "w", compression=compression) as zip_out:
+        for folder_name, _, filenames in os.walk(folder):
+            for filename in filenames:
+                file_path = os.path.join(folder_name, filename)
+                zip_out.write(file_path, os.path.relpath(file_path, folder))
+
+
+def write_with_archive_writer(folder: str, outputfile: str, compression_level: int):
+    with ArchiveWriter(outputfile, compression_level=compression_level) as archive:
+        for folder_name, _, filenames in os.walk(folder):
+            for filename in filenames:
+                file_path = os.path.join(folder_name, filename)
+                with open(file_path, "rb") as fd:
+                    archive.add_bytes(os.path.relpath(file_path, folder), fd.read())
+
+
+def main(images_mb: int = 190, text_mb: int = 10):
+    with TemporaryDirectory() as td:
+        folder = os.path.join(td, "book")
+        write_illustrated_book(folder, images_mb, text_mb)
+
+        writers = [
+            ("zipfile, stored (previous default)", lambda out: write_with_zipfile(folder, out, zipfile.ZIP_STORED)),
+            ("zipfile, deflate everything", lambda out: write_with_zipfile(folder, out, zipfile.ZIP_DEFLATED)),
+            ("ArchiveWriter, level 1", lambda out: write_with_archive_writer(folder, out, 1)),
+            ("ArchiveWriter, level 6", lambda out: write_with_archive_writer(folder, out, 6)),
+        ]
+        for name, write in writers:
+            outputfile = os.path.join(td, "output.epub")
+            start = time.perf_counter()
+            write(outputfile)
+            elapsed = time.perf_counter() - start
+            print(f"{name:>36}: {elapsed:.2f}s, {os.path.getsize(outputfile) / 1e6:.0f} MB")
+            os.remove(outputfile)
+
+
+if __name__ == "__main__":
+    typer.run(main)
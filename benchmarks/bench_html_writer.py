@@ -0,0 +1,70 @@
+"""
+Compare the native HTML writer, fed with the annotated documents, with the pandoc conversion of the annotated EPUB.
+
+Usage: python -m benchmarks.bench_html_writer --chapters 50 --paragraphs 500
+"""
+import os
+import time
+import zipfile
+from tempfile import TemporaryDirectory
+from xml.etree import ElementTree as ET
+
+import pypandoc
+import typer
+
+from furiganalyse.html_format import HtmlBookSink, read_package
+
+CONTAINER = """<?xml version="1.0"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+<rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/></rootfiles>
+</container>"""
+
+PARAGRAPH = "<p><ruby>吾輩<rt>わがはい</rt></ruby>は<ruby>猫<rt>ねこ</rt></ruby>である。<ruby>名前<rt>なまえ</rt></ruby>はまだ<ruby>無<rt>な</rt></ruby>い。</p>\n"
+
+
+def write_annotated_epub(filepath: str, chapters: int, paragraphs: int):
+    items = "".join(
+        f'<item id="c{i}" href="chapter{i}.xhtml" media-type="application/xhtml+xml"/>' for i in range(chapters)
+    )
+    itemrefs = "".join(f'<itemref idref="c{i}"/>' for i in range(chapters))
+    package = (
+        '<?xml version="1.0"?><package xmlns="http://www.idpf.org/2007/opf" version="3.0">'
+        '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/"><dc:title>吾輩は猫である</dc:title></metadata>'
+        f'<manifest>{items}<item id="img" href="cat.png" media-type="image/png"/></manifest>'
+        f"<spine>{itemrefs}</spine></package>"
+    )
+    with zipfile.ZipFile(filepath, "w") as zip_out:
+        zip_out.writestr("mimetype", "application/epub+zip")
+        zip_out.writestr("META-INF/container.xml", CONTAINER)
+        zip_out.writestr("OEBPS/content.opf", package)
+        zip_out.writestr("OEBPS/cat.png", os.urandom(100_000))
+        for i in range(chapters):
+            zip_out.writestr(
+                f"OEBPS/chapter{i}.xhtml",
+                '<html xmlns="http://www.w3.org/1999/xhtml"><head><title>章</title></head><body>'
+                '<img src="cat.png" alt=""/>' + PARAGRAPH * paragraphs + "</body></html>",
+            )
+
+
+def main(chapters: int = 50, paragraphs: int = 500):
+    with TemporaryDirectory() as td:
+        epub_filepath = os.path.join(td, "book.epub")
+        write_annotated_epub(epub_filepath, chapters, paragraphs)
+
+        start = time.perf_counter()
+        pypandoc.convert_file(epub_filepath, "html", outputfile=os.path.join(td, "pandoc.html"))
+        print(f"pandoc: {time.perf_counter() - start:.2f}s")
+
+        # The documents are parsed beforehand, as they come annotated from the processing of the book
+        with zipfile.ZipFile(epub_filepath) as zip_in:
+            documents = [(name, ET.fromstring(zip_in.read(name))) for name in read_package(zip_in)[2]]
+
+        start = time.perf_counter()
+        with HtmlBookSink(os.path.join(td, "native.html"), epub_filepath=epub_filepath) as sink:
+            for name, root in documents:
+                sink.add_document(name, root)
+        print(f"native: {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,48 @@
+"""
+Check that process_tree scales linearly on wide, flat documents (as produced by TXT/HTML conversions).
+
+Usage: python -m benchmarks.bench_process_tree_scaling --paragraphs 50000
+"""
+import time
+from xml.etree import ElementTree as ET
+
+import typer
+
+from furiganalyse.parsing import process_tree
+
+PARAGRAPH = "<p>吾輩は<ruby>猫<rt>ねこ</rt></ruby>である。</p>名前はまだ無い。"
+
+
+def generate_flat_document(paragraphs: int) -> str:
+    return (
+        '<html xmlns="http://www.w3.org/1999/xhtml"><head><title>吾輩は猫である</title></head><body>'
+        + PARAGRAPH * paragraphs
+        + "</body></html>"
+    )
+
+
+def measure(paragraphs: int, mode: str) -> float:
+    tree = ET.fromstring(generate_flat_document(paragraphs))
+    start = time.perf_counter()
+    process_tree(tree, mode)
+    return time.perf_counter() - start
+
+
+def main(paragraphs: int = 50_000, steps: int = 5, mode: str = "replace"):
+    # Warm up the reading cache, so that we only measure the tree rewrite
+    measure(10, mode)
+
+    print(f"{'paragraphs':>10} {'seconds':>9} {'us/paragraph':>13}")
+    per_paragraph = []
+    for step in range(1, steps + 1):
+        n = paragraphs * step // steps
+        elapsed = measure(n, mode)
+        per_paragraph.append(elapsed / n)
+        print(f"{n:>10} {elapsed:>9.3f} {elapsed / n * 1e6:>13.2f}")
+
+    # Linear cost means a flat cost per paragraph
+    print(f"cost per paragraph, largest / smallest document: {per_paragraph[-1] / per_paragraph[0]:.2f}")
+
+
+if __name__ == "__main__":
+    typer.run(main)
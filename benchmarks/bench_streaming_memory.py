@@ -0,0 +1,69 @@
+"""
+Compare the peak memory (RSS) of the tree and streaming modes on a large, flat XHTML file.
+
+Each mode runs in a fresh process, so that the peaks do not add up.
+Usage: python -m benchmarks.bench_streaming_memory --paragraphs 200000
+"""
+import io
+import multiprocessing
+import os
+import resource
+import time
+import zipfile
+from tempfile import TemporaryDirectory
+
+import typer
+
+from furiganalyse.epub_format import process_epub_archive
+from furiganalyse.params import FuriganaMode
+
+PARAGRAPH = "<p>吾輩は<ruby>猫<rt>ねこ</rt></ruby>である。名前はまだ無い。</p>\n"
+
+
+def write_flat_document(filepath: str, paragraphs: int):
+    """
+    EPUB archive with a single XHTML file.
+    """
+    with zipfile.ZipFile(filepath, "w", compression=zipfile.ZIP_DEFLATED) as zip_out, \
+            zip_out.open("OEBPS/book.xhtml", "w") as raw_fd, io.TextIOWrapper(raw_fd, encoding="utf-8") as fd:
+        fd.write('<html xmlns="http://www.w3.org/1999/xhtml"><head><title>吾輩は猫である</title></head><body>\n')
+        for _ in range(paragraphs):
+            fd.write(PARAGRAPH)
+        fd.write("</body></html>")
+
+
+def run(folder: str, streaming: bool, queue: multiprocessing.Queue):
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    process_epub_archive(
+        os.path.join(folder, "book.epub"), os.path.join(folder, "output.epub"), FuriganaMode.replace,
+        streaming=streaming,
+    )
+    elapsed = time.perf_counter() - start
+    queue.put((baseline, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, elapsed))
+
+
+def main(paragraphs: int = 200_000):
+    context = multiprocessing.get_context("spawn")
+    for streaming in (False, True):
+        with TemporaryDirectory() as td:
+            write_flat_document(os.path.join(td, "book.epub"), paragraphs)
+            with zipfile.ZipFile(os.path.join(td, "book.epub")) as zip_in:
+                size_mb = zip_in.getinfo("OEBPS/book.xhtml").file_size / 1e6
+
+            queue = context.Queue()
+            process = context.Process(target=run, args=(td, streaming, queue))
+            process.start()
+            baseline, peak, elapsed = queue.get()
+            process.join()
+
+        mode = "streaming" if streaming else "tree"
+        # ru_maxrss is in kilobytes on Linux
+        print(
+            f"{mode:>9}: {size_mb:.1f} MB document, peak RSS {peak / 1024:.1f} MB "
+            f"(+{(peak - baseline) / 1024:.1f} MB over imports), {elapsed:.2f}s"
+        )
+
+
+if __name__ == "__main__":
+    typer.run(main)
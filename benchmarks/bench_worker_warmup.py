@@ -0,0 +1,66 @@
+"""
+Compare the latency of the first job of a fresh worker process, with and without the warm up of the web app:
+without it, the job also pays for importing MeCab, loading its dictionary and the word list.
+
+Each run uses a new pool of spawned processes, so that nothing is inherited from this process.
+Usage: python -m benchmarks.bench_worker_warmup --runs 3 --paragraphs 200
+"""
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures.process import ProcessPoolExecutor
+from tempfile import TemporaryDirectory
+
+import typer
+
+from furiganalyse.__main__ import convert_book
+from furiganalyse.params import FuriganaMode, OutputFormat
+from furiganalyse.warmup import init_app_worker, warm_up_pool
+
+PARAGRAPH = "吾輩は猫である。名前はまだ無い。どこで生れたかとんと見当がつかぬ。\n"
+
+
+def run_job(folder: str, known_words_list: str):
+    convert_book(
+        os.path.join(folder, "book.txt"),
+        os.path.join(folder, "book.epub"),
+        furigana_mode=FuriganaMode.add,
+        output_format=[OutputFormat.epub],
+        known_words_list=known_words_list,
+    )
+
+
+def measure(folder: str, known_words_list: str, warm: bool) -> float:
+    """
+    Seconds from the submission of the first job of a fresh pool to its result.
+    """
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(
+        max_workers=1, mp_context=context, initializer=init_app_worker if warm else None
+    ) as executor:
+        if warm:
+            asyncio.run(warm_up_pool(executor, 1))
+        start = time.perf_counter()
+        executor.submit(run_job, folder, known_words_list).result()
+        return time.perf_counter() - start
+
+
+def main(runs: int = 3, paragraphs: int = 200, known_words_list: str = "JLPT_N5"):
+    with TemporaryDirectory() as td:
+        with open(os.path.join(td, "book.txt"), "w", encoding="utf-8") as fd:
+            fd.write(PARAGRAPH * paragraphs)
+
+        print(f"{'run':>4} {'cold (s)':>9} {'warm (s)':>9}")
+        colds, warms = [], []
+        for run in range(1, runs + 1):
+            colds.append(measure(td, known_words_list, warm=False))
+            warms.append(measure(td, known_words_list, warm=True))
+            print(f"{run:>4} {colds[-1]:>9.3f} {warms[-1]:>9.3f}")
+
+    cold, warm = min(colds), min(warms)
+    print(f"first job latency, best of {runs}: cold {cold:.3f}s, warm {warm:.3f}s, saved {cold - warm:.3f}s")
+
+
+if __name__ == "__main__":
+    typer.run(main)
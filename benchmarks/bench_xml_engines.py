@@ -0,0 +1,85 @@
+"""
+Compare the stdlib and lxml XML engines on the same EPUB corpus, and check that their outputs are equivalent.
+
+Usage: python -m benchmarks.bench_xml_engines book1.epub book2.epub ...
+Without EPUB files, a synthetic book is generated.
+"""
+import os
+import time
+import zipfile
+from tempfile import TemporaryDirectory
+from typing import List, Optional
+from xml.etree import ElementTree as ET
+
+import typer
+
+from furiganalyse.parsing import process_tree
+from furiganalyse.xml_engine import LxmlEngine, StdlibEngine
+
+CHAPTER = (
+    '<html xmlns="http://www.w3.org/1999/xhtml"><head><title>第{0}章</title></head><body>'
+    + "<p>吾輩は<ruby>猫<rt>ねこ</rt></ruby>である。<span>名前</span>はまだ無い。</p>\n" * 2000
+    + "</body></html>"
+)
+
+
+def write_synthetic_epub(filepath: str, chapters: int = 20):
+    with zipfile.ZipFile(filepath, "w") as zip_out:
+        for i in range(chapters):
+            zip_out.writestr(f"OEBPS/chapter{i}.xhtml", CHAPTER.format(i))
+
+
+def process_corpus(engine, folders: List[str], outputfolder: str) -> float:
+    elapsed = 0.0
+    for i, folder in enumerate(folders):
+        for root, _, files in os.walk(folder):
+            for file in sorted(files):
+                if os.path.splitext(file)[1] not in {".html", ".xhtml"}:
+                    continue
+                start = time.perf_counter()
+                tree = engine.parse(os.path.join(root, file))
+                process_tree(tree, "replace")
+                outputfile = os.path.join(outputfolder, f"{i}_{os.path.relpath(root, folder).replace(os.sep, '_')}_{file}")
+                tree.write(outputfile, encoding="utf-8")
+                elapsed += time.perf_counter() - start
+    return elapsed
+
+
+def main(epubs: Optional[List[str]] = typer.Argument(None)):
+    with TemporaryDirectory() as td:
+        if not epubs:
+            epubs = [os.path.join(td, "synthetic.epub")]
+            write_synthetic_epub(epubs[0])
+
+        folders = []
+        for i, epub in enumerate(epubs):
+            folder = os.path.join(td, f"book{i}")
+            with zipfile.ZipFile(epub) as zip_ref:
+                zip_ref.extractall(folder)
+            folders.append(folder)
+
+        engines = [StdlibEngine(), LxmlEngine()]
+        # Warm up the reading cache, so that we only measure the XML work
+        process_corpus(engines[0], folders, td)
+
+        outputfolders = {}
+        for engine in engines:
+            outputfolders[engine.name] = os.path.join(td, f"output_{engine.name}")
+            os.mkdir(outputfolders[engine.name])
+            elapsed = process_corpus(engine, folders, outputfolders[engine.name])
+            print(f"{engine.name:>7}: {elapsed:.2f}s")
+
+        mismatches = 0
+        for file in sorted(os.listdir(outputfolders["stdlib"])):
+            canonical = [
+                ET.canonicalize(from_file=os.path.join(outputfolders[engine.name], file), rewrite_prefixes=True)
+                for engine in engines
+            ]
+            if canonical[0] != canonical[1]:
+                mismatches += 1
+                print(f"Outputs differ for {file}")
+        print(f"{mismatches} mismatching documents")
+
+
+if __name__ == "__main__":
+    typer.run(main)
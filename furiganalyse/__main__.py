@@ -1,18 +1,22 @@
 import logging
 import os
-import zipfile
+import time
+from contextlib import nullcontext
 from tempfile import TemporaryDirectory
-from typing import Optional
+from typing import Dict, List, Optional, Union
 
-import capybre
 import pypandoc
 import typer
 
-from furiganalyse.apkg_format import generate_anki_deck
-from furiganalyse.epub_format import process_epub_file, write_epub_archive
+from furiganalyse.apkg_format import AnkiDeckSink
+from furiganalyse.conversion import convert_ebook
+from furiganalyse.epub_format import TXT_OUTPUT_FORMATS, ProcessingStats, process_epub_archive
+from furiganalyse.html_format import HtmlBookSink
 from furiganalyse.known_words import load_word_list, load_word_list_from_path
-from furiganalyse.params import FuriganaMode, OutputFormat, WritingMode
-from furiganalyse.txt_format import write_txt_archive, concat_txt_files
+from furiganalyse.params import OUTPUT_FORMAT_TO_EXTENSION, FuriganaMode, OutputFormat, WritingMode
+from furiganalyse.progress import ProgressReporter, Stage
+from furiganalyse.txt_format import MultiTxtSink, SingleTxtSink, TxtArchiveSink, TxtSink
+from furiganalyse.txt_input import process_txt_file
 
 logging.basicConfig(level=logging.INFO)
 
@@ -22,12 +26,44 @@ def main(
     inputfile: str,
     outputfile: str,
     furigana_mode: FuriganaMode = FuriganaMode.add,
-    output_format: OutputFormat = OutputFormat.epub,
+    output_format: Optional[List[OutputFormat]] = None,
     writing_mode: Optional[WritingMode] = None,
     known_words_list: Optional[str] = None,
     custom_word_list_path: Optional[str] = None,
     custom_word_list_limit: Optional[int] = None,
+    streaming: bool = False,
+    workers: int = 1,
 ):
+    """
+    Convert the input file to one or many output formats (EPUB by default), annotating it only once.
+    """
+    convert_book(
+        inputfile, outputfile, furigana_mode, output_format, writing_mode, known_words_list,
+        custom_word_list_path, custom_word_list_limit, streaming, workers,
+    )
+
+
+def convert_book(
+    inputfile: str,
+    outputfile: str,
+    furigana_mode: FuriganaMode = FuriganaMode.add,
+    output_format: Optional[List[OutputFormat]] = None,
+    writing_mode: Optional[WritingMode] = None,
+    known_words_list: Optional[str] = None,
+    custom_word_list_path: Optional[str] = None,
+    custom_word_list_limit: Optional[int] = None,
+    streaming: bool = False,
+    workers: int = 1,
+    progress: Optional[ProgressReporter] = None,
+) -> ProcessingStats:
+    """
+    Convert the input file to one or many output formats (EPUB by default), annotating it only once.
+    With many output formats, the output files are named after `outputfile`, see `get_output_filepaths`.
+    The progress of each stage is reported to `progress`, if set.
+    """
+    output_formats = get_output_formats(output_format)
+    output_filepaths = get_output_filepaths(outputfile, output_formats)
+
     # Load the known words list if specified (custom path takes precedence)
     exclude_words = None
     if custom_word_list_path:
@@ -41,39 +77,129 @@ def main(
 
     with TemporaryDirectory() as td:
         filename, ext = os.path.splitext(os.path.basename(inputfile))
-        inputfile = convert_inputfile_if_not_epub(inputfile, ext, td)
+        conversion_time = 0.0
+        if ext != ".txt":
+            if progress is not None and ext != ".epub":
+                progress.start_stage(Stage.converting_input)
+            start = time.perf_counter()
+            inputfile = convert_inputfile_if_not_epub(inputfile, ext, td)
+            conversion_time += time.perf_counter() - start
+
+        txt_formats = [output_format for output_format in output_formats if output_format in TXT_OUTPUT_FORMATS]
+        # The MOBI and AZW3 outputs are converted from the annotated EPUB
+        epub_formats = [
+            output_format for output_format in output_formats
+            if output_format not in TXT_OUTPUT_FORMATS and output_format != OutputFormat.html
+        ]
+        # Not tmp.epub, which is the input file once converted to EPUB
+        epub_filepath = output_filepaths.get(OutputFormat.epub, os.path.join(td, "annotated.epub"))
+
+        # The text and HTML outputs are written as the documents are annotated
+        with open_txt_sink(txt_formats, output_filepaths, deck_name=filename) or nullcontext() as txt_sink, \
+                open_html_sink(output_formats, output_filepaths, inputfile, ext, title=filename) or nullcontext() \
+                as html_sink:
+            if progress is not None:
+                progress.start_stage(Stage.annotating)
+            start = time.perf_counter()
+            if ext == ".txt":
+                # Plain text is read and annotated line by line, without converting it to EPUB with calibre
+                logging.info("Processing the text file ...")
+                stats = process_txt_file(
+                    inputfile, furigana_mode, filename,
+                    epub_filepath=epub_filepath if epub_formats else None,
+                    txt_sink=txt_sink,
+                    writing_mode=writing_mode,
+                    exclude_words=exclude_words,
+                    progress=progress,
+                    html_sink=html_sink,
+                )
+            else:
+                # The EPUB archive is rewritten directly (if needed), the untouched files are copied as they are,
+                # and the annotated documents are pushed into the text and HTML outputs
+                logging.info("Processing the archive ...")
+                stats = process_epub_archive(
+                    inputfile, epub_filepath if epub_formats else None, furigana_mode, writing_mode, exclude_words,
+                    streaming, workers, txt_sink=txt_sink, html_sink=html_sink, progress=progress,
+                )
+            stats.annotation_time = time.perf_counter() - start
+            stats.conversion_time = conversion_time
+
+        other_formats = [output_format for output_format in epub_formats if output_format != OutputFormat.epub]
+        if progress is not None and other_formats:
+            progress.start_stage(Stage.writing_output)
+        # The EPUB is already written by process_epub_archive or process_txt_file
+        for index, output_format in enumerate(other_formats):
+            logging.info("Creating the %s output file ...", output_format.value)
+            outputfile = output_filepaths[output_format]
+            if output_format in {OutputFormat.mobi, OutputFormat.azw3}:
+                stats.conversion_time += convert_ebook(epub_filepath, outputfile)
+            else:
+                raise ValueError("Invalid writing mode")
+            if progress is not None:
+                progress.advance(index + 1, len(other_formats))
+
+    logging.info("Annotation: %.3fs, conversions: %.3fs", stats.annotation_time, stats.conversion_time)
+    return stats
+
+
+def open_txt_sink(
+    txt_formats: List[OutputFormat], output_filepaths: Dict[OutputFormat, str], deck_name: str
+) -> Optional[TxtSink]:
+    """
+    Sink writing the text of the annotated documents to the output file of each text format, if any.
+    """
+    sinks = []
+    for output_format in txt_formats:
+        outputfile = output_filepaths[output_format]
+        if output_format == OutputFormat.many_txt:
+            sinks.append(TxtArchiveSink(outputfile))
+        elif output_format == OutputFormat.single_txt:
+            sinks.append(SingleTxtSink(outputfile))
+        elif output_format == OutputFormat.apkg:
+            sinks.append(AnkiDeckSink(deck_name, outputfile))
+    if not sinks:
+        return None
+    return sinks[0] if len(sinks) == 1 else MultiTxtSink(sinks)
 
-        unzipped_input_fpath = os.path.join(td, "unzipped")
 
-        logging.info("Extracting the archive ...")
-        with zipfile.ZipFile(inputfile, 'r') as zip_ref:
-            zip_ref.extractall(unzipped_input_fpath)
+def open_html_sink(
+    output_formats: List[OutputFormat], output_filepaths: Dict[OutputFormat, str], inputfile: str, ext: str,
+    title: str,
+) -> Optional[HtmlBookSink]:
+    """
+    Sink writing the annotated documents to the HTML output file, if requested, in the reading order of the input
+    EPUB (with its images), or in the order they come for plain text.
+    """
+    if OutputFormat.html not in output_formats:
+        return None
+    if ext == ".txt":
+        return HtmlBookSink(output_filepaths[OutputFormat.html], title=title, language="ja")
+    return HtmlBookSink(output_filepaths[OutputFormat.html], epub_filepath=inputfile)
 
-        logging.info("Processing the files ...")
-        process_epub_file(
-            unzipped_input_fpath, furigana_mode, writing_mode, output_format, exclude_words
-        )
 
-        logging.info("Creating the output file ...")
-        if output_format == OutputFormat.epub:
-            write_epub_archive(unzipped_input_fpath, outputfile)
-        elif output_format in {OutputFormat.mobi, OutputFormat.azw3}:
-            tmpfilepath = os.path.join(td, "tmp.epub")
-            write_epub_archive(unzipped_input_fpath, tmpfilepath)
-            capybre.convert(tmpfilepath, outputfile, as_ext=output_format.value, suppress_output=False)
-        elif output_format == OutputFormat.many_txt:
-            write_txt_archive(unzipped_input_fpath, outputfile)
-        elif output_format == OutputFormat.single_txt:
-            concat_txt_files(unzipped_input_fpath, outputfile)
-        elif output_format == OutputFormat.apkg:
-            deck_name = filename
-            generate_anki_deck(unzipped_input_fpath, deck_name, outputfile)
-        elif output_format == OutputFormat.html:
-            tmpfilepath = os.path.join(td, "tmp.epub")
-            write_epub_archive(unzipped_input_fpath, tmpfilepath)
-            pypandoc.convert_file(tmpfilepath, 'html', outputfile=outputfile)
-        else:
-            raise ValueError("Invalid writing mode")
+def get_output_formats(output_format: Union[None, OutputFormat, List[OutputFormat]]) -> List[OutputFormat]:
+    """
+    Requested output formats, without duplicates, EPUB if none.
+    """
+    if output_format is None:
+        return [OutputFormat.epub]
+    if isinstance(output_format, (str, OutputFormat)):
+        return [OutputFormat(output_format)]
+    return list(dict.fromkeys(OutputFormat(of) for of in output_format)) or [OutputFormat.epub]
+
+
+def get_output_filepaths(outputfile: str, output_formats: List[OutputFormat]) -> Dict[OutputFormat, str]:
+    """
+    Path of the output file of each format: `outputfile` itself with a single format,
+    otherwise `outputfile` with the extension of each format (e.g. book.epub, book.apkg).
+    """
+    if len(output_formats) == 1:
+        return {output_formats[0]: outputfile}
+    base = os.path.splitext(outputfile)[0]
+    return {
+        output_format: base + OUTPUT_FORMAT_TO_EXTENSION[output_format]
+        for output_format in output_formats
+    }
 
 
 def convert_inputfile_if_not_epub(inputfile, ext, td):
@@ -96,7 +222,7 @@ def convert_inputfile_if_not_epub(inputfile, ext, td):
     if ext == ".html":
         pypandoc.convert_file(inputfile, 'epub', outputfile=tmpfilepath)
     else:
-        capybre.convert(inputfile, tmpfilepath, as_ext='epub', suppress_output=False)
+        convert_ebook(inputfile, tmpfilepath)
     return tmpfilepath
 
 
@@ -1,59 +1,265 @@
-import random
-from typing import Iterator
+"""
+Anki deck output, with a card per sentence of the book, and the first word of the sentence
+that got a reading (e.g. the first word not in the known words list) as target word.
+
+The target word is the MeCab token holding the first ruby of the sentence, with its surface form, reading
+and base form (e.g. 言った → 言っ, いっ, 言う), as the ruby itself only covers the kanji of the word.
+
+The notes are written into the SQLite collection of the deck by batches, as the sentences come,
+so that memory stays bounded whatever the length of the book. The model and deck IDs are derived
+from their names, so converting the same book again gives the same deck.
+"""
+
+import base64
+import bisect
+import hashlib
+import itertools
+import json
+import logging
+import os
+import re
+import sqlite3
+import tempfile
+import time
+import zipfile
+from collections import deque
+from functools import lru_cache
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple
 
 import genanki
+from genanki.apkg_col import APKG_COL
+from genanki.apkg_schema import APKG_SCHEMA
+
+from furiganalyse.archive import COMPRESSION_LEVEL
+from furiganalyse.parsing import Paragraph, format_tokens
+from furiganalyse.txt_format import TxtSink
+
+MODEL_NAME = 'Sentence cards (furiganalyse)'
+
+MODEL_FIELDS = ['Sentence', 'Word', 'Reading', 'Base form']
+
+# Number of notes written to the collection per transaction
+NOTES_BATCH_SIZE = 1000
+
+# Fields of the MeCab IPADIC features holding the base form and the reading (in katakana)
+BASE_FORM_FEATURE = 6
+READING_FEATURE = 7
+
+KATAKANA_TO_HIRAGANA = {code: code - 0x60 for code in range(ord("ァ"), ord("ヶ") + 1)}
 
-from furiganalyse.txt_format import iter_txt_lines
+# A sentence ends with its punctuation, and the closing quotes or brackets right after, or at the end of a line.
+# A closing quote alone does not end it, the quoted speech being part of the sentence (「はい」と言った).
+SENTENCE_PATTERN = re.compile(r".+?(?:[。！？!?]+[」』）〉》”’]*|\n|$)")
 
 
-def generate_anki_deck(unzipped_input_fpath: str, deck_name: str, anki_deck_filepath: str):
-    model_id = random.randrange(1 << 30, 1 << 31)
-    model = genanki.Model(
-        model_id,
-        'Sentence cards (furiganalyse)',
-        fields=[
-            {'name': 'Sentence'},
-            {'name': 'Word'},
-            {'name': 'Definition'},
-        ],
+def stable_id(name: str) -> int:
+    """
+    ID in the range used by Anki for models and decks, derived from a name.
+    """
+    digest = hashlib.sha256(name.encode("utf-8")).digest()
+    return (1 << 30) + int.from_bytes(digest[:4], "big") % (1 << 30)
+
+
+def sentence_guid(sentence: str) -> str:
+    """
+    GUID of the note of a sentence: re-importing the deck updates the notes instead of duplicating them.
+    """
+    return base64.b64encode(hashlib.sha256(sentence.encode("utf-8")).digest()[:9]).decode("ascii")
+
+
+class Word(NamedTuple):
+    surface: str
+    reading: str
+    base_form: str
+
+
+def create_model() -> genanki.Model:
+    return genanki.Model(
+        # Derived from the fields too, so that the notes of the decks with other fields are not mixed up
+        stable_id(MODEL_NAME + ":" + ",".join(MODEL_FIELDS)),
+        MODEL_NAME,
+        fields=[{'name': name} for name in MODEL_FIELDS],
         templates=[
             {
-                'name': 'Sentence to Word Definition',
+                'name': 'Sentence to Word',
                 'qfmt': '{{Sentence}}',
-                'afmt': '{{FrontSide}}<hr id="answer">{{Word}}<br>{{Definition}}',
+                'afmt': '{{FrontSide}}<hr id="answer">{{Word}}<br>{{Reading}}<br>{{Base form}}',
             },
         ])
 
-    deck_id = random.randrange(1 << 30, 1 << 31)
-    description = 'Deck generated with <a href="https://github.com/itsupera/furiganalyse">furiganalyse</a><br/>' \
-                  'If you can, please consider <a href="https://www.buymeacoffee.com/itsupera">donating</a> ' \
-                  'to support my work, thank you !'
-    deck = genanki.Deck(
-        deck_id,
-        deck_name,
-        description
-    )
-
-    package = genanki.Package(deck)
-    package.media_files = []
-
-    idx = 0
-    for line in iter_txt_lines(unzipped_input_fpath):
-        for sentence in extract_sentences(line):
-            note = genanki.Note(
-                model=model,
-                fields=[sentence, "", ""],
-                due=idx,
-            )
-            deck.add_note(note)
-            idx += 1
-
-    package.write_to_file(anki_deck_filepath)
+
+class AnkiDeckSink(TxtSink):
+    """
+    Anki deck with a card per sentence of the documents, identical sentences are only kept once.
+    The Word, Reading and Base form fields get the ones of the target word of the sentence, if any.
+    """
+
+    def __init__(self, deck_name: str, anki_deck_filepath: str):
+        self.anki_deck_filepath = anki_deck_filepath
+        self.model = create_model()
+        description = 'Deck generated with <a href="https://github.com/itsupera/furiganalyse">furiganalyse</a><br/>' \
+                      'If you can, please consider <a href="https://www.buymeacoffee.com/itsupera">donating</a> ' \
+                      'to support my work, thank you !'
+        self.deck = genanki.Deck(
+            stable_id(deck_name),
+            deck_name,
+            description
+        )
+
+        self.timestamp = time.time()
+        # Same scheme as genanki: note and card IDs are consecutive milliseconds from now
+        self.id_gen = itertools.count(int(self.timestamp * 1000))
+        self.due = 0
+        self.guids = set()
+        self.batch: List[List[str]] = []
+
+        output_folder = os.path.dirname(os.path.abspath(anki_deck_filepath))
+        fd, self.db_filepath = tempfile.mkstemp(suffix=".anki2", dir=output_folder)
+        os.close(fd)
+        self.conn = sqlite3.connect(self.db_filepath)
+        # The collection is a temporary file, rebuilt from scratch if anything goes wrong
+        self.conn.execute("PRAGMA journal_mode = OFF")
+        self.conn.execute("PRAGMA synchronous = OFF")
+        self.conn.executescript(APKG_SCHEMA)
+        self.conn.executescript(APKG_COL)
+        # Added to the default deck and model, as genanki does
+        decks, models = (json.loads(value) for value in self.conn.execute("SELECT decks, models FROM col").fetchone())
+        decks[str(self.deck.deck_id)] = self.deck.to_json()
+        models[str(self.model.model_id)] = self.model.to_json(self.timestamp, self.deck.deck_id)
+        self.conn.execute("UPDATE col SET decks = ?, models = ?", (json.dumps(decks), json.dumps(models)))
+        self.conn.commit()
+
+    def add_document(self, name: str, paragraphs: Iterable[Paragraph]):
+        for tokens in paragraphs:
+            for sentence, word in split_sentences(tokens):
+                self.add_note([sentence, *(word or ("", "", ""))])
+
+    def add_note(self, fields: List[str]):
+        self.batch.append(fields)
+        if len(self.batch) >= NOTES_BATCH_SIZE:
+            self._flush()
+
+    def close(self):
+        try:
+            self._flush()
+            self.conn.close()
+            with zipfile.ZipFile(
+                self.anki_deck_filepath, "w", zipfile.ZIP_DEFLATED, compresslevel=COMPRESSION_LEVEL
+            ) as zip_out:
+                zip_out.write(self.db_filepath, "collection.anki2")
+                zip_out.writestr("media", json.dumps({}))
+        finally:
+            os.remove(self.db_filepath)
+
+    def abort(self):
+        self.conn.close()
+        os.remove(self.db_filepath)
+
+    def _flush(self):
+        notes = []
+        cards = []
+        mod = int(self.timestamp)
+        for fields in self.batch:
+            guid = sentence_guid(fields[0])
+            if guid in self.guids:
+                continue
+            self.guids.add(guid)
+            note_id = next(self.id_gen)
+            notes.append((note_id, guid, self.model.model_id, mod, -1, "  ", "\x1f".join(fields), fields[0], 0, 0, ""))
+            cards.append((next(self.id_gen), note_id, self.deck.deck_id, 0, mod, -1, 0, 0, self.due,
+                          0, 0, 0, 0, 0, 0, 0, 0, ""))
+            self.due += 1
+        self.batch = []
+
+        with self.conn:
+            self.conn.executemany("INSERT INTO notes VALUES(?,?,?,?,?,?,?,?,?,?,?)", notes)
+            self.conn.executemany("INSERT INTO cards VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)", cards)
 
 
 def extract_sentences(line: str) -> Iterator[str]:
-    sentences = line.split("。")
-    for sentence in sentences:
-        sentence = sentence.lstrip().rstrip()
+    for sentence, _ in split_sentences(((line,),)):
+        yield sentence
+
+
+def split_sentences(tokens: Paragraph) -> Iterator[Tuple[str, Optional[Word]]]:
+    """
+    Sentences of a paragraph, with the readings in parentheses, and the word holding their first ruby.
+    """
+    # Rubies, by their offset in the text with the readings and in the text alone
+    rubies = deque()
+    parts = []
+    offset = 0
+    text_offset = 0
+    for token in tokens:
+        formatted = format_tokens((token,))
+        if len(token) == 2 and token[0]:
+            rubies.append((offset, text_offset, token))
+        parts.append(formatted)
+        offset += len(formatted)
+        text_offset += len(token[0])
+
+    # Tokenized once for all the sentences of the paragraph, if any has a target word
+    morphemes = None
+    for match in SENTENCE_PATTERN.finditer("".join(parts)):
+        while rubies and rubies[0][0] < match.start():
+            rubies.popleft()
+        word = None
+        if rubies and rubies[0][0] < match.end():
+            _, text_offset, (kanji, reading) = rubies[0]
+            if morphemes is None:
+                morphemes = tokenize_morphemes("".join(token[0] for token in tokens))
+            word = find_word(morphemes, text_offset) or Word(kanji, reading, kanji)
+        sentence = match.group().strip()
         if sentence:
-            yield sentence
\ No newline at end of file
+            yield sentence, word
+
+
+@lru_cache(maxsize=1)
+def get_tagger():
+    """
+    MeCab tagger, kept for the life of the process (the nodes it returns belong to it).
+    """
+    try:
+        import MeCab
+    except ImportError:
+        logging.warning("MeCab is not available, the Anki cards only get the kanji of their target word")
+        return None
+    return MeCab.Tagger()
+
+
+def tokenize_morphemes(text: str) -> List[Tuple[int, int, Word]]:
+    """
+    MeCab tokens of the text, with their start and end offsets, sorted by offset.
+    """
+    tagger = get_tagger()
+    if tagger is None:
+        return []
+    morphemes = []
+    offset = 0
+    node = tagger.parseToNode(text)
+    while node is not None:
+        surface = node.surface
+        # Skips the beginning and end of sentence nodes, and the whitespace MeCab leaves out
+        start = text.find(surface, offset) if surface else -1
+        if start >= 0:
+            features = node.feature.split(",")
+            reading = features[READING_FEATURE] if len(features) > READING_FEATURE else ""
+            base_form = features[BASE_FORM_FEATURE] if len(features) > BASE_FORM_FEATURE else "*"
+            offset = start + len(surface)
+            morphemes.append((start, offset, Word(
+                surface,
+                reading.translate(KATAKANA_TO_HIRAGANA) if reading not in {"", "*"} else surface,
+                base_form if base_form != "*" else surface,
+            )))
+        node = node.next
+    return morphemes
+
+
+def find_word(morphemes: List[Tuple[int, int, Word]], offset: int) -> Optional[Word]:
+    """
+    Token holding the character at `offset`, if any.
+    """
+    index = bisect.bisect_right(morphemes, offset, key=lambda morpheme: morpheme[0]) - 1
+    if index >= 0 and offset < morphemes[index][1]:
+        return morphemes[index][2]
+    return None
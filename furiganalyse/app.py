@@ -5,31 +5,39 @@ import os
 import random
 import shutil
 import string
+import time
 import traceback
 from concurrent.futures.process import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
-from typing import Dict
-from uuid import UUID, uuid4
+from typing import Dict, List, Optional, Tuple, Union
+from uuid import UUID
 
 from fastapi import BackgroundTasks, File, Form, FastAPI, Request, status, UploadFile
-from fastapi.responses import HTMLResponse, RedirectResponse, FileResponse, Response, JSONResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, RedirectResponse, FileResponse, Response, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from pydantic import BaseModel, Field
 from starlette.middleware.cors import CORSMiddleware
 
-from furiganalyse.__main__ import main, SUPPORTED_INPUT_EXTS
-from furiganalyse.known_words import list_available_word_lists
-from furiganalyse.params import OutputFormat, FuriganaMode, WritingMode
+from furiganalyse.__main__ import convert_book, get_output_filepaths, get_output_formats, SUPPORTED_INPUT_EXTS
+from furiganalyse.epub_format import ProcessingStats
+from furiganalyse.job_store import Job, get_job_store
+from furiganalyse.known_words import list_available_word_lists, word_list_digest
+from furiganalyse.output_ledger import folder_size, get_output_ledger
+from furiganalyse.params import OUTPUT_FORMAT_TO_EXTENSION, OutputFormat, FuriganaMode, WritingMode
+from furiganalyse.progress import Progress, ProgressReporter
+from furiganalyse.result_cache import CachedResult, get_result_cache, job_cache_key
+from furiganalyse.scheduler import QueueFull, estimate_cost, get_scheduler
+from furiganalyse.uploads import CHUNK_SIZE, RequestSizeLimit, UploadTooLarge, save_upload
+from furiganalyse.warmup import init_app_worker, warm_up_pool
 
 
-class Job(BaseModel):
-    uid: UUID = Field(default_factory=uuid4)
-    status: str = "in_progress"
-    result: str = None
+# Shared by all the worker processes, so that a job can be polled from any of them
+job_store = get_job_store()
 
-
-jobs: Dict[UUID, Job] = {}
+# Shared by all the worker processes like the jobs, so that identical jobs are found whichever process gets them
+result_cache = get_result_cache()
 
 
 templates = Jinja2Templates(directory="./furiganalyse/templates")
@@ -49,23 +57,49 @@ app.mount("/assets", StaticFiles(directory="assets"), name="assets")
 OUTPUT_FOLDER = '/tmp/furiganalysed/'
 Path(OUTPUT_FOLDER).mkdir(exist_ok=True)
 
+# Job folders unused for this long are removed
+OUTPUT_TTL = float(os.environ.get("FURIGANALYSE_OUTPUT_TTL_IN_HOURS", 24)) * 3600
+
+# Seconds between two cleanups of the output folder
+CLEANUP_INTERVAL = float(os.environ.get("FURIGANALYSE_CLEANUP_INTERVAL_IN_SECONDS", 60))
+
+# Sizes of the job folders, shared by all the worker processes
+output_ledger = get_output_ledger()
+
+# Number of processes working on the files of each job, on top of the process running the job
+WORKERS_PER_JOB = int(os.environ.get("FURIGANALYSE_WORKERS_PER_JOB", 1))
+
+# Limits the jobs running at once over all the worker processes
+scheduler = get_scheduler(WORKERS_PER_JOB)
+
+# Seconds between two checks of the status of a job followed by /jobs/{uid}/events
+EVENTS_INTERVAL = 1.0
+
+# Seconds without event after which a comment is sent, to keep the connection open through proxies
+EVENTS_KEEPALIVE = 15.0
+
+# Maximum size for book uploads
+MAX_UPLOAD_SIZE = int(os.environ.get("FURIGANALYSE_MAX_UPLOAD_SIZE_IN_MB", 1024)) * 1024 * 1024
+
 # Maximum size for custom word list uploads (1MB)
 MAX_WORD_LIST_SIZE = 1 * 1024 * 1024
 
+# Rejected before their uploads are received, with room for the other fields of the form
+app.add_middleware(RequestSizeLimit, max_size=MAX_UPLOAD_SIZE + MAX_WORD_LIST_SIZE + 1024 * 1024)
 
-def validate_word_list_file(contents: bytes) -> tuple[bool, str]:
+
+def validate_word_list_file(path: str) -> tuple[bool, str]:
     """
-    Validate a custom word list file.
+    Validate a custom word list file, whose size was checked when it was uploaded.
 
     Returns:
         A tuple of (is_valid, error_message).
         If valid, error_message is empty.
     """
-    if len(contents) > MAX_WORD_LIST_SIZE:
-        return False, f"Word list file too large. Maximum size is {MAX_WORD_LIST_SIZE // 1024}KB."
-
     try:
-        contents.decode("utf-8")
+        with open(path, encoding="utf-8") as fd:
+            while fd.read(CHUNK_SIZE):
+                pass
     except UnicodeDecodeError:
         return False, "Word list file must be UTF-8 encoded text."
 
@@ -90,42 +124,50 @@ async def task_handler(
     file: UploadFile,
     furigana_mode: str = Form(),
     writing_mode: str = Form(),
-    of: str = Form(),
+    of: List[str] = Form(),
     known_words_list: str = Form(default=""),
     custom_word_list: UploadFile = File(default=None),
     custom_word_list_limit: int = Form(default=0),
+    streaming: bool = Form(default=False),
     redirect: bool = Form(default=True),
 ):
+    # The stores are shared by all the worker processes and may have to wait for their lock,
+    # so they are only used from the threadpool, like the files
     new_task = Job()
-    jobs[new_task.uid] = new_task
-
-    # Free up some space if necessary
-    cleanup_output_folder()
-
-    # Write uploaded file to a temporary file
+    # The uploads are written to the folder of the job, which is removed if they are not processed
     task_folder = os.path.join(OUTPUT_FOLDER, str(new_task.uid))
-    Path(task_folder).mkdir(exist_ok=True)
+    await run_in_threadpool(create_task, new_task, task_folder)
     # Sanitize filename to prevent path traversal attacks
     safe_filename = os.path.basename(file.filename)
     if not safe_filename:
         safe_filename = "uploaded_file"
-    tmpfile = os.path.join(task_folder, safe_filename)
-    contents = file.file.read()
-    with open(tmpfile, 'wb') as f:
-        f.write(contents)
+    try:
+        upload = await run_in_threadpool(
+            save_upload, file.file, os.path.join(task_folder, safe_filename), MAX_UPLOAD_SIZE
+        )
+    except UploadTooLarge as e:
+        await run_in_threadpool(discard_task, new_task.uid, task_folder)
+        return JSONResponse(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, content={"error": str(e)})
 
     # Handle custom word list upload
-    custom_word_list_path = None
+    word_list_upload = None
     if known_words_list == "__custom__":
         # Clear the special marker value
         known_words_list = ""
         if custom_word_list and custom_word_list.filename:
-            word_list_contents = custom_word_list.file.read()
-            is_valid, error_message = validate_word_list_file(word_list_contents)
+            try:
+                word_list_upload = await run_in_threadpool(
+                    save_upload,
+                    custom_word_list.file,
+                    os.path.join(task_folder, "custom_word_list.txt"),
+                    MAX_WORD_LIST_SIZE,
+                )
+                is_valid, error_message = await run_in_threadpool(validate_word_list_file, word_list_upload.path)
+            except UploadTooLarge:
+                is_valid = False
+                error_message = f"Word list file too large. Maximum size is {MAX_WORD_LIST_SIZE // 1024}KB."
             if not is_valid:
-                # Clean up task folder on validation error
-                shutil.rmtree(task_folder)
-                del jobs[new_task.uid]
+                await run_in_threadpool(discard_task, new_task.uid, task_folder)
                 if redirect:
                     return JSONResponse(
                         status_code=status.HTTP_400_BAD_REQUEST,
@@ -134,22 +176,43 @@ async def task_handler(
                 else:
                     return {"error": error_message}
 
-            custom_word_list_path = os.path.join(task_folder, "custom_word_list.txt")
-            with open(custom_word_list_path, 'wb') as f:
-                f.write(word_list_contents)
-
-    background_tasks.add_task(
-        start_furiganalyse_task,
-        new_task.uid,
-        task_folder,
-        safe_filename,
-        of,
+    cache_key = job_cache_key(
+        upload.digest,
+        sorted(set(of)),
         furigana_mode,
         writing_mode,
-        known_words_list,
-        custom_word_list_path,
-        custom_word_list_limit,
+        get_word_list_digest(known_words_list, word_list_upload.digest if word_list_upload else None),
+        custom_word_list_limit if word_list_upload is not None else 0,
+        streaming,
     )
+    if not await run_in_threadpool(find_identical_job, new_task, cache_key, task_folder):
+        try:
+            await run_in_threadpool(
+                scheduler.submit, new_task.uid, estimate_cost(upload.size, os.path.splitext(safe_filename)[1])
+            )
+        except QueueFull as e:
+            logging.warning(f"Rejecting job {new_task.uid}: {e}")
+            await run_in_threadpool(reject_task, new_task.uid, cache_key, task_folder)
+            return JSONResponse(status_code=status.HTTP_429_TOO_MANY_REQUESTS, content={"error": str(e)})
+
+        await run_in_threadpool(
+            output_ledger.update, new_task.uid, upload.size + (word_list_upload.size if word_list_upload else 0)
+        )
+        custom_word_list_path = word_list_upload.path if word_list_upload else None
+        background_tasks.add_task(
+            start_furiganalyse_task,
+            new_task.uid,
+            cache_key,
+            task_folder,
+            safe_filename,
+            of,
+            furigana_mode,
+            writing_mode,
+            known_words_list,
+            custom_word_list_path,
+            custom_word_list_limit,
+            streaming,
+        )
 
     if redirect:
         return RedirectResponse(f"/jobs/{new_task.uid}", status_code=status.HTTP_302_FOUND)
@@ -157,6 +220,41 @@ async def task_handler(
         return {"uid": new_task.uid}
 
 
+def create_task(job: Job, task_folder: str):
+    job_store.put(job)
+    output_ledger.add(job.uid)
+    Path(task_folder).mkdir(exist_ok=True)
+
+
+def find_identical_job(job: Job, cache_key: str, task_folder: str) -> bool:
+    """
+    Give the job the result of an identical job, or attach it to an identical job in progress,
+    returns False if there is none: the job must then be processed.
+    """
+    cached = result_cache.get(cache_key)
+    if cached is not None and job_store.get(cached.uid) is None:
+        # Its output was removed by a cleanup in the meantime
+        result_cache.invalidate(cached.uid)
+        cached = None
+    if cached is not None:
+        logging.info(f"Job {job.uid} is identical to job {cached.uid}, reusing its result")
+        remove_task_folder(job.uid, task_folder)
+        job.status = "complete"
+        job.result = cached.result
+        job.results = cached.results
+        job.processed_files = cached.processed_files
+        job.skipped_files = cached.skipped_files
+        job_store.put(job, source=cached.uid)
+        # Keep the popular results from being cleaned up first
+        output_ledger.touch(cached.uid)
+        return True
+    if result_cache.attach(cache_key, job.uid):
+        logging.info(f"Job {job.uid} is identical to a job in progress, waiting for its result")
+        remove_task_folder(job.uid, task_folder)
+        return True
+    return False
+
+
 @app.get("/jobs/{uid}", response_class=HTMLResponse)
 def get_download(request: Request, uid: UUID):
     return templates.TemplateResponse("download.html", {"request": request, "uid": uid})
@@ -165,47 +263,128 @@ def get_download(request: Request, uid: UUID):
 def furiganalyse_task(
     task_folder: Path,
     filename: str,
-    output_format: str,
+    output_format: Union[str, List[str]],
     furigana_mode: str,
     writing_mode: str,
     known_words_list: str = "",
     custom_word_list_path: str = None,
     custom_word_list_limit: int = 0,
-) -> str:
+    streaming: bool = False,
+    uid: UUID = None,
+) -> Tuple[Dict[str, str], ProcessingStats]:
+    """
+    Run the conversion job, returns the encoded path of the output file of each requested format.
+    The progress of the job `uid` is recorded in the job store as it goes.
+    """
     input_filepath = os.path.join(task_folder, filename)
-    output_filename = generate_output_filename(filename, output_format)
+    output_formats = get_output_formats(output_format)
+    output_filename = generate_output_filename(filename, output_formats[0])
     output_filepath = os.path.join(task_folder, output_filename)
-    path_hash = encode_filepath(output_filepath)
+    path_hashes = {
+        output_format.value: encode_filepath(filepath)
+        for output_format, filepath in get_output_filepaths(output_filepath, output_formats).items()
+    }
 
     try:
-        main(
+        stats = convert_book(
             input_filepath,
             output_filepath,
             furigana_mode=FuriganaMode(furigana_mode),
-            output_format=OutputFormat(output_format),
+            output_format=output_formats,
             writing_mode=WritingMode(writing_mode),
             known_words_list=known_words_list if known_words_list else None,
             custom_word_list_path=custom_word_list_path,
             custom_word_list_limit=custom_word_list_limit if custom_word_list_limit > 0 else None,
+            streaming=streaming,
+            workers=WORKERS_PER_JOB,
+            progress=ProgressReporter(partial(publish_progress, uid)) if uid is not None else None,
         )
     except Exception:
         logging.error("Error while processing %s: %s", input_filepath, traceback.format_exc())
         raise
 
-    return path_hash
+    return path_hashes, stats
+
+
+def publish_progress(uid: UUID, progress: Progress):
+    """
+    Record the progress of a job, from the process running it.
+    """
+    job_store.update_progress(uid, progress.stage.value, progress.percent, progress.eta_seconds)
+
+
+def get_job_status(uid: UUID) -> Optional[Job]:
+    """
+    Job with its position in the queue, if it's waiting. Blocking, to be run in a thread from async code.
+    """
+    job = job_store.get(uid)
+    if job is not None and job.status == "in_progress":
+        position = scheduler.position(uid)
+        if position is not None:
+            job.queue_position, job.estimated_wait_seconds = position
+    return job
 
 
 @app.get("/jobs/{uid}/status")
 async def status_handler(uid: UUID):
-    job = jobs.get(uid)
+    job = await run_in_threadpool(get_job_status, uid)
     if not job:
         return Response("Uid not found!", status_code=404)
-    return jobs[uid]
+    return job
+
+
+@app.get("/jobs/{uid}/events")
+async def events_handler(uid: UUID):
+    """
+    Server-Sent Events with the status of the job, sent when it changes, until it is done.
+    """
+    if await run_in_threadpool(job_store.get, uid) is None:
+        return Response("Uid not found!", status_code=404)
+    return StreamingResponse(
+        job_events(uid),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def job_events(uid: UUID):
+    last_data = None
+    last_event = time.monotonic()
+    while True:
+        job = await run_in_threadpool(get_job_status, uid)
+        if job is None:
+            return
+        data = job.model_dump_json()
+        if data != last_data:
+            yield f"data: {data}\n\n"
+            last_data = data
+            last_event = time.monotonic()
+        elif time.monotonic() - last_event > EVENTS_KEEPALIVE:
+            yield ": keepalive\n\n"
+            last_event = time.monotonic()
+        if job.status != "in_progress":
+            return
+        await asyncio.sleep(EVENTS_INTERVAL)
+
+
+@app.get("/ready")
+async def ready_handler():
+    """
+    Whether the worker processes of this process are warm, for the readiness probes.
+    """
+    content = {
+        "ready": app.state.ready,
+        "workers": scheduler.max_running_per_process,
+        "warmup_seconds": app.state.warmup_seconds,
+    }
+    if app.state.warmup_error is not None:
+        content["error"] = app.state.warmup_error
+    return JSONResponse(content, status_code=200 if app.state.ready else 503)
 
 
 @app.get('/jobs/{uid}/file')
-def get_file(uid: UUID):
-    job = jobs.get(uid)
+def get_file(uid: UUID, of: Optional[str] = None):
+    job = job_store.get(uid)
     if not job:
         return Response("Uid not found!", status_code=404)
 
@@ -216,6 +395,10 @@ def get_file(uid: UUID):
         return Response("Something went wrong!", status_code=500)
 
     path_hash = job.result
+    if of is not None:
+        if of not in (job.results or {}):
+            return Response(f"No {of} output for this job!", status_code=404)
+        path_hash = job.results[of]
     file_path = decode_filepath(path_hash)
     filename = os.path.basename(file_path)
     return FileResponse(path=file_path, filename=filename)
@@ -223,25 +406,24 @@ def get_file(uid: UUID):
 
 @app.on_event("startup")
 async def startup_event():
-    app.state.executor = ProcessPoolExecutor()
+    # The scheduler does not run more jobs than this at once in this process, its share of the machine's
+    app.state.executor = ProcessPoolExecutor(
+        max_workers=scheduler.max_running_per_process, initializer=init_app_worker
+    )
+    app.state.ready = False
+    app.state.warmup_seconds = None
+    app.state.warmup_error = None
+    app.state.warmup = asyncio.create_task(warm_up_executor())
+    app.state.janitor = asyncio.create_task(run_janitor())
 
 
 @app.on_event("shutdown")
 async def on_shutdown():
+    app.state.warmup.cancel()
+    app.state.janitor.cancel()
     app.state.executor.shutdown()
 
 
-OUTPUT_FORMAT_TO_EXTENSION = {
-    OutputFormat.epub: ".epub",
-    OutputFormat.mobi: ".mobi",
-    OutputFormat.azw3: ".azw3",
-    OutputFormat.many_txt: ".zip",
-    OutputFormat.single_txt: ".txt",
-    OutputFormat.apkg: ".apkg",
-    OutputFormat.html: ".html",
-}
-
-
 def generate_output_filename(input_filename: str, output_format: OutputFormat) -> str:
     filename_without_ext = os.path.splitext(input_filename)[0]
     extension = OUTPUT_FORMAT_TO_EXTENSION[output_format]
@@ -262,35 +444,73 @@ def decode_filepath(hashed_path):
 
 def cleanup_output_folder(force: bool = False):
     """
-    Keep the total size of output folder below a threshold, thrashing from the older files when needed.
+    Remove the job folders unused for too long, and the least recently used ones while the output folder is
+    over its size budget, along with their jobs. The folders of the jobs in progress are kept.
     """
-    size_threshold = int(os.environ.get("FURIGANALYSE_CLEANUP_THRESHOLD_IN_MB", 100)) * 1_000_000
-
-    output_folder = Path(OUTPUT_FOLDER)
-    paths = sorted(output_folder.iterdir(), key=os.path.getctime)
-
-    path_and_sizes = []
-    total_size = 0
-    for path in paths:
-        size = sum(f.stat().st_size for f in path.glob('**/*') if f.is_file())
-        path_and_sizes.append((path, size))
-        total_size += size
+    size_threshold = 0 if force else int(os.environ.get("FURIGANALYSE_CLEANUP_THRESHOLD_IN_MB", 100)) * 1_000_000
+    ttl = 0 if force else OUTPUT_TTL
 
-    if total_size < size_threshold and not force:
-        return
-
-    for path, size in path_and_sizes:
+    for uid in output_ledger.evict(size_threshold, ttl):
+        path = os.path.join(OUTPUT_FOLDER, str(uid))
         logging.info(f"Removing {path} to free up space")
+        for deleted_uid in job_store.delete(uid):
+            logging.info(f"Deleting associated job {deleted_uid}")
+        result_cache.invalidate(uid)
+        shutil.rmtree(path, ignore_errors=True)
 
-        uid = UUID(os.path.basename(path))
-        if uid in jobs:
-            logging.info(f"Deleting associated job {uid}")
-            del jobs[uid]
 
-        shutil.rmtree(path)
-        total_size -= size
-        if total_size < size_threshold and not force:
-            break
+def reconcile_output_folder():
+    """
+    Record the job folders missing from the output ledger (e.g. left by a previous version),
+    and forget the ones of finished jobs that are not there anymore.
+    """
+    # Listed first: the folders of the jobs finished by then were created before the scan
+    done_uids = output_ledger.done_uids()
+    uids = set()
+    for path in Path(OUTPUT_FOLDER).iterdir():
+        try:
+            uid = UUID(path.name)
+        except ValueError:
+            continue
+        uids.add(uid)
+        if uid not in output_ledger:
+            output_ledger.adopt(uid, folder_size(str(path)), path.stat().st_mtime)
+    for uid in done_uids - uids:
+        output_ledger.remove(uid)
+
+
+async def run_janitor():
+    """
+    Clean up the output folder periodically, in the background, from one worker process only:
+    the others take over if it exits.
+    """
+    reconciled = False
+    while True:
+        if output_ledger.acquire_janitor():
+            try:
+                if not reconciled:
+                    await run_in_threadpool(reconcile_output_folder)
+                    reconciled = True
+                await run_in_threadpool(cleanup_output_folder)
+            except Exception:
+                logging.error("Error while cleaning up the output folder: %s", traceback.format_exc())
+        await asyncio.sleep(CLEANUP_INTERVAL)
+
+
+async def warm_up_executor():
+    """
+    Start the worker processes and load the tokenizer and word lists in each of them, in the background.
+    """
+    start = time.perf_counter()
+    try:
+        await warm_up_pool(app.state.executor, scheduler.max_running_per_process)
+    except Exception as e:
+        logging.error("Error while warming up the worker processes: %s", traceback.format_exc())
+        app.state.warmup_error = repr(e)
+        return
+    app.state.warmup_seconds = round(time.perf_counter() - start, 3)
+    app.state.ready = True
+    logging.info("%d worker processes warmed up in %.2fs", scheduler.max_running_per_process, app.state.warmup_seconds)
 
 
 async def run_in_process(fn, *args):
@@ -298,10 +518,81 @@ async def run_in_process(fn, *args):
     return await loop.run_in_executor(app.state.executor, fn, *args)  # wait and return result
 
 
-async def start_furiganalyse_task(uid: UUID, *args) -> None:
+async def start_furiganalyse_task(uid: UUID, cache_key: str, *args) -> None:
+    job = Job(uid=uid)
+    cached = None
     try:
-        jobs[uid].result = await run_in_process(furiganalyse_task, *args)
-        jobs[uid].status = "complete"
+        await scheduler.wait_turn(uid)
+        job.results, stats = await run_in_process(furiganalyse_task, *args, uid)
+        job.result = next(iter(job.results.values()))
+        job.processed_files = stats.processed
+        job.skipped_files = stats.skipped
+        job.annotation_seconds = stats.annotation_time
+        job.conversion_seconds = stats.conversion_time
+        job.status = "complete"
+        cached = CachedResult(uid, job.result, job.results, stats.processed, stats.skipped)
     except:
         logging.error(f"Error occured for job {uid}")
-        jobs[uid].status = "error"
\ No newline at end of file
+        job.status = "error"
+    finally:
+        await run_in_threadpool(finish_task, job, cache_key, cached)
+
+
+def finish_task(job: Job, cache_key: str, cached: Optional[CachedResult]):
+    """
+    Record the end of a job, and give its result to the identical jobs submitted in the meantime.
+    """
+    scheduler.finish(job.uid)
+    output_ledger.update(job.uid, folder_size(os.path.join(OUTPUT_FOLDER, str(job.uid))), in_progress=False)
+    if job_store.get(job.uid) is None:
+        # Removed by the cleanup of the output folder in the meantime, along with its output
+        job.status = "error"
+        cached = None
+    else:
+        job_store.put(job)
+    complete_followers(cache_key, job, cached)
+
+
+def complete_followers(cache_key: str, job: Job, cached: Optional[CachedResult] = None):
+    """
+    Record the result of the in-flight job of `cache_key` (None if it failed),
+    and copy its final status to the identical jobs attached to it.
+    """
+    # Their results are in the folder of the job, if it was kept
+    source = job.uid if job_store.get(job.uid) is not None else None
+    for follower_uid in result_cache.complete(cache_key, cached):
+        if job_store.get(follower_uid) is not None:
+            job_store.put(job.model_copy(update={"uid": follower_uid}), source=source)
+
+
+def get_word_list_digest(known_words_list: str, custom_word_list_digest: str = None) -> str:
+    if custom_word_list_digest is not None:
+        return custom_word_list_digest
+    if not known_words_list:
+        return ""
+    try:
+        return word_list_digest(known_words_list)
+    except FileNotFoundError:
+        # The job will fail, and its result will not be cached
+        return f"missing:{known_words_list}"
+
+
+def discard_task(uid: UUID, task_folder: str):
+    """
+    Remove a job that was not accepted, and its uploads.
+    """
+    job_store.delete(uid)
+    remove_task_folder(uid, task_folder)
+
+
+def reject_task(uid: UUID, cache_key: str, task_folder: str):
+    """
+    Remove a job rejected by the scheduler, the identical jobs attached to it in the meantime fail with it.
+    """
+    discard_task(uid, task_folder)
+    complete_followers(cache_key, Job(uid=uid, status="error"))
+
+
+def remove_task_folder(uid: UUID, task_folder: str):
+    output_ledger.remove(uid)
+    shutil.rmtree(task_folder, ignore_errors=True)
\ No newline at end of file
@@ -0,0 +1,130 @@
+"""
+Zip archive helpers, to rewrite an EPUB archive without extracting it, and to write archives
+whose entries are compressed depending on their type.
+"""
+
+import logging
+import os
+import struct
+import time
+import zipfile
+from typing import BinaryIO, Iterable, Optional
+
+# Size of the chunks copied from an archive to the other
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# Files that are already compressed, compressing them again would only cost time
+STORED_EXTENSIONS = {
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".avif",
+    ".mp3", ".m4a", ".ogg", ".opus", ".mp4", ".webm",
+    ".woff", ".woff2", ".zip", ".gz",
+}
+
+# Deflate level of the other files, from 1 (fastest) to 9 (smallest)
+COMPRESSION_LEVEL = int(os.environ.get("FURIGANALYSE_ARCHIVE_COMPRESSION_LEVEL", 6))
+
+# The EPUB specification requires this entry to come first, uncompressed
+EPUB_MIMETYPE_FILENAME = "mimetype"
+
+
+def compress_type_for(filename: str) -> int:
+    if filename == EPUB_MIMETYPE_FILENAME or os.path.splitext(filename)[1].lower() in STORED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+class ArchiveWriter:
+    """
+    Zip archive writer whose entries are compressed depending on their extension, see `compress_type_for`,
+    and deflated at the given level.
+    """
+
+    def __init__(self, outputfile: str, compression_level: Optional[int] = None):
+        self.compression_level = COMPRESSION_LEVEL if compression_level is None else compression_level
+        self.zip_out = zipfile.ZipFile(outputfile, "w")
+
+    def add_bytes(self, arcname: str, data: bytes):
+        logging.debug("    Adding %s", arcname)
+        info = zipfile.ZipInfo(arcname, date_time=time.localtime(time.time())[:6])
+        info.external_attr = 0o644 << 16
+        info.compress_type = compress_type_for(arcname)
+        self.zip_out.writestr(info, data, compresslevel=self.compression_level)
+
+    def close(self):
+        self.zip_out.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def can_copy_raw(info: zipfile.ZipInfo) -> bool:
+    """
+    Entries that can be copied as they are: not encrypted, and not needing ZIP64 extensions.
+    """
+    return (
+        not info.flag_bits & 0x1
+        and info.file_size <= zipfile.ZIP64_LIMIT
+        and info.compress_size <= zipfile.ZIP64_LIMIT
+    )
+
+
+def copy_raw_entry(raw_input: BinaryIO, zip_in: zipfile.ZipFile, zip_out: zipfile.ZipFile, info: zipfile.ZipInfo):
+    """
+    Copy an entry of `zip_in` to `zip_out` without decompressing and recompressing it.
+    `raw_input` is the input archive opened in binary mode, where the compressed data is read from.
+    Falls back to a regular copy for the entries that cannot be copied as they are.
+    """
+    if not can_copy_raw(info):
+        zip_out.writestr(info, zip_in.read(info))
+        return
+
+    # The compressed data comes after the local header, whose variable fields may differ from the central directory
+    raw_input.seek(info.header_offset)
+    header = struct.unpack(zipfile.structFileHeader, raw_input.read(zipfile.sizeFileHeader))
+    if header[0] != zipfile.stringFileHeader:
+        raise zipfile.BadZipFile(f"Bad magic number for file header of {info.filename}")
+    raw_input.seek(header[10] + header[11], 1)
+
+    out_info = zipfile.ZipInfo(info.filename, info.date_time)
+    out_info.compress_type = info.compress_type
+    out_info.comment = info.comment
+    out_info.create_system = info.create_system
+    out_info.external_attr = info.external_attr
+    out_info.internal_attr = info.internal_attr
+    # The CRC and sizes are written in the local header, no data descriptor follows the data
+    out_info.flag_bits = info.flag_bits & ~0x08
+    out_info.CRC = info.CRC
+    out_info.compress_size = info.compress_size
+    out_info.file_size = info.file_size
+
+    write_compressed_entry(zip_out, out_info, _read_chunks(raw_input, info.compress_size))
+
+
+def write_compressed_entry(zip_out: zipfile.ZipFile, info: zipfile.ZipInfo, chunks: Iterable[bytes]):
+    """
+    Write an entry whose data is already compressed, its CRC and sizes must be set.
+    There is no public API for this, so we do what ZipFile.writestr does. Only used to copy the entries raw,
+    the others are written with ZipFile.writestr.
+    """
+    with zip_out._lock:
+        zip_out._writecheck(info)
+        info.header_offset = zip_out.fp.tell()
+        zip_out._didModify = True
+        zip_out.fp.write(info.FileHeader(zip64=False))
+        for chunk in chunks:
+            zip_out.fp.write(chunk)
+        zip_out.filelist.append(info)
+        zip_out.NameToInfo[info.filename] = info
+        zip_out.start_dir = zip_out.fp.tell()
+
+
+def _read_chunks(source: BinaryIO, size: int) -> Iterable[bytes]:
+    while size > 0:
+        chunk = source.read(min(size, COPY_CHUNK_SIZE))
+        if not chunk:
+            raise zipfile.BadZipFile("Truncated archive")
+        yield chunk
+        size -= len(chunk)
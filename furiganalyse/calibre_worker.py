@@ -0,0 +1,48 @@
+"""
+Calibre conversion worker, run in calibre's own Python environment with `calibre-debug -e calibre_worker.py`.
+
+Calibre and its conversion plugins are loaded once, then the worker converts the books it is asked to,
+one at a time: each request is a JSON object on a line of stdin, {"input": ..., "output": ...},
+answered by a JSON object on a line of stdout, {"ok": true} or {"error": ...}.
+A first {"ready": true} line tells that the worker is ready.
+
+This file must only depend on the standard library and calibre, it does not run in our environment.
+"""
+
+import json
+import os
+import sys
+import traceback
+
+
+def serve():
+    # Calibre logs its progress on stdout, which is kept for the replies
+    replies = os.fdopen(os.dup(1), "w", encoding="utf-8")
+    os.dup2(2, 1)
+    sys.stdout = sys.stderr
+
+    from calibre.ebooks.conversion.cli import main as ebook_convert
+
+    reply(replies, {"ready": True})
+    for line in sys.stdin:
+        request = json.loads(line)
+        try:
+            code = ebook_convert(["ebook-convert", request["input"], request["output"]])
+            if code:
+                reply(replies, {"error": f"ebook-convert exited with code {code}"})
+            else:
+                reply(replies, {"ok": True})
+        except KeyboardInterrupt:
+            raise
+        except BaseException:
+            # Including SystemExit, raised by calibre on invalid arguments
+            reply(replies, {"error": traceback.format_exc()})
+
+
+def reply(replies, message):
+    replies.write(json.dumps(message) + "\n")
+    replies.flush()
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,209 @@
+"""
+Ebook conversions with calibre (MOBI/AZW3 to EPUB and back), by a pool of warm calibre processes.
+
+Starting calibre takes longer than converting a small book, so each worker process loads calibre once
+(see calibre_worker.py) and then converts books until it has done FURIGANALYSE_CALIBRE_WORKER_MAX_CONVERSIONS
+of them, when it is replaced to keep leaks in check.
+
+Configuration (environment variables):
+- FURIGANALYSE_CALIBRE_WORKERS: number of warm calibre processes (default 1), 0 to spawn `ebook-convert`
+  for each conversion instead
+- FURIGANALYSE_CONVERSION_QUEUE_LIMIT: number of conversions waiting for a worker beyond which
+  new ones are rejected with ConversionQueueFull (default 8)
+- FURIGANALYSE_CONVERSION_TIMEOUT: seconds after which a conversion is aborted, and its worker killed (default 300)
+- FURIGANALYSE_CALIBRE_DEBUG: calibre-debug command running the workers (default "calibre-debug")
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import select
+import shlex
+import shutil
+import subprocess
+import threading
+import time
+from functools import lru_cache
+from typing import List, Optional
+
+CALIBRE_WORKERS = int(os.environ.get("FURIGANALYSE_CALIBRE_WORKERS", 1))
+CONVERSION_QUEUE_LIMIT = int(os.environ.get("FURIGANALYSE_CONVERSION_QUEUE_LIMIT", 8))
+CONVERSION_TIMEOUT = float(os.environ.get("FURIGANALYSE_CONVERSION_TIMEOUT", 300))
+CALIBRE_WORKER_MAX_CONVERSIONS = int(os.environ.get("FURIGANALYSE_CALIBRE_WORKER_MAX_CONVERSIONS", 100))
+CALIBRE_DEBUG = os.environ.get("FURIGANALYSE_CALIBRE_DEBUG", "calibre-debug")
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "calibre_worker.py")
+
+
+class ConversionError(Exception):
+    pass
+
+
+class ConversionTimeout(ConversionError):
+    pass
+
+
+class ConversionQueueFull(ConversionError):
+    pass
+
+
+class _CalibreWorker:
+    """
+    A calibre process converting books on request, see calibre_worker.py for the protocol.
+    """
+
+    def __init__(self, command: List[str], startup_timeout: float):
+        self.process = subprocess.Popen(
+            command + [WORKER_SCRIPT],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            encoding="utf-8",
+        )
+        self.conversions = 0
+        try:
+            self._read_reply(startup_timeout)
+        except ConversionError:
+            self.stop()
+            raise
+
+    @property
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def convert(self, inputfile: str, outputfile: str, timeout: float):
+        self.process.stdin.write(json.dumps({"input": inputfile, "output": outputfile}) + "\n")
+        self.process.stdin.flush()
+        self.conversions += 1
+        reply = self._read_reply(timeout)
+        if "error" in reply:
+            raise ConversionError(f"Could not convert {inputfile}: {reply['error']}")
+
+    def stop(self):
+        if self.alive:
+            self.process.kill()
+        self.process.wait()
+        self.process.stdin.close()
+        self.process.stdout.close()
+
+    def _read_reply(self, timeout: float) -> dict:
+        # A single reply is expected at a time, so nothing is left in the buffer of stdout after reading it
+        ready, _, _ = select.select([self.process.stdout], [], [], timeout)
+        if not ready:
+            raise ConversionTimeout(f"No reply from the calibre worker after {timeout}s")
+        line = self.process.stdout.readline()
+        if not line:
+            raise ConversionError(f"The calibre worker exited with code {self.process.wait()}")
+        return json.loads(line)
+
+
+class ConversionService:
+    """
+    Converts books with a pool of warm calibre workers, started when first needed (or by `start`).
+    At most `workers + queue_limit` conversions are accepted at once, the others are rejected.
+    """
+
+    def __init__(
+        self,
+        workers: int = CALIBRE_WORKERS,
+        queue_limit: int = CONVERSION_QUEUE_LIMIT,
+        timeout: float = CONVERSION_TIMEOUT,
+        command: Optional[List[str]] = None,
+    ):
+        self.timeout = timeout
+        self.command = command if command is not None else shlex.split(CALIBRE_DEBUG) + ["-e"]
+        if workers > 0 and shutil.which(self.command[0]) is None:
+            logging.warning("%s not found, calibre will be started for each conversion", self.command[0])
+            workers = 0
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(max(workers, 1) + queue_limit)
+        # Idle workers, None for the ones not started yet (or stopped)
+        self._idle: "queue.Queue[Optional[_CalibreWorker]]" = queue.Queue()
+        for _ in range(workers):
+            self._idle.put(None)
+
+    def start(self):
+        """
+        Start the workers that are not running yet, so that the first conversions do not wait for calibre.
+        """
+        for _ in range(self.workers):
+            worker = self._idle.get()
+            try:
+                if worker is None or not worker.alive:
+                    worker = _CalibreWorker(self.command, self.timeout)
+            finally:
+                self._idle.put(worker)
+
+    def convert(self, inputfile: str, outputfile: str, timeout: Optional[float] = None) -> float:
+        """
+        Convert `inputfile` to `outputfile`, whose formats are given by their extensions.
+        Returns the time spent converting, in seconds, not counting the time waiting for a worker.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        if not self._slots.acquire(blocking=False):
+            raise ConversionQueueFull("Too many conversions in progress, try again later")
+        try:
+            if self.workers == 0:
+                start = time.perf_counter()
+                self._convert_in_new_process(inputfile, outputfile, timeout)
+                return time.perf_counter() - start
+
+            waiting_start = time.perf_counter()
+            worker = self._idle.get()
+            start = time.perf_counter()
+            logging.debug("Waited %.3fs for a calibre worker", start - waiting_start)
+            try:
+                if worker is None or not worker.alive:
+                    worker = _CalibreWorker(self.command, timeout)
+                worker.convert(inputfile, outputfile, timeout)
+            except ConversionError:
+                # The worker may be stuck or in a bad state, start a new one next time
+                if worker is not None:
+                    worker.stop()
+                    worker = None
+                raise
+            finally:
+                if worker is not None and worker.conversions >= CALIBRE_WORKER_MAX_CONVERSIONS:
+                    worker.stop()
+                    worker = None
+                self._idle.put(worker)
+            return time.perf_counter() - start
+        finally:
+            self._slots.release()
+
+    def close(self):
+        for _ in range(self.workers):
+            worker = self._idle.get()
+            if worker is not None:
+                worker.stop()
+        self.workers = 0
+
+    @staticmethod
+    def _convert_in_new_process(inputfile: str, outputfile: str, timeout: float):
+        try:
+            subprocess.run(["ebook-convert", inputfile, outputfile], check=True, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            raise ConversionTimeout(f"Could not convert {inputfile} in {timeout}s")
+        except (OSError, subprocess.CalledProcessError) as e:
+            raise ConversionError(f"Could not convert {inputfile}: {e}")
+
+
+@lru_cache(maxsize=None)
+def get_conversion_service() -> ConversionService:
+    """
+    Conversion service of this process, its workers are stopped when the process exits.
+    """
+    service = ConversionService()
+    atexit.register(service.close)
+    return service
+
+
+def convert_ebook(inputfile: str, outputfile: str) -> float:
+    """
+    Convert an ebook with the conversion service of this process, returns the conversion time in seconds.
+    """
+    elapsed = get_conversion_service().convert(inputfile, outputfile)
+    logging.info("Converted %s to %s in %.3fs", os.path.basename(inputfile), os.path.basename(outputfile), elapsed)
+    return elapsed
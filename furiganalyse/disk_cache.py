@@ -0,0 +1,188 @@
+"""
+Persistent reading cache, shared by all the worker processes and jobs of a machine.
+
+The furigana tokens of each text segment are stored in a SQLite database (in WAL mode, so that many
+processes can read while one writes), under the directory set by FURIGANALYSE_READING_CACHE_DIR.
+The cache is disabled when this variable is not set.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from functools import lru_cache
+from importlib import metadata
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from furiganalyse.sqlite_db import Transaction
+
+Token = Tuple[str, ...]
+
+DATABASE_FILENAME = "readings.sqlite3"
+
+# SQLite limits the number of variables in a query
+QUERY_CHUNK_SIZE = 500
+
+# Entries used within this delay (in seconds) are not refreshed, to avoid writing on every lookup
+REFRESH_INTERVAL = 3600
+
+# How many new entries to write before checking the size of the cache
+EVICTION_INTERVAL = 1000
+
+
+@lru_cache(maxsize=1)
+def dictionary_identity() -> str:
+    """
+    Identify the MeCab dictionary and furigana version that produce the readings,
+    so that changing any of them does not serve stale readings.
+    """
+    parts = []
+    try:
+        parts.append(metadata.version("furigana"))
+    except metadata.PackageNotFoundError:
+        parts.append("furigana-unknown")
+
+    try:
+        import MeCab
+
+        # The dictionary info belongs to the tagger, which must stay alive while it is read
+        tagger = MeCab.Tagger()
+        info = tagger.dictionary_info()
+        filename, charset, version = str(info.filename), str(info.charset), int(info.version)
+        parts.append(f"{filename}:{charset}:{version}")
+    except Exception:
+        logging.warning("Could not identify the MeCab dictionary")
+        parts.append("dictionary-unknown")
+
+    return "|".join(parts)
+
+
+def make_key(text: str, dictionary: str, exclude_words_fingerprint: str) -> bytes:
+    return hashlib.sha256(
+        "\0".join((dictionary, exclude_words_fingerprint, text)).encode("utf-8")
+    ).digest()
+
+
+class PersistentReadingCache:
+    """
+    SQLite backed cache of furigana tokens, bounded to `max_entries` by evicting the least recently used.
+    """
+
+    def __init__(self, directory: str, max_entries: int, dictionary: Optional[str] = None):
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        self.path = os.path.join(directory, DATABASE_FILENAME)
+        self.max_entries = max_entries
+        self.dictionary = dictionary if dictionary is not None else dictionary_identity()
+        self._writes_since_eviction = 0
+
+        self._connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS readings ("
+            "key BLOB PRIMARY KEY, tokens TEXT NOT NULL, last_used REAL NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS readings_last_used ON readings (last_used)")
+
+    def get_many(self, texts: Iterable[str], fingerprint: str) -> Dict[str, Tuple[Token, ...]]:
+        """
+        Look up the tokens of the given texts, returns only the ones found in the cache.
+        """
+        keys = {make_key(text, self.dictionary, fingerprint): text for text in texts}
+        found = {}
+        try:
+            for chunk in _chunks(list(keys), QUERY_CHUNK_SIZE):
+                rows = self._connection.execute(
+                    f"SELECT key, tokens, last_used FROM readings WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                for key, tokens, _ in rows:
+                    found[keys[key]] = tuple(tuple(token) for token in json.loads(tokens))
+
+                # Refresh the entries that were not used recently, so that they are not evicted
+                now = time.time()
+                stale_keys = [(now, key) for key, _, last_used in rows if now - last_used > REFRESH_INTERVAL]
+                if stale_keys:
+                    with self._transaction():
+                        self._connection.executemany("UPDATE readings SET last_used = ? WHERE key = ?", stale_keys)
+        except sqlite3.Error as e:
+            logging.warning("Persistent reading cache lookup failed: %s", e)
+        return found
+
+    def put_many(self, tokens_by_text: Dict[str, Tuple[Token, ...]], fingerprint: str) -> None:
+        if not tokens_by_text:
+            return
+        now = time.time()
+        rows = [
+            (make_key(text, self.dictionary, fingerprint), json.dumps(tokens, ensure_ascii=False), now)
+            for text, tokens in tokens_by_text.items()
+        ]
+        try:
+            with self._transaction():
+                self._connection.executemany("INSERT OR REPLACE INTO readings VALUES (?, ?, ?)", rows)
+
+            self._writes_since_eviction += len(rows)
+            if self._writes_since_eviction >= EVICTION_INTERVAL:
+                self.evict()
+        except sqlite3.Error as e:
+            logging.warning("Persistent reading cache update failed: %s", e)
+
+    def evict(self) -> int:
+        """
+        Remove the least recently used entries above the size cap, returns how many were removed.
+        """
+        self._writes_since_eviction = 0
+        with self._transaction():
+            count = self._connection.execute("SELECT count(*) FROM readings").fetchone()[0]
+            excess = count - self.max_entries
+            if excess <= 0:
+                return 0
+            self._connection.execute(
+                "DELETE FROM readings WHERE key IN (SELECT key FROM readings ORDER BY last_used LIMIT ?)",
+                (excess,),
+            )
+        logging.info("Evicted %d entries from the persistent reading cache", excess)
+        return excess
+
+    def __len__(self) -> int:
+        return self._connection.execute("SELECT count(*) FROM readings").fetchone()[0]
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def _transaction(self):
+        return Transaction(self._connection)
+
+
+def _chunks(items: List, size: int) -> Iterable[List]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+_persistent_cache: Tuple[Optional[int], Optional[str], Optional[PersistentReadingCache]] = (None, None, None)
+
+
+def get_persistent_reading_cache() -> Optional[PersistentReadingCache]:
+    """
+    Persistent reading cache configured by the environment, or None if disabled.
+    Each process opens its own connection, as they cannot be shared after a fork.
+    """
+    global _persistent_cache
+    directory = os.environ.get("FURIGANALYSE_READING_CACHE_DIR")
+    if not directory:
+        return None
+
+    pid, cache_directory, cache = _persistent_cache
+    if pid != os.getpid() or cache_directory != directory:
+        max_entries = int(os.environ.get("FURIGANALYSE_READING_CACHE_MAX_ENTRIES", 2_000_000))
+        try:
+            cache = PersistentReadingCache(directory, max_entries)
+        except sqlite3.Error as e:
+            logging.warning("Could not open the persistent reading cache in %s: %s", directory, e)
+            cache = None
+        _persistent_cache = (os.getpid(), directory, cache)
+    return cache
@@ -1,74 +1,290 @@
+import contextlib
+import io
 import logging
 import os
 import re
+import time
 import zipfile
-from pathlib import Path
-from typing import Optional, Set
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
 from xml.etree import ElementTree as ET
 
+from furigana.furigana import split_furigana
+
+from furiganalyse.archive import COMPRESSION_LEVEL, EPUB_MIMETYPE_FILENAME, copy_raw_entry
+from furiganalyse.html_format import HtmlBookSink
 from furiganalyse.params import OutputFormat, WritingMode
-from furiganalyse.parsing import process_html, convert_html_to_txt
+from furiganalyse.progress import ProgressReporter
+from furiganalyse.parsing import (
+    Paragraph, process_html, exclude_words_fingerprint, iter_paragraph_tokens, needs_processing, reading_cache,
+)
+from furiganalyse.streaming import process_html_streaming
+from furiganalyse.txt_format import TxtSink
+from furiganalyse.xml_engine import get_xml_engine
 
 # Register XHTML namespace with empty prefix (default namespace)
 # This prevents ElementTree from adding 'html:' prefix to all elements when serializing
 ET.register_namespace('', 'http://www.w3.org/1999/xhtml')
 
+TXT_OUTPUT_FORMATS = {OutputFormat.many_txt, OutputFormat.single_txt, OutputFormat.apkg}
+
+
+@dataclass
+class ProcessingStats:
+    """
+    Number of HTML/XHTML files of a job that were processed, or skipped because they needed no change,
+    and the processing time of each file (by name in the EPUB archive), in seconds.
+    The time spent annotating the book, and converting it with calibre, are reported apart.
+    """
+    processed: int = 0
+    skipped: int = 0
+    timings: Dict[str, float] = field(default_factory=dict)
+    cache_hits: int = 0
+    cache_misses: int = 0
+    annotation_time: float = 0.0
+    conversion_time: float = 0.0
+
+    def add(self, filename: str, result: "FileResult"):
+        if result.skipped:
+            self.skipped += 1
+        else:
+            self.processed += 1
+        self.timings[filename] = result.elapsed
+        self.cache_hits += result.cache_hits
+        self.cache_misses += result.cache_misses
+
+    def log(self):
+        logging.info("Reading cache: %d hits, %d misses", self.cache_hits, self.cache_misses)
+        logging.info("Processed %d files, skipped %d files without changes", self.processed, self.skipped)
+        for filename, elapsed in sorted(self.timings.items(), key=lambda item: item[1], reverse=True):
+            logging.info("    %.3fs %s", elapsed, filename)
+
+
+class FileResult(NamedTuple):
+    skipped: bool
+    elapsed: float
+    cache_hits: int
+    cache_misses: int
+
+
+# Exclude words of the job, set once per worker process by `init_worker`
+_worker_exclude_words: Optional[Set[str]] = None
+
 
-def process_epub_file(
-    unzipped_input_fpath,
+def init_worker(exclude_words: Optional[Set[str]]):
+    """
+    Initialize a worker process: keep the exclude words, and load MeCab before the first file comes in.
+    """
+    global _worker_exclude_words
+    _worker_exclude_words = exclude_words
+    exclude_words_fingerprint(exclude_words)
+    split_furigana("漢字")
+
+
+def process_epub_archive(
+    inputfile: str,
+    outputfile: Optional[str],
     mode,
-    writing_mode,
-    output_format,
+    writing_mode: Optional[WritingMode] = None,
     exclude_words: Optional[Set[str]] = None,
-):
-    if writing_mode is not None:
-        update_writing_mode(unzipped_input_fpath, writing_mode)
-
-    for root, _, files in os.walk(unzipped_input_fpath):
-        for file in files:
-            if os.path.splitext(file)[1] in {".html", ".xhtml"}:
-                logging.info("    Processing %s", file)
-                html_filepath = os.path.join(root, file)
-                tree = process_html(html_filepath, mode, exclude_words)
-                if output_format in {OutputFormat.many_txt, OutputFormat.single_txt, OutputFormat.apkg}:
-                    txt_outputfile = os.path.splitext(html_filepath)[0] + '.txt'
-                    convert_html_to_txt(tree, txt_outputfile)
+    streaming: bool = False,
+    workers: int = 1,
+    txt_sink: Optional[TxtSink] = None,
+    html_sink: Optional[HtmlBookSink] = None,
+    progress: Optional[ProgressReporter] = None,
+) -> ProcessingStats:
+    """
+    Process an EPUB archive into a new one, without extracting it: only the HTML/XHTML files
+    (and the CSS files when changing the writing mode) are transformed, the other entries (images, fonts, ...)
+    and the files that need no change are copied as they are, without decompressing them.
+    The entries keep their order and compression method.
+
+    In streaming mode, each XHTML file is streamed from the input archive to the output one,
+    one at a time. Otherwise, with more than one worker, the files are processed in parallel.
+
+    If `txt_sink` is set, the paragraphs of each annotated document are pushed into it, in archive order,
+    for the text outputs, and so are the annotated trees into `html_sink` for the HTML output
+    (this needs the whole trees, so no streaming). Without `outputfile`, only these outputs are produced.
+    """
+    if (txt_sink is not None or html_sink is not None) and streaming:
+        logging.info("    Text and HTML outputs need the whole documents, streaming is disabled")
+        streaming = False
+    with_text = txt_sink is not None
+    with_tree = with_text or html_sink is not None
+
+    stats = ProcessingStats()
+    with zipfile.ZipFile(inputfile) as zip_in, open(inputfile, "rb") as raw_input, \
+            _open_output_archive(outputfile) as zip_out:
+        # The mimetype must be the first entry, uncompressed
+        infos = sorted(zip_in.infolist(), key=lambda info: info.filename != EPUB_MIMETYPE_FILENAME)
+        is_html = [os.path.splitext(info.filename)[1] in {".html", ".xhtml"} for info in infos]
+        html_infos = [info for info, html in zip(infos, is_html) if html]
+
+        executor = None
+        if workers > 1 and len(html_infos) > 1 and not streaming:
+            logging.info("    Processing %d files with %d workers", len(html_infos), workers)
+            executor = ProcessPoolExecutor(
+                max_workers=min(workers, len(html_infos)),
+                initializer=init_worker,
+                initargs=(exclude_words,),
+            )
+        try:
+            if executor:
+                # Submitted in order, the results are written in order as they come
+                futures = iter([
+                    executor.submit(process_html_content_in_worker, zip_in.read(info), mode, with_text)
+                    for info in html_infos
+                ])
+
+            for info, html in zip(infos, is_html):
+                if html:
+                    paragraphs = None
+                    tree = None
+                    if executor:
+                        content, paragraphs, result = next(futures).result()
+                        if html_sink is not None:
+                            # The trees do not cross the process boundary, the annotated content is parsed again
+                            tree = get_xml_engine().parse(
+                                io.BytesIO(zip_in.read(info) if content is None else content)
+                            )
+                    elif streaming:
+                        content, result = _stream_html_entry(zip_in, zip_out, info, mode, exclude_words)
+                    else:
+                        content, tree, result = annotate_html_content(
+                            zip_in.read(info), mode, exclude_words, with_tree
+                        )
+                        if with_text:
+                            paragraphs = list(iter_paragraph_tokens(tree))
+
+                    if paragraphs is not None:
+                        txt_sink.add_document(info.filename, paragraphs)
+                    if html_sink is not None:
+                        html_sink.add_document(info.filename, tree.getroot())
+
+                    if zip_out is not None:
+                        if result.skipped:
+                            copy_raw_entry(raw_input, zip_in, zip_out, info)
+                        elif content is not None:
+                            zip_out.writestr(_output_info(info), content, compresslevel=COMPRESSION_LEVEL)
+                    stats.add(info.filename, result)
+                    if progress is not None:
+                        progress.advance(stats.processed + stats.skipped, len(html_infos))
+                elif zip_out is None:
+                    # Only the text and HTML outputs are produced
+                    continue
+                elif writing_mode is not None and os.path.splitext(info.filename)[1] == ".css":
+                    css_content = zip_in.read(info).decode("utf-8", errors="surrogateescape")
+                    css_content = update_css_writing_mode(css_content, writing_mode)
+                    zip_out.writestr(
+                        _output_info(info), css_content.encode("utf-8", errors="surrogateescape"),
+                        compresslevel=COMPRESSION_LEVEL,
+                    )
+                elif info.filename == EPUB_MIMETYPE_FILENAME and info.compress_type != zipfile.ZIP_STORED:
+                    zip_out.writestr(_output_info(info, zipfile.ZIP_STORED), zip_in.read(info))
                 else:
-                    tree.write(html_filepath, encoding="utf-8")
+                    copy_raw_entry(raw_input, zip_in, zip_out, info)
+        finally:
+            if executor:
+                executor.shutdown(cancel_futures=True)
+
+    stats.log()
+    return stats
+
+
+def _open_output_archive(outputfile: Optional[str]):
+    if outputfile is None:
+        return contextlib.nullcontext()
+    # The streamed entries take their compression from the archive, see `_stream_html_entry`
+    return zipfile.ZipFile(outputfile, "w", zipfile.ZIP_DEFLATED, compresslevel=COMPRESSION_LEVEL)
+
 
+def process_html_content(
+    content: bytes, mode, exclude_words: Optional[Set[str]] = None, with_text: bool = False
+) -> Tuple[Optional[bytes], Optional[List[Paragraph]], FileResult]:
+    """
+    Process an HTML/XHTML document held in memory, returns the new content (None if skipped),
+    and its paragraphs for the text outputs if `with_text` is set, from the same annotated tree.
+    """
+    output, tree, result = annotate_html_content(content, mode, exclude_words, with_text)
+    paragraphs = list(iter_paragraph_tokens(tree)) if with_text else None
+    return output, paragraphs, result
+
+
+def annotate_html_content(
+    content: bytes, mode, exclude_words: Optional[Set[str]] = None, with_tree: bool = False
+) -> Tuple[Optional[bytes], Optional[ET.ElementTree], FileResult]:
+    """
+    Process an HTML/XHTML document held in memory, returns the new content (None if skipped),
+    and the annotated tree if `with_tree` is set (the parsed document if skipped).
+    """
+    start = time.perf_counter()
+    cache_info_before = reading_cache.info()
+    skipped = not needs_processing(content, mode)
+    if skipped and not with_tree:
+        return None, None, FileResult(True, time.perf_counter() - start, 0, 0)
 
-def update_writing_mode(unzipped_input_fpath: str, writing_mode: WritingMode):
-    for css_filepath in Path(unzipped_input_fpath).glob('**/*.css'):
-        with open(css_filepath) as fd:
-            css_content = fd.read()
+    output = None
+    if skipped:
+        tree = get_xml_engine().parse(io.BytesIO(content))
+    else:
+        tree = process_html(io.BytesIO(content), mode, exclude_words)
+        output = io.BytesIO()
+        tree.write(output, encoding="utf-8")
+        output = output.getvalue()
 
-        pattern = re.compile(r"(-webkit-writing-mode|-epub-writing-mode|writing-mode):\s*[^;\n]+")
-        css_content = pattern.sub(rf"\1: {writing_mode.value}", css_content)
+    return output, tree if with_tree else None, _file_result(start, cache_info_before, skipped)
 
-        with open(css_filepath, "w") as fd:
-            fd.write(css_content)
 
-    # content.opf has a tag like this: <meta name="primary-writing-mode" content="vertical-rl"/>
-    # content_opf_path: Path = Path(unzipped_input_fpath) / "content.opf"
-    # if content_opf_path.exists():
-    #     from xml.etree import ElementTree as ET
-    #     tree = ET.parse(content_opf_path)
-    #     # import ipdb; ipdb.set_trace()
-    #     x: ET.Element = tree.find(".//{http://www.idpf.org/2007/opf}meta[@name='primary-writing-mode']")
-    #     x.attrib["content"] = writing_mode.value
-    #     tree.write(content_opf_path, encoding="utf-8")
+def process_html_content_in_worker(
+    content: bytes, mode, with_text: bool = False
+) -> Tuple[Optional[bytes], Optional[List[Paragraph]], FileResult]:
+    return process_html_content(content, mode, _worker_exclude_words, with_text)
 
 
-def write_epub_archive(unzipped_input_fpath: str, outputfile: str):
+def _stream_html_entry(
+    zip_in: zipfile.ZipFile, zip_out: zipfile.ZipFile, info: zipfile.ZipInfo, mode, exclude_words: Optional[Set[str]]
+) -> Tuple[None, FileResult]:
     """
-    Write the modified extracted EPUB archive to a new archive file.
+    Stream an XHTML entry from the input archive to the output one, unless it needs no change.
     """
-    with zipfile.ZipFile(outputfile, 'w') as zip_out:
-        for folder_name, _, filenames in os.walk(unzipped_input_fpath):
-            for filename in filenames:
-                rel_dir = os.path.relpath(folder_name, unzipped_input_fpath)
-                rel_file = os.path.join(rel_dir, filename)
-                file_path = os.path.join(folder_name, filename)
-                # Add file to zip
-                zip_out.write(file_path, rel_file)
-                logging.info(f"    Adding {rel_file}")
\ No newline at end of file
+    start = time.perf_counter()
+    cache_info_before = reading_cache.info()
+    with zip_in.open(info) as fd:
+        if not needs_processing(fd.read(), mode):
+            return None, FileResult(True, time.perf_counter() - start, 0, 0)
+
+    # Opened by name, as the compression level of an entry can only be set by the archive when streaming it:
+    # the entry is deflated, and dated from now
+    with zip_in.open(info) as fd_in, zip_out.open(info.filename, "w") as fd_out:
+        with io.TextIOWrapper(fd_out, encoding="utf-8") as text_out:
+            process_html_streaming(fd_in, text_out, mode, exclude_words)
+    return None, _file_result(start, cache_info_before)
+
+
+def _file_result(start: float, cache_info_before, skipped: bool = False) -> FileResult:
+    cache_info = reading_cache.info()
+    return FileResult(
+        skipped,
+        time.perf_counter() - start,
+        cache_info.hits - cache_info_before.hits,
+        cache_info.misses - cache_info_before.misses,
+    )
+
+
+def _output_info(info: zipfile.ZipInfo, compress_type: Optional[int] = None) -> zipfile.ZipInfo:
+    """
+    Entry of the output archive replacing the given input entry, with the same name, date and compression
+    (unless another compression method is given), to write with `compresslevel=COMPRESSION_LEVEL`.
+    """
+    out_info = zipfile.ZipInfo(info.filename, info.date_time)
+    out_info.compress_type = info.compress_type if compress_type is None else compress_type
+    out_info.external_attr = info.external_attr
+    return out_info
+
+
+writing_mode_pattern = re.compile(r"(-webkit-writing-mode|-epub-writing-mode|writing-mode):\s*[^;\n]+")
+
+
+def update_css_writing_mode(css_content: str, writing_mode: WritingMode) -> str:
+    return writing_mode_pattern.sub(rf"\1: {writing_mode.value}", css_content)
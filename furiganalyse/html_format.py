@@ -0,0 +1,304 @@
+"""
+Native HTML output: the annotated documents of a book, in reading order, concatenated into a single HTML file.
+
+The documents are pushed into an `HtmlBookSink` as they are annotated, like the text outputs, and each document
+of the OPF spine becomes a <section> of the output. The ruby markup is kept as it is, and the images are inlined
+as data URIs from the input EPUB so that the file is self-contained.
+"""
+
+import base64
+import logging
+import mimetypes
+import os
+import posixpath
+import shutil
+import zipfile
+from tempfile import TemporaryDirectory
+from typing import Dict, List, Optional, TextIO, Tuple
+from urllib.parse import unquote, urlsplit
+from xml.etree import ElementTree as ET
+from xml.sax.saxutils import escape, quoteattr
+
+CONTAINER_FILENAME = "META-INF/container.xml"
+CONTAINER_NAMESPACE = "{urn:oasis:names:tc:opendocument:xmlns:container}"
+OPF_NAMESPACE = "{http://www.idpf.org/2007/opf}"
+DC_NAMESPACE = "{http://purl.org/dc/elements/1.1/}"
+XHTML_NAMESPACE = "{http://www.w3.org/1999/xhtml}"
+SVG_NAMESPACE = "{http://www.w3.org/2000/svg}"
+XLINK_HREF = "{http://www.w3.org/1999/xlink}href"
+XML_LANG = "{http://www.w3.org/XML/1998/namespace}lang"
+
+HTML_DOCUMENT_MEDIA_TYPES = {"application/xhtml+xml", "text/html"}
+
+# Elements without end tag in HTML
+VOID_ELEMENTS = {
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr",
+}
+
+# Elements whose content is written as it is
+RAW_TEXT_ELEMENTS = {"script", "style"}
+
+HTML_HEADER = """<!DOCTYPE html>
+<html{lang}>
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>{title}</title>
+<style>
+body {{ max-width: 40em; margin: auto; padding: 1em; line-height: 2; }}
+img, svg {{ max-width: 100%; height: auto; }}
+section + section {{ margin-top: 3em; }}
+</style>
+</head>
+<body>
+"""
+
+HTML_FOOTER = """</body>
+</html>
+"""
+
+
+class HtmlBookSink:
+    """
+    Write the annotated documents pushed into it into a single HTML file, one document at a time.
+
+    With `epub_filepath`, the title, language and reading order are the ones of the EPUB, whose images are inlined:
+    the documents that come before their turn are written to temporary files until then, and the ones out of
+    the spine are left out. Otherwise, the documents are written in the order they come.
+    """
+
+    def __init__(self, outputfile: str, epub_filepath: Optional[str] = None, title: str = "",
+                 language: Optional[str] = None):
+        self.outputfile = outputfile
+        self.zip_in = zipfile.ZipFile(epub_filepath) if epub_filepath else None
+        self.documents = None
+        if self.zip_in is not None:
+            title, language, documents = read_package(self.zip_in)
+            self.documents = list(dict.fromkeys(documents))
+        self.writer = _HtmlBookWriter(self.zip_in, self.documents)
+        # Position in the spine of the next document to write, and the documents that came before their turn
+        self.next_document = 0
+        self.pending = TemporaryDirectory()
+        self.pending_documents: Dict[str, str] = {}
+
+        self.fd = open(outputfile, "w", encoding="utf-8")
+        lang = f" lang={quoteattr(language)}" if language else ""
+        self.fd.write(HTML_HEADER.format(lang=lang, title=escape(title)))
+
+    def add_document(self, name: str, root: ET.Element):
+        if self.documents is None:
+            self.writer.write_document(name, root, self.fd)
+            return
+        if name not in self.writer.section_ids:
+            return
+        if name != self.documents[self.next_document]:
+            path = os.path.join(self.pending.name, self.writer.section_ids[name])
+            with open(path, "w", encoding="utf-8") as fd:
+                self.writer.write_document(name, root, fd)
+            self.pending_documents[name] = path
+            return
+
+        self.writer.write_document(name, root, self.fd)
+        self.next_document += 1
+        self._write_pending_documents()
+
+    def _write_pending_documents(self):
+        while self.next_document < len(self.documents):
+            path = self.pending_documents.pop(self.documents[self.next_document], None)
+            if path is None:
+                return
+            with open(path, encoding="utf-8") as fd:
+                shutil.copyfileobj(fd, self.fd)
+            os.remove(path)
+            self.next_document += 1
+
+    def close(self):
+        if self.documents is not None:
+            # The documents that never came (e.g. not HTML) are left out
+            while self.next_document < len(self.documents):
+                self.next_document += 1
+                self._write_pending_documents()
+        self.fd.write(HTML_FOOTER)
+        self._close_files()
+
+    def abort(self):
+        """
+        Called instead of `close` when the processing failed, the incomplete output is removed.
+        """
+        self._close_files()
+        os.remove(self.outputfile)
+
+    def _close_files(self):
+        self.fd.close()
+        self.pending.cleanup()
+        if self.zip_in is not None:
+            self.zip_in.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def read_package(zip_in: zipfile.ZipFile) -> Tuple[str, Optional[str], List[str]]:
+    """
+    Title, language and HTML documents (in spine order) of the EPUB, from its OPF package document.
+    Without one, the HTML documents are taken in the order of the archive.
+    """
+    names = set(zip_in.namelist())
+    opf_path = None
+    if CONTAINER_FILENAME in names:
+        container = ET.fromstring(zip_in.read(CONTAINER_FILENAME))
+        rootfile = container.find(f".//{CONTAINER_NAMESPACE}rootfile")
+        if rootfile is not None:
+            opf_path = rootfile.get("full-path")
+    if opf_path not in names:
+        opf_path = next((name for name in zip_in.namelist() if name.endswith(".opf")), None)
+
+    if opf_path is None:
+        logging.warning("No OPF package document found, taking the HTML documents in archive order")
+        documents = [name for name in zip_in.namelist() if posixpath.splitext(name)[1] in {".html", ".xhtml"}]
+        return "", None, documents
+
+    package = ET.fromstring(zip_in.read(opf_path))
+    opf_folder = posixpath.dirname(opf_path)
+    title = package.findtext(f".//{DC_NAMESPACE}title", default="")
+    language = package.findtext(f".//{DC_NAMESPACE}language")
+
+    manifest = {}
+    for item in package.iterfind(f"{OPF_NAMESPACE}manifest/{OPF_NAMESPACE}item"):
+        path = posixpath.normpath(posixpath.join(opf_folder, unquote(item.get("href", ""))))
+        manifest[item.get("id")] = (path, item.get("media-type"))
+
+    documents = []
+    for itemref in package.iterfind(f"{OPF_NAMESPACE}spine/{OPF_NAMESPACE}itemref"):
+        path, media_type = manifest.get(itemref.get("idref"), (None, None))
+        if path in names and media_type in HTML_DOCUMENT_MEDIA_TYPES:
+            documents.append(path)
+    return title, language, documents
+
+
+class _HtmlBookWriter:
+
+    def __init__(self, zip_in: Optional[zipfile.ZipFile], documents: Optional[List[str]]):
+        self.zip_in = zip_in
+        self.names = set(zip_in.namelist()) if zip_in is not None else set()
+        # Each document becomes a section, whose id prefixes the ids of its elements to keep them unique
+        self.section_ids: Dict[str, str] = {document: f"doc{i}" for i, document in enumerate(documents or [])}
+        self.document = ""
+        self.fd: Optional[TextIO] = None
+
+    def write_document(self, document: str, root: ET.Element, fd: TextIO):
+        if document not in self.section_ids:
+            # Without spine, the sections are numbered as they come
+            self.section_ids[document] = f"doc{len(self.section_ids)}"
+        self.document = document
+        self.fd = fd
+        body = root.find(f"{XHTML_NAMESPACE}body")
+        if body is None:
+            logging.warning("No <body> in %s, skipped", document)
+            return
+
+        logging.debug("    Adding %s", document)
+        self.fd.write(f'<section id="{self.section_ids[document]}">')
+        self.fd.write(escape(body.text or ""))
+        for child in body:
+            self._write_element(child)
+        self.fd.write("</section>\n")
+
+    def _write_element(self, elem: ET.Element):
+        if not isinstance(elem.tag, str):
+            # Comments and processing instructions
+            self.fd.write(escape(elem.tail or ""))
+            return
+
+        namespace, tag = _split_tag(elem.tag)
+        attributes = []
+        if tag == "svg" and namespace == SVG_NAMESPACE:
+            attributes.append(("xmlns", SVG_NAMESPACE[1:-1]))
+        for name, value in elem.attrib.items():
+            attribute = self._convert_attribute(tag, name, value)
+            if attribute is not None:
+                attributes.append(attribute)
+
+        self.fd.write(f"<{tag}")
+        for name, value in attributes:
+            self.fd.write(f" {name}={quoteattr(value)}")
+
+        if namespace == XHTML_NAMESPACE and tag in VOID_ELEMENTS:
+            self.fd.write(">")
+        elif namespace != XHTML_NAMESPACE and not len(elem) and not elem.text:
+            # SVG and MathML elements can be self-closing
+            self.fd.write("/>")
+        else:
+            self.fd.write(">")
+            # The content of <script> and <style> is not parsed for entities in HTML
+            self.fd.write((elem.text or "") if tag in RAW_TEXT_ELEMENTS else escape(elem.text or ""))
+            for child in elem:
+                self._write_element(child)
+            self.fd.write(f"</{tag}>")
+        self.fd.write(escape(elem.tail or ""))
+
+    def _convert_attribute(self, tag: str, name: str, value: str) -> Optional[Tuple[str, str]]:
+        if name == "id":
+            return "id", self._element_id(self.document, value)
+        if name == XML_LANG:
+            return "lang", value
+        if name == "src" or (tag == "image" and name in {"href", XLINK_HREF}):
+            return ("src" if name == "src" else "href"), self._resource_url(value)
+        if name in {"href", XLINK_HREF}:
+            return "href", self._link_url(value)
+        if name.startswith("{"):
+            # Other namespaced attributes (epub:type, ...) have no meaning in HTML
+            return None
+        return name, value
+
+    def _element_id(self, document: str, element_id: str) -> str:
+        return f"{self.section_ids[document]}-{element_id}"
+
+    def _resolve(self, url: str) -> Optional[Tuple[str, str]]:
+        """
+        Path in the archive and fragment of a relative URL, or None for external ones.
+        """
+        parts = urlsplit(url)
+        if parts.scheme or parts.netloc:
+            return None
+        path = self.document
+        if parts.path:
+            path = posixpath.normpath(posixpath.join(posixpath.dirname(self.document), unquote(parts.path)))
+        return path, parts.fragment
+
+    def _link_url(self, url: str) -> str:
+        """
+        Links to the other documents of the book point to their section.
+        """
+        resolved = self._resolve(url)
+        if resolved is None or resolved[0] not in self.section_ids:
+            return url
+        path, fragment = resolved
+        return "#" + (self._element_id(path, fragment) if fragment else self.section_ids[path])
+
+    def _resource_url(self, url: str) -> str:
+        """
+        Images and other resources of the book are inlined as data URIs. They are encoded again each time
+        they are used, rather than kept, so that only one is held in memory at a time.
+        """
+        resolved = self._resolve(url)
+        if resolved is None or resolved[0] not in self.names:
+            return url
+        path = resolved[0]
+        media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        data = base64.b64encode(self.zip_in.read(path)).decode("ascii")
+        return f"data:{media_type};base64,{data}"
+
+
+def _split_tag(tag: str) -> Tuple[str, str]:
+    if tag.startswith("{"):
+        namespace, _, local_name = tag[1:].partition("}")
+        return "{" + namespace + "}", local_name
+    # Documents without namespace are taken as XHTML
+    return XHTML_NAMESPACE, tag
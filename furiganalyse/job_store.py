@@ -0,0 +1,179 @@
+"""
+Store of the web app's jobs, shared by all the uvicorn worker processes of a machine, so that the status
+of a job can be polled from any of them.
+
+The store is selected with the FURIGANALYSE_JOB_STORE environment variable:
+- "sqlite" (default): a SQLite database in WAL mode (many processes can read while one writes), at the path set by
+  FURIGANALYSE_JOB_STORE_PATH, which keeps the jobs across restarts
+- "memory": a dictionary, only for running the app in a single process
+
+Each job is stored as JSON under its uid, along with the uid of the job whose output folder holds its results
+(when it shares the result of an identical job), so that removing a folder removes all the jobs pointing to it.
+"""
+
+import logging
+import os
+import threading
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+from uuid import UUID, uuid4
+
+from pydantic import BaseModel, Field
+
+from furiganalyse.sqlite_db import SharedDatabase
+
+DEFAULT_JOB_STORE_PATH = "/tmp/furiganalyse-jobs.sqlite3"
+
+
+class Job(BaseModel):
+    uid: UUID = Field(default_factory=uuid4)
+    status: str = "in_progress"
+    result: str = None
+    # Result of each output format, `result` is the first one
+    results: Dict[str, str] = None
+    processed_files: int = None
+    skipped_files: int = None
+    # Time spent annotating the book, and converting it with calibre, in seconds
+    annotation_seconds: float = None
+    conversion_seconds: float = None
+    # While the job waits for its turn: its position in the queue, and the estimated time before it starts
+    queue_position: int = None
+    estimated_wait_seconds: float = None
+    # While the job runs: its current stage, how much of it is done, and the estimated time left
+    stage: str = None
+    progress_percent: float = None
+    eta_seconds: float = None
+
+
+class JobStore(ABC):
+    """
+    Jobs by uid. The jobs returned are copies: they must be put back for their changes to be seen.
+    """
+
+    @abstractmethod
+    def get(self, uid: UUID) -> Optional[Job]:
+        ...
+
+    @abstractmethod
+    def put(self, job: Job, source: Optional[UUID] = None):
+        """
+        Add or replace a job, `source` being the job whose output folder holds its results, if not its own.
+        """
+
+    @abstractmethod
+    def update_progress(self, uid: UUID, stage: str, percent: float, eta_seconds: Optional[float]):
+        """
+        Set the progress fields of the job `uid`, only if it is still in progress, leaving the others as they are:
+        the job may be completed or removed meanwhile by another process.
+        """
+
+    @abstractmethod
+    def delete(self, uid: UUID) -> List[UUID]:
+        """
+        Delete the job `uid` and the jobs sharing its results, returns the uids of the deleted jobs.
+        """
+
+    @abstractmethod
+    def __len__(self) -> int:
+        ...
+
+
+class MemoryJobStore(JobStore):
+    name = "memory"
+
+    def __init__(self):
+        self._jobs: Dict[UUID, Tuple[Job, Optional[UUID]]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, uid: UUID) -> Optional[Job]:
+        job, _ = self._jobs.get(uid, (None, None))
+        return job.model_copy(deep=True) if job is not None else None
+
+    def put(self, job: Job, source: Optional[UUID] = None):
+        with self._lock:
+            self._jobs[job.uid] = (job.model_copy(deep=True), source)
+
+    def update_progress(self, uid: UUID, stage: str, percent: float, eta_seconds: Optional[float]):
+        with self._lock:
+            job, _ = self._jobs.get(uid, (None, None))
+            if job is not None and job.status == "in_progress":
+                job.stage, job.progress_percent, job.eta_seconds = stage, percent, eta_seconds
+
+    def delete(self, uid: UUID) -> List[UUID]:
+        with self._lock:
+            deleted = [job_uid for job_uid, (_, source) in self._jobs.items() if job_uid == uid or source == uid]
+            for job_uid in deleted:
+                del self._jobs[job_uid]
+        return deleted
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+
+class SqliteJobStore(JobStore):
+    name = "sqlite"
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.environ.get("FURIGANALYSE_JOB_STORE_PATH", DEFAULT_JOB_STORE_PATH)
+        self.database = SharedDatabase(self.path)
+
+        connection = self.database.connection()
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (uid TEXT PRIMARY KEY, source TEXT, job TEXT NOT NULL) WITHOUT ROWID"
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS jobs_source ON jobs (source)")
+
+    def get(self, uid: UUID) -> Optional[Job]:
+        row = self.database.connection().execute("SELECT job FROM jobs WHERE uid = ?", (str(uid),)).fetchone()
+        return Job.model_validate_json(row[0]) if row is not None else None
+
+    def put(self, job: Job, source: Optional[UUID] = None):
+        self.database.connection().execute(
+            "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?)",
+            (str(job.uid), str(source) if source is not None else None, job.model_dump_json(exclude_none=True)),
+        )
+
+    def update_progress(self, uid: UUID, stage: str, percent: float, eta_seconds: Optional[float]):
+        # A single statement, so that it cannot overwrite a status set meanwhile. The fields left unset
+        # are removed, as the jobs are stored without their None fields
+        job, values = "job", []
+        for field_name, value in (("stage", stage), ("progress_percent", percent), ("eta_seconds", eta_seconds)):
+            if value is None:
+                job = f"json_remove({job}, '$.{field_name}')"
+            else:
+                job = f"json_set({job}, '$.{field_name}', ?)"
+                values.append(value)
+        self.database.connection().execute(
+            f"UPDATE jobs SET job = {job} WHERE uid = ? AND json_extract(job, '$.status') = 'in_progress'",
+            (*values, str(uid)),
+        )
+
+    def delete(self, uid: UUID) -> List[UUID]:
+        with self.database.transaction() as connection:
+            rows = connection.execute(
+                "SELECT uid FROM jobs WHERE uid = ? OR source = ?", (str(uid), str(uid))
+            ).fetchall()
+            connection.execute("DELETE FROM jobs WHERE uid = ? OR source = ?", (str(uid), str(uid)))
+        return [UUID(row[0]) for row in rows]
+
+    def __len__(self) -> int:
+        return self.database.connection().execute("SELECT count(*) FROM jobs").fetchone()[0]
+
+
+JOB_STORES = {
+    SqliteJobStore.name: SqliteJobStore,
+    MemoryJobStore.name: MemoryJobStore,
+}
+
+
+@lru_cache(maxsize=None)
+def get_job_store(name: str = None) -> JobStore:
+    """
+    Get the job store by name (defaults to the configured one).
+    """
+    name = name or os.environ.get("FURIGANALYSE_JOB_STORE", SqliteJobStore.name)
+    if name not in JOB_STORES:
+        raise ValueError(f"Unknown job store {name}, must be one of: {','.join(JOB_STORES)}")
+    logging.info("Using the %s job store", name)
+    return JOB_STORES[name]()
@@ -5,6 +5,7 @@ Word lists are stored as CSV files in the words_lists/ directory.
 Each file contains one word per line (the kanji/expression form).
 """
 
+import hashlib
 import logging
 import re
 import unicodedata
@@ -106,6 +107,16 @@ def load_word_list(name: str) -> Set[str]:
     return words
 
 
+@lru_cache(maxsize=16)
+def word_list_digest(name: str) -> str:
+    """
+    SHA-256 of the content of a word list file, to tell apart different versions of a list.
+    """
+    if not name.lower().endswith(".csv"):
+        name = name + ".csv"
+    return hashlib.sha256((WORDS_LISTS_DIR / name).read_bytes()).hexdigest()
+
+
 def load_word_list_from_path(filepath: str, limit: int = 0) -> Set[str]:
     """
     Load a word list from an arbitrary file path (for user uploads).
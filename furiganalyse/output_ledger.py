@@ -0,0 +1,147 @@
+"""
+Ledger of the job folders of the web app's output folder, shared by all the uvicorn worker processes of a machine.
+
+Each job folder is recorded when it is created, then its size when its uploads are written, and when its job is done
+with the size of its outputs: the total size of the output folder is known without walking it.
+The folders are evicted when they have not been used for a while, or, least recently used first, when the total size
+goes over the budget. The folders of the jobs in progress are never evicted, unless the process running them died.
+
+The ledger is kept in a SQLite database at FURIGANALYSE_OUTPUT_LEDGER_PATH. The folders are cleaned up by one
+worker process at a time, the one holding the lock file next to it.
+"""
+
+import fcntl
+import os
+import time
+from functools import lru_cache
+from typing import List, Set
+from uuid import UUID
+
+from furiganalyse.sqlite_db import SharedDatabase, process_exists
+
+DEFAULT_OUTPUT_LEDGER_PATH = "/tmp/furiganalyse-outputs.sqlite3"
+
+
+def folder_size(path: str) -> int:
+    """
+    Total size of the files in a folder and its subfolders.
+    """
+    size = 0
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                size += folder_size(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                size += entry.stat(follow_symlinks=False).st_size
+    return size
+
+
+class OutputLedger:
+    """
+    Size and last use of each job folder, and the pid of the process running its job if in progress.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.database = SharedDatabase(path)
+        self._janitor_lock = (None, None)
+
+        connection = self.database.connection()
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS folders ("
+            "uid TEXT PRIMARY KEY, size INTEGER NOT NULL, last_used REAL NOT NULL, pid INTEGER"
+            ") WITHOUT ROWID"
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS folders_last_used ON folders (last_used)")
+
+    def add(self, uid: UUID):
+        """
+        Record the folder of a job in progress, before it is created.
+        """
+        self.database.connection().execute(
+            "INSERT OR REPLACE INTO folders VALUES (?, 0, ?, ?)", (str(uid), time.time(), os.getpid())
+        )
+
+    def update(self, uid: UUID, size: int, in_progress: bool = True):
+        self.database.connection().execute(
+            "UPDATE folders SET size = ?, last_used = ?, pid = ? WHERE uid = ?",
+            (size, time.time(), os.getpid() if in_progress else None, str(uid)),
+        )
+
+    def adopt(self, uid: UUID, size: int, last_used: float):
+        """
+        Record a folder that was not recorded, e.g. created before the ledger was.
+        """
+        self.database.connection().execute(
+            "INSERT OR IGNORE INTO folders VALUES (?, ?, ?, NULL)", (str(uid), size, last_used)
+        )
+
+    def touch(self, uid: UUID):
+        """
+        Mark a folder as used, so that it is evicted later.
+        """
+        self.database.connection().execute("UPDATE folders SET last_used = ? WHERE uid = ?", (time.time(), str(uid)))
+
+    def remove(self, uid: UUID):
+        self.database.connection().execute("DELETE FROM folders WHERE uid = ?", (str(uid),))
+
+    def done_uids(self) -> Set[UUID]:
+        """
+        Folders whose jobs are not in progress.
+        """
+        return {UUID(uid) for uid, in self.database.connection().execute("SELECT uid FROM folders WHERE pid IS NULL")}
+
+    def evict(self, max_size: int, ttl: float) -> List[UUID]:
+        """
+        Remove from the ledger the folders unused for `ttl` seconds, and the least recently used ones until the total
+        size is under `max_size`, returns them for the caller to delete.
+        """
+        evicted = []
+        with self.database.transaction() as connection:
+            total_size = connection.execute("SELECT coalesce(sum(size), 0) FROM folders").fetchone()[0]
+            expiry = time.time() - ttl
+            live_pids = {}
+            for uid, size, last_used, pid in connection.execute(
+                "SELECT uid, size, last_used, pid FROM folders ORDER BY last_used"
+            ).fetchall():
+                if total_size <= max_size and last_used >= expiry:
+                    break
+                if pid is not None:
+                    if pid not in live_pids:
+                        live_pids[pid] = process_exists(pid)
+                    if live_pids[pid]:
+                        continue
+                evicted.append(uid)
+                total_size -= size
+            connection.executemany("DELETE FROM folders WHERE uid = ?", [(uid,) for uid in evicted])
+        return [UUID(uid) for uid in evicted]
+
+    def acquire_janitor(self) -> bool:
+        """
+        Whether this process is the one cleaning up the folders, holding the lock until it exits.
+        """
+        pid, fd = self._janitor_lock
+        if pid == os.getpid():
+            return True
+        fd = os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._janitor_lock = (os.getpid(), fd)
+        return True
+
+    def total_size(self) -> int:
+        return self.database.connection().execute("SELECT coalesce(sum(size), 0) FROM folders").fetchone()[0]
+
+    def __contains__(self, uid: UUID) -> bool:
+        return self.database.connection().execute("SELECT 1 FROM folders WHERE uid = ?", (str(uid),)).fetchone() is not None
+
+
+@lru_cache(maxsize=None)
+def get_output_ledger() -> OutputLedger:
+    """
+    Output ledger configured by the environment.
+    """
+    return OutputLedger(os.environ.get("FURIGANALYSE_OUTPUT_LEDGER_PATH", DEFAULT_OUTPUT_LEDGER_PATH))
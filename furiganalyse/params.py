@@ -20,4 +20,15 @@ class OutputFormat(str, Enum):
 class WritingMode(str, Enum):
     horizontal_tb = "horizontal-tb"
     vertical_rl = "vertical-rl"
-    vertical_lr = "vertical-lr"
\ No newline at end of file
+    vertical_lr = "vertical-lr"
+
+
+OUTPUT_FORMAT_TO_EXTENSION = {
+    OutputFormat.epub: ".epub",
+    OutputFormat.mobi: ".mobi",
+    OutputFormat.azw3: ".azw3",
+    OutputFormat.many_txt: ".zip",
+    OutputFormat.single_txt: ".txt",
+    OutputFormat.apkg: ".apkg",
+    OutputFormat.html: ".html",
+}
@@ -1,157 +1,432 @@
+import hashlib
 import logging
+import os
 import re
-from typing import Tuple, List, Iterable, Optional, Set
+from collections import OrderedDict
+from typing import Dict, Tuple, List, Iterable, Iterator, NamedTuple, Optional, Set
 from xml.etree import ElementTree as ET
 
-from furigana.furigana import create_furigana_html
+from furigana.furigana import split_furigana
 
+from furiganalyse.disk_cache import get_persistent_reading_cache
 from furiganalyse.params import FuriganaMode
+from furiganalyse.xml_engine import get_xml_engine
 
 NAMESPACE = "{http://www.w3.org/1999/xhtml}"
+RUBY_TAG = NAMESPACE + "ruby"
+RT_TAG = NAMESPACE + "rt"
+P_TAG = NAMESPACE + "p"
 
 
 def process_html(
     inputfile: str, mode: FuriganaMode, exclude_words: Optional[Set[str]] = None
 ) -> ET.ElementTree:
-    tree = ET.parse(inputfile)
+    tree = get_xml_engine().parse(inputfile)
     process_tree(tree, mode, exclude_words)
     return tree
 
 
 def process_tree(
-    tree: ET.ElementTree, mode: FuriganaMode, exclude_words: Optional[Set[str]] = None
+    tree: ET.ElementTree,
+    mode: FuriganaMode,
+    exclude_words: Optional[Set[str]] = None,
 ):
-    parent_map = dict((c, p) for p in tree.iter() for c in p)
+    """
+    Add, replace or remove the furigana of a parsed XHTML document (or element), in linear time.
+
+    Every text segment of the document is collected first and annotated in a single `annotate_segments` pass.
+    """
+    root = tree.getroot() if hasattr(tree, "getroot") else tree
 
     if mode in {"remove", "replace"}:
-        remove_existing_furigana(tree, parent_map)
+        remove_existing_furigana(root)
 
     if mode in {"add", "replace"}:
-        ps = tree.findall(f'.//{NAMESPACE}*')
-        for p in ps:
-            # Exclude ruby related tags, we don't want to override them (unless we have removed them before)
-            if not inside_ruby_subtag(p, parent_map):
-                logging.debug(f">>> BEFORE {p.tag} > '{p.text}' {list(p)} '{p.tail}'")
-                process_head(p, exclude_words)
-                process_tail(p, parent_map[p], exclude_words)
-                logging.debug(f">>> AFTER  {p.tag} > '{p.text}' {list(p)} '{p.tail}'")
+        segments = collect_segments(root)
+
+        texts = [text for _, _, _, text in segments]
+        # New elements must be created by the same XML engine as the tree
+        annotations = annotate_segments(texts, exclude_words, makeelement=root.makeelement)
+        splice_segments(segments, annotations)
+
+
+RUBY_SUBTAGS = ("rt", "rb", "rp")
 
-        # Add the namespace to our new elements
-        elems = tree.findall('.//{}*')
-        for elem in elems:
-            elem.tag = NAMESPACE + elem.tag
+
+Segment = Tuple[ET.Element, Optional[ET.Element], int, str]
+
+
+def has_parent_pointers(elem: ET.Element) -> bool:
+    """
+    lxml elements know their parent, which allows looking up what we need without walking the whole tree.
+    """
+    return hasattr(elem, "getparent")
 
 
-def inside_ruby_subtag(elem: ET.Element, parent_map):
+def collect_segments(root: ET.Element) -> List[Segment]:
     """
-    Returns True if any of the ascendant tags is a ruby subtag (<rt>, <rb> or <rp>)
+    Collect the kanji-bearing text segments below the root, in document order, in a single walk.
+    Each segment is (element, parent, index in parent, text): the parent is None for the text before
+    the element's children ("head"), and set for the text that follows the element ("tail").
+    With lxml, the index is -1, as the rubies can be inserted next to the element directly.
     """
+    if has_parent_pointers(root):
+        return _collect_segments_from_text_nodes(root)
+
+    segments = []
+    # Iterative depth first walk, carrying whether we are inside a ruby subtag (<rt>, <rb> or <rp>)
+    stack = [(root, enumerate(root), False)]
+    while stack:
+        parent, children, parent_inside_ruby = stack[-1]
+        index, elem = next(children, (None, None))
+        if elem is None:
+            stack.pop()
+            continue
+        if not isinstance(elem.tag, str):
+            # Comments and processing instructions (kept by lxml), only their tail is part of the text
+            if elem.tail and not parent_inside_ruby:
+                text = elem.tail.strip()
+                if contains_kanji(text):
+                    segments.append((elem, parent, index, text))
+            continue
+
+        # Exclude ruby related tags, we don't want to override them (unless we have removed them before)
+        inside_ruby = parent_inside_ruby or elem.tag.endswith(RUBY_SUBTAGS)
+        if not inside_ruby and elem.tag.startswith(NAMESPACE):
+            if elem.text and not elem.tag.endswith("ruby"):
+                text = elem.text.strip()
+                if contains_kanji(text):
+                    segments.append((elem, None, 0, text))
+
+            if elem.tail:
+                text = elem.tail.strip()
+                if contains_kanji(text):
+                    segments.append((elem, parent, index, text))
+
+        stack.append((elem, enumerate(elem), inside_ruby))
+    return segments
+
+
+def _collect_segments_from_text_nodes(root) -> List[Segment]:
+    """
+    lxml version of `collect_segments`: only the kanji-bearing text nodes are looked at,
+    and we check their ancestors.
+    """
+    segments = []
+    seen = set()
+    inside_ruby = {}
+    for text_node in root.xpath("descendant::text()"):
+        if not kanji_pattern.search(text_node):
+            continue
+        elem = text_node.getparent()
+        is_tail = text_node.is_tail
+        if elem is root or (elem, is_tail) in seen:
+            continue
+        seen.add((elem, is_tail))
+
+        if not isinstance(elem.tag, str):
+            # Comments, processing instructions and entities: only their tail is part of the text
+            if is_tail and not inside_ruby_subtag(elem.getparent(), inside_ruby):
+                segments.append((elem, elem.getparent(), -1, elem.tail.strip()))
+            continue
+
+        # Exclude ruby related tags, we don't want to override them (unless we have removed them before)
+        if not elem.tag.startswith(NAMESPACE) or inside_ruby_subtag(elem, inside_ruby):
+            continue
+        if is_tail:
+            segments.append((elem, elem.getparent(), -1, elem.tail.strip()))
+        elif not elem.tag.endswith("ruby"):
+            segments.append((elem, None, 0, elem.text.strip()))
+    return segments
+
+
+def inside_ruby_subtag(elem, memo: Dict[ET.Element, bool]) -> bool:
+    """
+    Returns True if the element or any of its ascendants is a ruby subtag (<rt>, <rb> or <rp>), lxml only.
+    The result for each ascendant is memoized, as siblings share most of their ascendants.
+    """
+    path = []
+    result = False
     while elem is not None:
-        if any((elem.tag.endswith(tag) for tag in {"rt", "rb", "rp"})):
-            return True
-        elem = parent_map.get(elem)
-    return False
+        if elem in memo:
+            result = memo[elem]
+            break
+        path.append(elem)
+        if isinstance(elem.tag, str) and elem.tag.endswith(RUBY_SUBTAGS):
+            result = True
+            break
+        elem = elem.getparent()
+    for visited in path:
+        # Keyed by the elements themselves, as lxml reuses the ids of the proxies it frees
+        memo[visited] = result
+    return result
+
+
+def splice_segments(
+    segments: List[Segment], annotations: List[Tuple[str, List[ET.Element], str]]
+):
+    """
+    Replace each collected segment by its annotation: the "head" text followed by the <ruby> children.
+    """
+    # Rubies following an element's tail are grouped by parent, to rebuild each parent's children once
+    tail_insertions = {}
+    for (elem, parent_elem, index, _), (head, children, _) in zip(segments, annotations):
+        if parent_elem is None:
+            continue
+        logging.debug(f">>> TAIL {elem.tag} > '{elem.tail}' -> '{head}' {children}")
+        # Replace the original tail by the rubys "head", the ruby children go just after the element
+        elem.tail = head
+        if index < 0:
+            for child in reversed(children):
+                elem.addnext(child)
+            continue
+        tail_insertions.setdefault(id(parent_elem), (parent_elem, []))[1].append((index, children))
+
+    # Tail insertions first, as the indices refer to the original children
+    for parent_elem, insertions in tail_insertions.values():
+        original_children = list(parent_elem)
+        new_children = []
+        start = 0
+        for index, children in insertions:
+            new_children.extend(original_children[start:index + 1])
+            new_children.extend(children)
+            start = index + 1
+        new_children.extend(original_children[start:])
+        parent_elem[:] = new_children
+
+    for (elem, parent_elem, _, _), (head, children, _) in zip(segments, annotations):
+        if parent_elem is not None:
+            continue
+        logging.debug(f">>> HEAD {elem.tag} > '{elem.text}' -> '{head}' {children}")
+        # Replace the original text by the ruby childs "head", and insert the children at the beginning
+        elem.text = head
+        elem[0:0] = children
 
 
-def remove_existing_furigana(tree: ET.ElementTree, parent_map: dict):
+def remove_existing_furigana(root: ET.Element):
     """
     Replace all existing ruby elements by their text, e.g., <ruby>X<rt>Y</rt></ruby> becomes X.
     """
-    elems = tree.findall(f'.//{NAMESPACE}ruby')
-    for elem in elems:
-        # Remove all the <rt> children, e.g., the readings, but keep the text from other childs
-        childs_text = []
-        for child in list(elem):
-            if not child.tag.endswith("rt") and not child.tag.endswith("rp"):
-                text = (child.text or "") + (child.tail or "")
-            else:
-                text = child.tail or ""
-            childs_text.append(text)
-            elem.remove(child)
-
-        # Replacing the node the its text, childs text and tail
-        new_text = (elem.text or "") + "".join(childs_text) + (elem.tail or "")
-
-        parent_elem = parent_map[elem]
-
-        # Find the previous child to append our new text to it
-        idx = list(parent_elem).index(elem)
-        if idx == 0:
-            # If our element was the first child, append to parent node's text
-            parent_elem.text = (parent_elem.text or "") + new_text
-        else:
-            # Otherwise, append to the tail of previous children
-            previous_elem = parent_elem[idx - 1]
-            previous_elem.tail = (previous_elem.tail or "") + new_text
+    if has_parent_pointers(root):
+        # Find the ruby elements directly, and only rebuild their parents
+        parents = {}
+        for elem in root.iter(RUBY_TAG):
+            parent_elem = elem.getparent()
+            parents.setdefault(id(parent_elem), parent_elem)
+        for parent_elem in parents.values():
+            remove_ruby_children(parent_elem)
+        return
 
-        # Finally, remove our ruby element from its parent
-        parent_elem.remove(elem)
+    stack = [root]
+    while stack:
+        parent_elem = stack.pop()
+        if any(child.tag == RUBY_TAG for child in parent_elem):
+            remove_ruby_children(parent_elem)
+        stack.extend(parent_elem)
 
 
-def process_head(elem: ET.Element, exclude_words: Optional[Set[str]] = None):
+def remove_ruby_children(parent_elem: ET.Element):
     """
-    Process the text that is before the children of the given element.
+    Rebuild the children list once, merging the text of the ruby elements into the previous child
+    tail, or in the parent node's text if the ruby element was the first child.
     """
-    if not elem.text or elem.tag.endswith("ruby"):
-        return
+    kept_children = []
+    for elem in parent_elem:
+        if elem.tag != RUBY_TAG:
+            kept_children.append(elem)
+            continue
+
+        new_text = ruby_element_text(elem)
+        if kept_children:
+            previous_elem = kept_children[-1]
+            previous_elem.tail = (previous_elem.tail or "") + new_text
+        else:
+            parent_elem.text = (parent_elem.text or "") + new_text
 
-    text = elem.text.strip()
-    if contains_kanji(text):
+    parent_elem[:] = kept_children
 
-        head, children, tail = create_parsed_furigana_html(text, exclude_words)
 
-        # Replace the original text by the ruby childs "head"
-        elem.text = head
+def ruby_element_text(elem: ET.Element) -> str:
+    """
+    Text of a ruby element without its readings, followed by its tail.
+    """
+    # Drop the <rt> and <rp> children, e.g., the readings, but keep the text from other childs
+    childs_text = []
+    for child in elem:
+        if not isinstance(child.tag, str) or child.tag.endswith("rt") or child.tag.endswith("rp"):
+            childs_text.append(child.tail or "")
+        else:
+            childs_text.append((child.text or "") + (child.tail or ""))
 
-        # Insert the children at the beginning
-        for child in reversed(children):
-            elem.insert(0, child)
+    return (elem.text or "") + "".join(childs_text) + (elem.tail or "")
 
 
-def process_tail(
-    elem: ET.Element, parent_elem: ET.Element, exclude_words: Optional[Set[str]] = None
-):
+class ReadingCacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+
+
+class ReadingCache:
     """
-    Process the text that is before the children of the given element.
+    Bounded LRU cache of furigana tokens, keyed on the text and the exclude words fingerprint.
     """
-    if not elem.tail:
-        return
 
-    text = elem.tail.strip()
-    if contains_kanji(text):
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
 
-        head, children, tail = create_parsed_furigana_html(text, exclude_words)
+    def get(self, key: Tuple[str, str]):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
 
-        # Replace the original tail by the rubys "head"
-        elem.tail = head
+    def put(self, key: Tuple[str, str], entry) -> None:
+        if self.maxsize <= 0:
+            return
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def info(self) -> ReadingCacheInfo:
+        return ReadingCacheInfo(self.hits, self.misses, self.maxsize, len(self._entries))
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+READING_CACHE_SIZE = int(os.environ.get("FURIGANALYSE_READING_CACHE_SIZE", 10_000))
+
+reading_cache = ReadingCache(READING_CACHE_SIZE)
+
+# Last computed fingerprint, the word list object is kept alive so its id cannot be reused
+_last_fingerprint: Tuple[Optional[Set[str]], str] = (None, "")
 
-        # Insert the ruby children just after the element
-        idx = list(parent_elem).index(elem)
-        for child in reversed(children):
-            parent_elem.insert(idx + 1, child)
+
+def exclude_words_fingerprint(exclude_words: Optional[Set[str]]) -> str:
+    """
+    Stable fingerprint of an exclude words list, used as part of the cache keys.
+    """
+    global _last_fingerprint
+    if not exclude_words:
+        return ""
+    if _last_fingerprint[0] is exclude_words:
+        return _last_fingerprint[1]
+    digest = hashlib.sha1("\n".join(sorted(exclude_words)).encode("utf-8")).hexdigest()
+    _last_fingerprint = (exclude_words, digest)
+    return digest
+
+
+# A token is either (text,) for text without furigana, or (kanji, reading)
+Token = Tuple[str, ...]
 
 
 def create_parsed_furigana_html(
-    text: str, exclude_words: Optional[Set[str]] = None
+    text: str, exclude_words: Optional[Set[str]] = None, makeelement=ET.Element
 ) -> Tuple[str, List[ET.Element], str]:
     """
     Generate the furigana and return it parsed: "head" text, <ruby> children, "tail" text.
+    Tokens are memoized in `reading_cache`, the returned children are always new elements.
     """
-    try:
-        new_text = create_furigana_html(text, exclude_words=exclude_words)
-    except Exception:
-        logging.warning("Something wrong happened when retrieving furigana for '%s'", text)
-        new_text = text
+    return build_ruby_elements(tokenize_furigana(text, exclude_words), makeelement)
 
-    # Need to wrap the children <ruby> elements in something to parse them
-    try:
-        elem = ET.fromstring(f"""<p>{new_text}</p>""")
-    except ET.ParseError:
-        logging.error(f"XML parsing failed for {new_text}, which was generated from: {text}")
-        raise
 
-    # Return the parts that will need to be integrated in the XML tree
-    return elem.text, list(elem), elem.tail
+def annotate_segments(
+    texts: List[str], exclude_words: Optional[Set[str]] = None, makeelement=ET.Element
+) -> List[Tuple[str, List[ET.Element], str]]:
+    """
+    Bulk version of `create_parsed_furigana_html`, for all the segments of a document:
+    each distinct text goes through the caches and tokenizer only once, the persistent cache is queried
+    for all of them at once.
+    """
+    fingerprint = exclude_words_fingerprint(exclude_words)
+    tokens_by_text = _cached_tokenize_furigana(list(dict.fromkeys(texts)), exclude_words, fingerprint)
+    return [build_ruby_elements(tokens_by_text[text], makeelement) for text in texts]
+
+
+def tokenize_furigana(text: str, exclude_words: Optional[Set[str]] = None) -> Tuple[Token, ...]:
+    """
+    Split the text in tokens with their readings, going through the reading caches.
+    """
+    return _cached_tokenize_furigana([text], exclude_words, exclude_words_fingerprint(exclude_words))[text]
+
+
+def _cached_tokenize_furigana(
+    texts: List[str], exclude_words: Optional[Set[str]], fingerprint: str
+) -> Dict[str, Tuple[Token, ...]]:
+    """
+    Tokens of the given distinct texts, from the in-memory cache, then the persistent cache (if enabled),
+    and finally from the tokenizer.
+    """
+    tokens_by_text = {}
+    missing_texts = []
+    for text in texts:
+        tokens = reading_cache.get((text, fingerprint))
+        if tokens is None:
+            missing_texts.append(text)
+        else:
+            tokens_by_text[text] = tokens
+
+    if not missing_texts:
+        return tokens_by_text
+
+    persistent_cache = get_persistent_reading_cache()
+    found = persistent_cache.get_many(missing_texts, fingerprint) if persistent_cache is not None else {}
+
+    tokenized = {}
+    for text in missing_texts:
+        tokens = found.get(text)
+        if tokens is None:
+            try:
+                tokens = tokenized[text] = tuple(
+                    tuple(pair) for pair in split_furigana(text, exclude_words=exclude_words)
+                )
+            except Exception:
+                logging.warning("Something wrong happened when retrieving furigana for '%s'", text)
+                tokens = ((text,),)
+        reading_cache.put((text, fingerprint), tokens)
+        tokens_by_text[text] = tokens
+
+    if persistent_cache is not None:
+        persistent_cache.put_many(tokenized, fingerprint)
+
+    return tokens_by_text
+
+
+def build_ruby_elements(
+    tokens: Iterable[Token], makeelement=ET.Element
+) -> Tuple[str, List[ET.Element], str]:
+    """
+    Build the namespaced <ruby> elements for the tokens: "head" text, <ruby> children, "tail" text.
+    Text without furigana goes to the head, or to the tail of the previous <ruby>.
+    `makeelement` is the element factory of the XML engine, e.g., the `makeelement` of an existing element.
+    """
+    head = None
+    children = []
+    for token in tokens:
+        if len(token) == 2:
+            kanji, reading = token
+            ruby = makeelement(RUBY_TAG, {})
+            ruby.text = kanji
+            rt = makeelement(RT_TAG, {})
+            rt.text = reading
+            ruby.append(rt)
+            children.append(ruby)
+        elif children:
+            children[-1].tail = (children[-1].tail or "") + token[0]
+        else:
+            head = (head or "") + token[0]
+    return head, children, None
 
 
 kanji_pattern = re.compile("[一-龯]")
@@ -161,18 +436,87 @@ def contains_kanji(text: str) -> bool:
     return bool(kanji_pattern.search(text))
 
 
-def convert_html_to_txt(tree, outputfile):
-    with open(outputfile, "w") as fd:
-        for line in convert_html_to_txt_lines(tree):
-            fd.write(line)
+ruby_tag_pattern = re.compile(r"<(?:[\w.-]+:)?ruby[\s/>]")
+xml_encoding_pattern = re.compile(rb"""^<\?xml[^>]*encoding=["']([^"']+)["']""")
+
+
+def needs_processing(content: bytes, mode: FuriganaMode) -> bool:
+    """
+    Cheap prescan of a raw XHTML document, telling if processing it could change anything:
+    there must be kanji to annotate (add mode), or ruby elements to remove (remove mode).
+    When in doubt (other encodings, character references that may hide kanji), the document is processed.
+    """
+    match = xml_encoding_pattern.match(content)
+    if match and match.group(1).lower() not in {b"utf-8", b"utf8", b"us-ascii", b"ascii"}:
+        return True
+    try:
+        text = content.decode("utf-8")
+    except UnicodeDecodeError:
+        return True
+
+    if mode in {"remove", "replace"} and ruby_tag_pattern.search(text):
+        return True
+    if mode in {"add", "replace"} and (kanji_pattern.search(text) or "&#" in text):
+        return True
+    return False
+
+
+def convert_html_to_txt_lines(tree) -> Iterator[str]:
+    """
+    Text of each paragraph, with the readings in parentheses after the words, e.g. "漢字(かんじ)",
+    in a single pass over the tree, which is left as it is.
+    """
+    for tokens in iter_paragraph_tokens(tree):
+        yield format_tokens(tokens)
 
 
-def convert_html_to_txt_lines(tree) -> Iterable[str]:
-    rts = tree.findall(f'.//{NAMESPACE}rt')
-    for rt in rts:
-        rt.text = "(" + (rt.text or "")
-        rt.tail = (rt.tail or "") + ")"
+# Tokens of a paragraph, its tail included
+Paragraph = Tuple[Token, ...]
 
-    ps = tree.findall(f'.//{NAMESPACE}p')
-    for p in ps:
-        yield ET.tostring(p, encoding="utf-8", method="text").decode("utf-8")
\ No newline at end of file
+
+def iter_paragraph_tokens(tree) -> Iterator[Paragraph]:
+    """
+    Tokens of each paragraph of an annotated tree: (text,) for the text, (kanji, reading) for the <ruby> elements,
+    so that the tokens of the annotation are available to the text outputs without tokenizing the text again.
+    """
+    root = tree.getroot() if hasattr(tree, "getroot") else tree
+    for p in root.iter(P_TAG):
+        tokens = []
+        _collect_tokens(p, tokens)
+        if p.tail:
+            tokens.append((p.tail,))
+        yield tuple(tokens)
+
+
+def _collect_tokens(elem, tokens: List[Token]):
+    if elem.text:
+        tokens.append((elem.text,))
+    for child in elem:
+        if child.tag == RUBY_TAG:
+            _collect_ruby_tokens(child, tokens)
+        elif isinstance(child.tag, str):
+            _collect_tokens(child, tokens)
+        # Comments and processing instructions only have a tail
+        if child.tail:
+            tokens.append((child.tail,))
+
+
+def _collect_ruby_tokens(ruby, tokens: List[Token]):
+    """
+    A token per <rt>, whose kanji are the text before it, e.g. "<ruby>漢<rt>かん</rt>字<rt>じ</rt></ruby>"
+    gives ("漢", "かん"), ("字", "じ"). The <rp> parentheses are dropped.
+    """
+    kanji = [ruby.text or ""]
+    for child in ruby:
+        if child.tag == RT_TAG:
+            tokens.append(("".join(kanji), "".join(child.itertext())))
+            kanji = []
+        elif isinstance(child.tag, str) and not child.tag.endswith("rp"):
+            kanji.extend(child.itertext())
+        kanji.append(child.tail or "")
+    if "".join(kanji):
+        tokens.append(("".join(kanji),))
+
+
+def format_tokens(tokens: Iterable[Token]) -> str:
+    return "".join(token[0] if len(token) == 1 else f"{token[0]}({token[1]})" for token in tokens)
@@ -0,0 +1,68 @@
+"""
+Progress of a conversion, reported by stages: converting the input to EPUB, annotating its documents,
+and writing the other output formats.
+
+Each stage covers a fixed share of the percentage, the estimated remaining time is extrapolated
+from the time spent so far. The progress is published at most every PUBLISH_INTERVAL seconds,
+and on every change of stage.
+"""
+
+import time
+from enum import Enum
+from typing import Callable, NamedTuple, Optional
+
+# Minimum seconds between two publications of the progress within a stage
+PUBLISH_INTERVAL = 1.0
+
+
+class Stage(str, Enum):
+    converting_input = "converting_input"
+    annotating = "annotating"
+    writing_output = "writing_output"
+
+
+# Percentage at which each stage starts, and its share of the total
+STAGE_RANGES = {
+    Stage.converting_input: (0.0, 10.0),
+    Stage.annotating: (10.0, 80.0),
+    Stage.writing_output: (90.0, 10.0),
+}
+
+
+class Progress(NamedTuple):
+    stage: Stage
+    percent: float
+    eta_seconds: Optional[float]  # None at the start of a stage
+
+
+class ProgressReporter:
+
+    def __init__(self, publish: Callable[[Progress], None]):
+        self.publish = publish
+        self.start = time.monotonic()
+        self.stage: Optional[Stage] = None
+        self.last_publication = 0.0
+
+    def start_stage(self, stage: Stage):
+        self.stage = stage
+        self._publish(0, 1, force=True)
+
+    def advance(self, done: int, total: int):
+        """
+        Report that `done` of the `total` steps of the current stage are done.
+        """
+        self._publish(done, total, force=done >= total)
+
+    def _publish(self, done: int, total: int, force: bool):
+        now = time.monotonic()
+        if not force and now - self.last_publication < PUBLISH_INTERVAL:
+            return
+        self.last_publication = now
+
+        stage_start, stage_share = STAGE_RANGES[self.stage]
+        percent = stage_start + stage_share * (done / total if total else 1.0)
+        elapsed = now - self.start
+        # Nothing to extrapolate from at the start of a stage
+        eta_seconds = elapsed * (100.0 - percent) / percent if done > 0 else None
+        self.publish(Progress(self.stage, round(percent, 1), eta_seconds))
+
@@ -0,0 +1,212 @@
+"""
+Cache of the web app's job results, keyed by the content of the job (uploaded file, parameters, word list
+and dictionary), so that converting again a book that was just converted is instant.
+
+Identical jobs submitted while the first one is still running are attached to it, instead of being processed
+again. The results are the output files of the jobs that produced them, so they follow the cleanup
+of the output folder.
+
+Like the jobs, the results and the jobs in flight are kept in the database of the job store, so that the identical
+jobs are found whichever uvicorn worker process they are submitted to (in memory with FURIGANALYSE_JOB_STORE=memory).
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Union
+from uuid import UUID
+
+from furiganalyse.disk_cache import dictionary_identity
+from furiganalyse.job_store import DEFAULT_JOB_STORE_PATH, MemoryJobStore, SqliteJobStore
+from furiganalyse.sqlite_db import SharedDatabase, process_exists
+
+
+def job_cache_key(
+    upload_digest: str,
+    output_format: Union[str, List[str]],
+    furigana_mode: str,
+    writing_mode: str,
+    word_list_digest: str = "",
+    word_list_limit: int = 0,
+    streaming: bool = False,
+) -> str:
+    """
+    Content-addressed key of a job, from the SHA-256 digests of the uploaded file and word list.
+    """
+    parameters = {
+        "upload": upload_digest,
+        "output_format": output_format,
+        "furigana_mode": furigana_mode,
+        "writing_mode": writing_mode,
+        "word_list": word_list_digest,
+        "word_list_limit": word_list_limit,
+        "streaming": streaming,
+        "dictionary": dictionary_identity(),
+    }
+    return hashlib.sha256(json.dumps(parameters, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class CachedResult(NamedTuple):
+    uid: UUID  # Job that produced the result, its folder holds the output files
+    result: str
+    results: Dict[str, str]
+    processed_files: Optional[int] = None
+    skipped_files: Optional[int] = None
+
+
+class ResultCache(ABC):
+    """
+    Results by job key, and the jobs in flight for each key.
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[CachedResult]:
+        ...
+
+    @abstractmethod
+    def attach(self, key: str, uid: UUID) -> bool:
+        """
+        Attach the job `uid` to the in-flight job with the same key, returns False if there is none:
+        the job will then be processed, and the next identical jobs attached to it.
+        """
+
+    @abstractmethod
+    def complete(self, key: str, cached: Optional[CachedResult]) -> List[UUID]:
+        """
+        Record the result of the in-flight job (None if it failed), returns the jobs attached to it.
+        """
+
+    @abstractmethod
+    def invalidate(self, uid: UUID):
+        """
+        Forget the results produced by the job `uid`, whose output was removed.
+        The jobs sharing them are removed with it from the job store.
+        """
+
+    @abstractmethod
+    def __len__(self) -> int:
+        ...
+
+
+class MemoryResultCache(ResultCache):
+    name = MemoryJobStore.name
+
+    def __init__(self):
+        self._results: Dict[str, CachedResult] = {}
+        # Jobs attached to the in-flight job of each key
+        self._in_flight: Dict[str, List[UUID]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[CachedResult]:
+        return self._results.get(key)
+
+    def attach(self, key: str, uid: UUID) -> bool:
+        with self._lock:
+            followers = self._in_flight.get(key)
+            if followers is None:
+                self._in_flight[key] = []
+                return False
+            followers.append(uid)
+            return True
+
+    def complete(self, key: str, cached: Optional[CachedResult]) -> List[UUID]:
+        with self._lock:
+            followers = self._in_flight.pop(key, [])
+            if cached is not None:
+                self._results[key] = cached
+        return followers
+
+    def invalidate(self, uid: UUID):
+        with self._lock:
+            for key in [key for key, cached in self._results.items() if cached.uid == uid]:
+                del self._results[key]
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+
+class SqliteResultCache(ResultCache):
+    """
+    The job in flight for a key is recorded with the pid of its process: if that process died,
+    the next identical job takes over, along with the jobs attached to it.
+    """
+    name = SqliteJobStore.name
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.environ.get("FURIGANALYSE_JOB_STORE_PATH", DEFAULT_JOB_STORE_PATH)
+        self.database = SharedDatabase(self.path)
+
+        connection = self.database.connection()
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, uid TEXT NOT NULL, result TEXT NOT NULL)"
+            " WITHOUT ROWID"
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS results_uid ON results (uid)")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS in_flight (key TEXT PRIMARY KEY, uid TEXT NOT NULL, pid INTEGER NOT NULL)"
+            " WITHOUT ROWID"
+        )
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS followers (uid TEXT PRIMARY KEY, key TEXT NOT NULL) WITHOUT ROWID"
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS followers_key ON followers (key)")
+
+    def get(self, key: str) -> Optional[CachedResult]:
+        row = self.database.connection().execute("SELECT result FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        uid, result, results, processed_files, skipped_files = json.loads(row[0])
+        return CachedResult(UUID(uid), result, results, processed_files, skipped_files)
+
+    def attach(self, key: str, uid: UUID) -> bool:
+        with self.database.transaction() as connection:
+            row = connection.execute("SELECT pid FROM in_flight WHERE key = ?", (key,)).fetchone()
+            if row is None or not process_exists(row[0]):
+                connection.execute(
+                    "INSERT OR REPLACE INTO in_flight VALUES (?, ?, ?)", (key, str(uid), os.getpid())
+                )
+                return False
+            connection.execute("INSERT INTO followers VALUES (?, ?)", (str(uid), key))
+            return True
+
+    def complete(self, key: str, cached: Optional[CachedResult]) -> List[UUID]:
+        with self.database.transaction() as connection:
+            followers = [
+                UUID(uid) for uid, in connection.execute("SELECT uid FROM followers WHERE key = ?", (key,))
+            ]
+            connection.execute("DELETE FROM followers WHERE key = ?", (key,))
+            connection.execute("DELETE FROM in_flight WHERE key = ?", (key,))
+            if cached is not None:
+                connection.execute(
+                    "INSERT OR REPLACE INTO results VALUES (?, ?, ?)",
+                    (key, str(cached.uid), json.dumps([str(cached.uid), *cached[1:]])),
+                )
+        return followers
+
+    def invalidate(self, uid: UUID):
+        self.database.connection().execute("DELETE FROM results WHERE uid = ?", (str(uid),))
+
+    def __len__(self) -> int:
+        return self.database.connection().execute("SELECT count(*) FROM results").fetchone()[0]
+
+
+RESULT_CACHES = {
+    SqliteResultCache.name: SqliteResultCache,
+    MemoryResultCache.name: MemoryResultCache,
+}
+
+
+@lru_cache(maxsize=None)
+def get_result_cache(name: str = None) -> ResultCache:
+    """
+    Get the result cache by name (defaults to the one of the configured job store).
+    """
+    name = name or os.environ.get("FURIGANALYSE_JOB_STORE", SqliteResultCache.name)
+    if name not in RESULT_CACHES:
+        raise ValueError(f"Unknown result cache {name}, must be one of: {','.join(RESULT_CACHES)}")
+    logging.info("Using the %s result cache", name)
+    return RESULT_CACHES[name]()
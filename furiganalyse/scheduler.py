@@ -0,0 +1,203 @@
+"""
+Scheduler of the web app's jobs, shared by all the uvicorn worker processes of a machine.
+
+At most FURIGANALYSE_MAX_RUNNING_JOBS jobs run at once on the machine, whichever worker received them (defaults to
+the number of CPUs divided by FURIGANALYSE_WORKERS_PER_JOB), and at most FURIGANALYSE_MAX_QUEUED_JOBS wait for
+their turn (defaults to 50): the next ones are rejected, and should be submitted again later.
+Each of the WEB_CONCURRENCY uvicorn worker processes runs its share of these jobs, with a pool of as many processes.
+
+The waiting jobs are taken by order of submission time plus estimated cost, so that small books are not stuck
+behind big ones, while a big book is only overtaken by the books submitted less than its cost (taken as seconds)
+after it.
+The cost of a job is estimated from the size and format of the upload, and converted to seconds with the average
+duration of the last jobs, which also gives the estimated waiting time of the queued jobs.
+
+The state is kept in a SQLite database at FURIGANALYSE_SCHEDULER_PATH, the waiting jobs poll it for their turn.
+"""
+
+import asyncio
+import math
+import os
+import sqlite3
+import time
+from functools import lru_cache
+from typing import NamedTuple, Optional
+from uuid import UUID
+
+from furiganalyse.sqlite_db import SharedDatabase, process_exists
+
+DEFAULT_SCHEDULER_PATH = "/tmp/furiganalyse-scheduler.sqlite3"
+
+# Seconds between two checks of a waiting job for its turn
+POLL_INTERVAL = 0.5
+
+# Relative cost of a megabyte of each input format: text is denser than EPUB (which holds images, fonts and markup),
+# and MOBI/AZW3 books are converted with calibre on top of it
+FORMAT_COSTS = {
+    ".txt": 3.0,
+    ".html": 1.5,
+    ".epub": 1.0,
+    ".mobi": 2.0,
+    ".azw3": 2.0,
+}
+
+# Cost of any job, to account for the startup and the output conversions
+BASE_COST = 1.0
+
+# Initial estimate of the seconds per cost unit, refined with an exponential moving average of the jobs' durations
+DEFAULT_SECONDS_PER_COST = 5.0
+SECONDS_PER_COST_SMOOTHING = 0.2
+
+
+class QueueFull(Exception):
+    pass
+
+
+class QueuePosition(NamedTuple):
+    position: int  # 1 for the next job to start, 0 once running
+    wait_seconds: float  # Estimated time before the job starts
+
+
+def estimate_cost(size: int, extension: str) -> float:
+    """
+    Cost of a job, from the size in bytes and the extension of its upload.
+    """
+    return BASE_COST + size / 1_000_000 * FORMAT_COSTS.get(extension.lower(), 1.0)
+
+
+class JobScheduler:
+    """
+    Queued and running jobs of the machine, at most `max_running` running and `max_queued` waiting.
+    Each process runs at most `max_running_per_process` of them: its next jobs are passed over until it has
+    a free slot, so that they do not wait in its pool while holding a slot of the machine.
+    """
+
+    def __init__(self, path: str, max_running: int, max_queued: int, max_running_per_process: Optional[int] = None):
+        self.path = path
+        self.max_running = max_running
+        self.max_queued = max_queued
+        self.max_running_per_process = max_running_per_process or max_running
+        self.database = SharedDatabase(path)
+
+        connection = self.database.connection()
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            "uid TEXT PRIMARY KEY, cost REAL NOT NULL, submitted REAL NOT NULL, started REAL, pid INTEGER NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        connection.execute("CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value REAL NOT NULL)")
+
+    def submit(self, uid: UUID, cost: float):
+        """
+        Queue a job, raises QueueFull if too many jobs are waiting.
+        """
+        with self.database.transaction() as connection:
+            self._remove_orphans(connection)
+            queued = connection.execute("SELECT count(*) FROM tasks WHERE started IS NULL").fetchone()[0]
+            if queued >= self.max_queued:
+                raise QueueFull(f"{queued} jobs are waiting already, try again later")
+            connection.execute(
+                "INSERT INTO tasks VALUES (?, ?, ?, NULL, ?)", (str(uid), cost, time.time(), os.getpid())
+            )
+
+    def try_start(self, uid: UUID) -> bool:
+        """
+        Start the job if it's its turn and a slot is free.
+        """
+        with self.database.transaction() as connection:
+            self._remove_orphans(connection)
+            running = connection.execute("SELECT count(*) FROM tasks WHERE started IS NOT NULL").fetchone()[0]
+            if running >= self.max_running:
+                return False
+            first = connection.execute(
+                "SELECT uid FROM tasks AS queued WHERE started IS NULL AND ("
+                "SELECT count(*) FROM tasks AS running WHERE running.pid = queued.pid AND running.started IS NOT NULL"
+                ") < ? ORDER BY submitted + cost LIMIT 1",
+                (self.max_running_per_process,),
+            ).fetchone()
+            if first is None or first[0] != str(uid):
+                return False
+            connection.execute("UPDATE tasks SET started = ? WHERE uid = ?", (time.time(), str(uid)))
+            return True
+
+    async def wait_turn(self, uid: UUID):
+        # The database may be locked by the other processes, which must not block the event loop
+        while not await asyncio.to_thread(self.try_start, uid):
+            await asyncio.sleep(POLL_INTERVAL)
+
+    def finish(self, uid: UUID):
+        """
+        Remove a job, and learn from its duration if it ran.
+        """
+        with self.database.transaction() as connection:
+            row = connection.execute("SELECT cost, started FROM tasks WHERE uid = ?", (str(uid),)).fetchone()
+            connection.execute("DELETE FROM tasks WHERE uid = ?", (str(uid),))
+            if row is None or row[1] is None:
+                return
+            cost, started = row
+            seconds_per_cost = (time.time() - started) / cost
+            connection.execute(
+                "INSERT OR REPLACE INTO settings VALUES ('seconds_per_cost', ?)",
+                (self._seconds_per_cost(connection) * (1 - SECONDS_PER_COST_SMOOTHING)
+                 + seconds_per_cost * SECONDS_PER_COST_SMOOTHING,),
+            )
+
+    def position(self, uid: UUID) -> Optional[QueuePosition]:
+        """
+        Position in the queue and estimated waiting time of a job, or None if it's not scheduled.
+        """
+        connection = self.database.connection()
+        row = connection.execute(
+            "SELECT submitted + cost, started FROM tasks WHERE uid = ?", (str(uid),)
+        ).fetchone()
+        if row is None:
+            return None
+        rank, started = row
+        if started is not None:
+            return QueuePosition(0, 0.0)
+
+        seconds_per_cost = self._seconds_per_cost(connection)
+        now = time.time()
+        ahead, ahead_cost = connection.execute(
+            "SELECT count(*), coalesce(sum(cost), 0) FROM tasks WHERE started IS NULL AND submitted + cost < ?",
+            (rank,),
+        ).fetchone()
+        running_seconds = sum(
+            max(cost * seconds_per_cost - (now - started), 0.0)
+            for cost, started in connection.execute("SELECT cost, started FROM tasks WHERE started IS NOT NULL")
+        )
+        # The slots free up in parallel, assuming the work is spread evenly over them
+        wait_seconds = (running_seconds + ahead_cost * seconds_per_cost) / self.max_running
+        return QueuePosition(ahead + 1, wait_seconds)
+
+    def _seconds_per_cost(self, connection: sqlite3.Connection) -> float:
+        row = connection.execute("SELECT value FROM settings WHERE name = 'seconds_per_cost'").fetchone()
+        return row[0] if row is not None else DEFAULT_SECONDS_PER_COST
+
+    @staticmethod
+    def _remove_orphans(connection: sqlite3.Connection):
+        """
+        Remove the jobs of the processes that died (e.g. a worker that was restarted), they would never finish.
+        """
+        pids = [pid for pid, in connection.execute("SELECT DISTINCT pid FROM tasks")]
+        for pid in pids:
+            if not process_exists(pid):
+                connection.execute("DELETE FROM tasks WHERE pid = ?", (pid,))
+
+
+@lru_cache(maxsize=None)
+def get_scheduler(workers_per_job: int = 1) -> JobScheduler:
+    """
+    Scheduler configured by the environment.
+    """
+    max_running = int(os.environ.get(
+        "FURIGANALYSE_MAX_RUNNING_JOBS", max(1, (os.cpu_count() or 1) // max(workers_per_job, 1))
+    ))
+    # Same variable as uvicorn's --workers, each worker process needs at least one slot
+    app_workers = max(int(os.environ.get("WEB_CONCURRENCY", 1)), 1)
+    return JobScheduler(
+        os.environ.get("FURIGANALYSE_SCHEDULER_PATH", DEFAULT_SCHEDULER_PATH),
+        max_running=max_running,
+        max_queued=int(os.environ.get("FURIGANALYSE_MAX_QUEUED_JOBS", 50)),
+        max_running_per_process=math.ceil(max_running / app_workers),
+    )
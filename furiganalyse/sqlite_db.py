@@ -0,0 +1,64 @@
+"""
+Helpers for the SQLite databases shared by all the worker processes of a machine (jobs, scheduler, outputs).
+
+The databases are in WAL mode, so that many processes can read while one writes.
+"""
+
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+
+class SharedDatabase:
+    """
+    Each thread of each process has its own connection to the database, as they cannot be shared
+    between threads, nor after a fork.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self.connection().execute("PRAGMA journal_mode=WAL")
+
+    def connection(self) -> sqlite3.Connection:
+        pid, connection = getattr(self._local, "connection", (None, None))
+        if pid != os.getpid():
+            # Autocommit: each statement is its own transaction, and readers never wait for writers
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = (os.getpid(), connection)
+        return connection
+
+    def transaction(self) -> "Transaction":
+        return Transaction(self.connection())
+
+
+class Transaction:
+    """
+    Write transaction taking the database lock upfront, to avoid deadlocks between processes.
+    """
+
+    def __init__(self, connection: sqlite3.Connection):
+        self.connection = connection
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.connection.execute("COMMIT" if exc_type is None else "ROLLBACK")
+
+
+def process_exists(pid: int) -> bool:
+    """
+    Whether the process `pid` is alive, e.g. to tell apart the records left by a worker that died.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
@@ -0,0 +1,193 @@
+"""
+Streaming processing of large XHTML files, with bounded memory.
+
+The document is parsed incrementally: each child of <body> (typically a <p> or <div>) is processed and
+written out as soon as it is complete, then dropped from memory.
+
+A <ruby> right in the <body> is replaced by its text, merged with the text around it, so the output is only cut
+between blocks where no <ruby> comes: the text of the <body> is processed with the first blocks, and a <ruby> with
+the block it follows, as in the tree mode.
+"""
+
+import logging
+import re
+from typing import BinaryIO, List, Optional, Set, TextIO, Union
+from xml.etree import ElementTree as ET
+from xml.sax.saxutils import escape
+
+from furiganalyse.params import FuriganaMode
+from furiganalyse.parsing import NAMESPACE, RUBY_TAG, process_tree
+
+BODY_TAG = NAMESPACE + "body"
+
+# Marker inserted in <body> to split the serialized document around its content
+SPLIT_MARKER = "furiganalyse-stream-split"
+
+# Number of completed blocks processed and written together
+STREAM_BATCH_SIZE = 256
+
+namespace_declaration_pattern = re.compile(r' xmlns(?::[^=\s]+)?="[^"]*"')
+
+
+def process_html_streaming(
+    inputfile: Union[str, BinaryIO],
+    outputfile: Union[str, TextIO],
+    mode: FuriganaMode,
+    exclude_words: Optional[Set[str]] = None,
+) -> bool:
+    """
+    Process the XHTML file by batches of blocks and write the result to `outputfile`
+    (a path, or a text file object).
+    Documents without a <body> element are processed as a whole, like `process_html` does.
+
+    Returns True if the document was streamed, False if it fell back to the tree mode.
+    """
+    if isinstance(outputfile, str):
+        with open(outputfile, "w", encoding="utf-8") as fd:
+            return process_html_streaming(inputfile, fd, mode, exclude_words)
+
+    writer = _StreamWriter(outputfile, mode, exclude_words)
+    stack: List[ET.Element] = []
+    # The parser works by chunks, so the tree may already be ahead of the events we receive
+    for event, elem in ET.iterparse(inputfile, events=("start", "end")):
+        if event == "start":
+            if writer.body is not None and len(stack) == 2 and stack[1] is writer.body:
+                # A new block starts: the previous ones are complete, including their tail,
+                # unless it is a <ruby> whose text may be merged with that tail
+                if writer.completed_blocks >= STREAM_BATCH_SIZE and elem.tag != RUBY_TAG:
+                    writer.flush()
+            elif len(stack) == 1 and elem.tag == BODY_TAG:
+                writer.root = stack[0]
+                writer.body = elem
+            stack.append(elem)
+        else:
+            stack.pop()
+            if elem is writer.body:
+                writer.flush()
+            elif writer.body is not None and len(stack) == 2 and stack[1] is writer.body:
+                writer.completed_blocks += 1
+            if not stack:
+                writer.finish(elem)
+
+    if not writer.streamed:
+        logging.info("    No <body> found in %s, processed as a whole", getattr(inputfile, "name", inputfile))
+    return writer.streamed
+
+
+def _container(elem: ET.Element) -> ET.Element:
+    container = ET.Element("stream")
+    container.append(elem)
+    return container
+
+
+class _StreamWriter:
+
+    def __init__(self, fd, mode: FuriganaMode, exclude_words: Optional[Set[str]]):
+        self.fd = fd
+        self.mode = mode
+        self.exclude_words = exclude_words
+        self.root: Optional[ET.Element] = None
+        self.body: Optional[ET.Element] = None
+        self.completed_blocks = 0
+        # Text of the <body>, written with the first blocks
+        self.body_text: Optional[str] = None
+        self.streamed = False
+        self.header_declarations = set()
+
+    def flush(self):
+        """
+        Write the completed blocks, now that their tail is known, and drop them from the tree.
+        """
+        if not self.streamed:
+            self._write_header()
+
+        if self.completed_blocks or self.body_text:
+            # Blocks are written in order, so the completed blocks are the first ones left in the <body>
+            blocks = self.body[:self.completed_blocks]
+            del self.body[:self.completed_blocks]
+            self.completed_blocks = 0
+
+            # Process the blocks in a stand-in <body>, with the text of the <body> for the first ones,
+            # which receives the text of a removed <ruby> block
+            wrapper = ET.Element(BODY_TAG)
+            wrapper.text, self.body_text = self.body_text, None
+            wrapper.extend(blocks)
+            process_tree(_container(wrapper), self.mode, self.exclude_words)
+            self._write_content(wrapper)
+
+    def finish(self, root: ET.Element):
+        if not self.streamed:
+            # No <body> to stream, fall back to processing the whole tree
+            process_tree(root, self.mode, self.exclude_words)
+            self.fd.write(ET.tostring(root, encoding="unicode"))
+            return
+
+        _, footer = self._split_around_body_content(root)
+        self.fd.write(footer)
+
+    def _write_header(self):
+        """
+        Write everything up to the content of the <body>, processing the <head>.
+        """
+        self.streamed = True
+
+        # Set aside the blocks already parsed and the <body> text, so that the root only has the <head>
+        blocks = list(self.body)
+        del self.body[:]
+        self.body_text, self.body.text = self.body.text, None
+        process_tree(self.root, self.mode, self.exclude_words)
+        header, _ = self._split_around_body_content(self.root)
+        del self.body[:]
+        self.body.extend(blocks)
+
+        root_start_tag = header[:header.index(">")]
+        self.header_declarations = set(namespace_declaration_pattern.findall(root_start_tag))
+        self.fd.write(header)
+
+    def _split_around_body_content(self, root: ET.Element):
+        marker = ET.Comment(SPLIT_MARKER)
+        self.body.append(marker)
+        serialized = ET.tostring(root, encoding="unicode")
+        self.body.remove(marker)
+        header, footer = serialized.split(f"<!--{SPLIT_MARKER}-->", 1)
+        return header, footer
+
+    def _write_content(self, wrapper: ET.Element):
+        if not len(wrapper):
+            self.fd.write(escape(wrapper.text or ""))
+            return
+
+        serialized = ET.tostring(wrapper, encoding="unicode")
+        start_tag_end = serialized.index(">")
+        declarations = set(namespace_declaration_pattern.findall(serialized[:start_tag_end]))
+        if declarations <= self.header_declarations:
+            self.fd.write(serialized[start_tag_end + 1:serialized.rindex("</")])
+            return
+
+        # Some namespaces are not declared on the root, declare them on each element
+        if wrapper.text:
+            self.fd.write(escape(wrapper.text))
+        for child in wrapper:
+            self.fd.write(self._serialize(child))
+
+    def _serialize(self, elem: ET.Element) -> str:
+        """
+        Serialize an element without repeating the namespace declarations already made on the root.
+        """
+        wrapper = ET.Element(self.body.tag)
+        wrapper.append(elem)
+        serialized = ET.tostring(wrapper, encoding="unicode")
+
+        start_tag_end = serialized.index(">")
+        declarations = [
+            declaration
+            for declaration in namespace_declaration_pattern.findall(serialized[:start_tag_end])
+            if declaration not in self.header_declarations
+        ]
+        content = serialized[start_tag_end + 1:serialized.rindex("</")]
+
+        if declarations:
+            # Move the missing declarations to the element's start tag
+            tag_name_end = re.match(r"<[^\s/>]+", content).end()
+            content = content[:tag_name_end] + "".join(declarations) + content[tag_name_end:]
+        return content
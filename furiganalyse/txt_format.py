@@ -1,37 +1,89 @@
-import logging
 import os
-import zipfile
-from typing import Iterator
+from abc import ABC, abstractmethod
+from typing import Iterable, List
 
+from furiganalyse.archive import ArchiveWriter
+from furiganalyse.parsing import Paragraph, format_tokens
 
-def write_txt_archive(unzipped_input_fpath: str, outputfile: str):
+
+class TxtSink(ABC):
+    """
+    Destination of the text of the annotated documents, pushed into it one document at a time,
+    in reading order, as they are processed. The paragraphs come as tokens, see `iter_paragraph_tokens`.
+    """
+
+    @abstractmethod
+    def add_document(self, name: str, paragraphs: Iterable[Paragraph]):
+        ...
+
+    def close(self):
+        pass
+
+    def abort(self):
+        """
+        Called instead of `close` when the processing failed.
+        """
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class SingleTxtSink(TxtSink):
+    """
+    The text of all the documents in a single file.
+    """
+
+    def __init__(self, outputfile: str):
+        self.fd = open(outputfile, "w")
+
+    def add_document(self, name: str, paragraphs: Iterable[Paragraph]):
+        for tokens in paragraphs:
+            self.fd.write(format_tokens(tokens))
+
+    def close(self):
+        self.fd.close()
+
+
+class TxtArchiveSink(TxtSink):
+    """
+    The text of each document in its own .txt file, named after the document, within a zip archive.
+    """
+
+    def __init__(self, outputfile: str):
+        self.archive = ArchiveWriter(outputfile)
+
+    def add_document(self, name: str, paragraphs: Iterable[Paragraph]):
+        text = "".join(format_tokens(tokens) for tokens in paragraphs)
+        self.archive.add_bytes(os.path.splitext(name)[0] + ".txt", text.encode("utf-8"))
+
+    def close(self):
+        self.archive.close()
+
+
+class MultiTxtSink(TxtSink):
     """
-    Only keep the converted txt files within the archive.
+    Push the text of the documents into several sinks.
     """
-    with zipfile.ZipFile(outputfile, 'w') as zip_out:
-        for folder_name, _, filenames in os.walk(unzipped_input_fpath):
-            for filename in filenames:
-                extension = os.path.splitext(filename)[1]
-                if extension == ".txt":
-                    rel_dir = os.path.relpath(folder_name, unzipped_input_fpath)
-                    rel_file = os.path.join(rel_dir, filename)
-                    file_path = os.path.join(folder_name, filename)
-                    # Add file to zip
-                    zip_out.write(file_path, rel_file)
-                    logging.info(f"    Adding {rel_file}")
 
+    def __init__(self, sinks: List[TxtSink]):
+        self.sinks = sinks
 
-def iter_txt_lines(unzipped_input_fpath: str) -> Iterator[str]:
-    for root, _, files in sorted(os.walk(unzipped_input_fpath)):
-        for file in sorted(files):
-            if os.path.splitext(file)[1] == ".txt":
-                filepath = os.path.join(root, file)
-                with open(filepath) as fd:
-                    for line in fd:
-                        yield line
+    def add_document(self, name: str, paragraphs: Iterable[Paragraph]):
+        paragraphs = list(paragraphs)
+        for sink in self.sinks:
+            sink.add_document(name, paragraphs)
 
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
 
-def concat_txt_files(unzipped_input_fpath: str, outputfile: str):
-    with open(outputfile, "w") as fd:
-        for line in iter_txt_lines(unzipped_input_fpath):
-            fd.write(line)
\ No newline at end of file
+    def abort(self):
+        for sink in self.sinks:
+            sink.abort()
@@ -0,0 +1,232 @@
+"""
+Plain text input, processed without converting it to EPUB with calibre first.
+
+The text file is read line by line, each non-empty line being a paragraph. The paragraphs are annotated
+by chapters of CHAPTER_PARAGRAPHS, which are written out as they come: as XHTML documents of a new EPUB,
+and/or into the sinks of the text and HTML outputs. Memory stays bounded whatever the size of the input.
+"""
+
+import codecs
+import logging
+import math
+import time
+import uuid
+from typing import Iterable, Iterator, List, Optional, Set
+from xml.etree import ElementTree as ET
+from xml.sax.saxutils import escape
+
+from furiganalyse.archive import EPUB_MIMETYPE_FILENAME, ArchiveWriter
+from furiganalyse.epub_format import FileResult, ProcessingStats
+from furiganalyse.html_format import CONTAINER_FILENAME, HtmlBookSink
+from furiganalyse.params import FuriganaMode, WritingMode
+from furiganalyse.parsing import NAMESPACE, iter_paragraph_tokens, process_tree, reading_cache
+from furiganalyse.progress import ProgressReporter
+from furiganalyse.txt_format import TxtSink
+
+# Number of paragraphs per chapter (one XHTML document or text file each)
+CHAPTER_PARAGRAPHS = 1000
+
+# Number of bytes looked at to detect the encoding
+ENCODING_DETECTION_SIZE = 1024 * 1024
+
+# Encodings tried in order, the first one decoding the beginning of the file without error is used.
+# Shift_JIS text hardly ever decodes as EUC-JP (hiragana lead bytes are invalid there), the reverse is common.
+CANDIDATE_ENCODINGS = ["utf-8", "euc_jp", "cp932"]
+
+# Escape sequence switching ISO-2022-JP to JIS X 0208, whose text is otherwise 7-bit and would decode as UTF-8
+ISO2022_JP_ESCAPE = b"\x1b$"
+
+CONTAINER = """<?xml version="1.0" encoding="utf-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+<rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/></rootfiles>
+</container>
+"""
+
+PACKAGE = """<?xml version="1.0" encoding="utf-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="uid" xml:lang="ja">
+<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+<dc:identifier id="uid">urn:uuid:{uid}</dc:identifier>
+<dc:title>{title}</dc:title>
+<dc:language>ja</dc:language>
+<meta property="dcterms:modified">{modified}</meta>
+</metadata>
+<manifest>
+<item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>
+<item id="style" href="style.css" media-type="text/css"/>
+{items}
+</manifest>
+<spine{page_progression}>
+{itemrefs}
+</spine>
+</package>
+"""
+
+NAV = """<?xml version="1.0" encoding="utf-8"?>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops">
+<head><title>{title}</title></head>
+<body><nav epub:type="toc"><ol>
+{entries}
+</ol></nav></body>
+</html>
+"""
+
+
+def detect_encoding(inputfile: str) -> str:
+    """
+    Detect the encoding of a text file, from its byte order mark or by trying the usual Japanese encodings.
+    """
+    with open(inputfile, "rb") as fd:
+        head = fd.read(ENCODING_DETECTION_SIZE)
+
+    if head.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    if head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return "utf-16"
+    if ISO2022_JP_ESCAPE in head:
+        return "iso2022_jp"
+
+    for encoding in CANDIDATE_ENCODINGS:
+        decoder = codecs.getincrementaldecoder(encoding)()
+        try:
+            # Not final, the last character may be cut
+            decoder.decode(head, final=len(head) < ENCODING_DETECTION_SIZE)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+
+    logging.warning("Could not detect the encoding of %s, decoding it as UTF-8", inputfile)
+    return "utf-8"
+
+
+def iter_paragraphs(inputfile: str, encoding: Optional[str] = None) -> Iterator[str]:
+    encoding = encoding or detect_encoding(inputfile)
+    logging.info("    Reading %s as %s", inputfile, encoding)
+    with open(inputfile, encoding=encoding, errors="replace") as fd:
+        for line in fd:
+            line = line.strip()
+            if line:
+                yield line
+
+
+def iter_chapters(paragraphs: Iterable[str], size: int) -> Iterator[List[str]]:
+    chapter = []
+    for paragraph in paragraphs:
+        chapter.append(paragraph)
+        if len(chapter) >= size:
+            yield chapter
+            chapter = []
+    if chapter:
+        yield chapter
+
+
+def process_txt_file(
+    inputfile: str,
+    mode: FuriganaMode,
+    title: str,
+    epub_filepath: Optional[str] = None,
+    txt_sink: Optional[TxtSink] = None,
+    writing_mode: Optional[WritingMode] = None,
+    exclude_words: Optional[Set[str]] = None,
+    progress: Optional[ProgressReporter] = None,
+    html_sink: Optional[HtmlBookSink] = None,
+) -> ProcessingStats:
+    """
+    Annotate a plain text file chapter by chapter, writing an EPUB to `epub_filepath` and/or
+    pushing each chapter into `txt_sink` and `html_sink`, like `process_epub_archive` does.
+    """
+    stats = ProcessingStats()
+    encoding = detect_encoding(inputfile)
+    if progress is not None:
+        # Counting the paragraphs first is cheap, next to annotating them
+        chapters = math.ceil(sum(1 for _ in iter_paragraphs(inputfile, encoding)) / CHAPTER_PARAGRAPHS)
+    epub = _EpubBookWriter(epub_filepath, title, writing_mode) if epub_filepath else None
+    try:
+        for index, paragraphs in enumerate(iter_chapters(iter_paragraphs(inputfile, encoding), CHAPTER_PARAGRAPHS)):
+            start = time.perf_counter()
+            cache_info_before = reading_cache.info()
+
+            root = build_chapter(title, paragraphs)
+            process_tree(root, mode, exclude_words)
+            if epub:
+                epub.add_chapter(ET.tostring(root, encoding="utf-8", xml_declaration=True))
+            if txt_sink is not None:
+                txt_sink.add_document(f"chapter{index:05d}", iter_paragraph_tokens(root))
+            if html_sink is not None:
+                html_sink.add_document(f"chapter{index:05d}", root)
+
+            cache_info = reading_cache.info()
+            stats.add(f"chapter{index:05d}", FileResult(
+                False,
+                time.perf_counter() - start,
+                cache_info.hits - cache_info_before.hits,
+                cache_info.misses - cache_info_before.misses,
+            ))
+            if progress is not None:
+                progress.advance(index + 1, chapters)
+    finally:
+        if epub:
+            epub.close()
+
+    stats.log()
+    return stats
+
+
+def build_chapter(title: str, paragraphs: List[str]) -> ET.Element:
+    root = ET.Element(f"{NAMESPACE}html")
+    head = ET.SubElement(root, f"{NAMESPACE}head")
+    ET.SubElement(head, f"{NAMESPACE}title").text = title
+    ET.SubElement(head, f"{NAMESPACE}link", {"rel": "stylesheet", "type": "text/css", "href": "style.css"})
+    body = ET.SubElement(root, f"{NAMESPACE}body")
+    body.text = "\n"
+    for paragraph in paragraphs:
+        p = ET.SubElement(body, f"{NAMESPACE}p")
+        p.text = paragraph
+        p.tail = "\n"
+    return root
+
+
+class _EpubBookWriter:
+    """
+    Write an EPUB book chapter by chapter, the package document is written last, once all the chapters are known.
+    """
+
+    def __init__(self, outputfile: str, title: str, writing_mode: Optional[WritingMode]):
+        self.title = title
+        self.writing_mode = writing_mode
+        self.chapters = 0
+        self.archive = ArchiveWriter(outputfile)
+        self.archive.add_bytes(EPUB_MIMETYPE_FILENAME, b"application/epub+zip")
+        self.archive.add_bytes(CONTAINER_FILENAME, CONTAINER.encode("utf-8"))
+
+    def add_chapter(self, content: bytes):
+        self.archive.add_bytes(f"OEBPS/chapter{self.chapters:05d}.xhtml", content)
+        self.chapters += 1
+
+    def close(self):
+        chapters = [f"chapter{i:05d}" for i in range(self.chapters)]
+        style = ""
+        page_progression = ""
+        if self.writing_mode is not None:
+            style = f"html {{ writing-mode: {self.writing_mode.value}; -epub-writing-mode: {self.writing_mode.value}; }}\n"
+            if self.writing_mode == WritingMode.vertical_rl:
+                page_progression = ' page-progression-direction="rtl"'
+
+        self.archive.add_bytes("OEBPS/style.css", style.encode("utf-8"))
+        self.archive.add_bytes("OEBPS/nav.xhtml", NAV.format(
+            title=escape(self.title),
+            entries="\n".join(
+                f'<li><a href="{chapter}.xhtml">{i + 1}</a></li>' for i, chapter in enumerate(chapters)
+            ),
+        ).encode("utf-8"))
+        self.archive.add_bytes("OEBPS/content.opf", PACKAGE.format(
+            uid=uuid.uuid4(),
+            title=escape(self.title),
+            modified=time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            items="\n".join(
+                f'<item id="{chapter}" href="{chapter}.xhtml" media-type="application/xhtml+xml"/>'
+                for chapter in chapters
+            ),
+            page_progression=page_progression,
+            itemrefs="\n".join(f'<itemref idref="{chapter}"/>' for chapter in chapters),
+        ).encode("utf-8"))
+        self.archive.close()
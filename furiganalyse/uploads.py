@@ -0,0 +1,86 @@
+"""
+Uploads of the web app.
+
+The size of the request body is limited before it is parsed: from its Content-Length, or as it is received when
+it has none. The files of the form, spooled by Starlette, are then copied to the job folder by chunks: the memory
+used does not depend on their size, their SHA-256 digest is computed along the way, and their own maximum size
+is enforced.
+"""
+
+import hashlib
+import os
+from typing import BinaryIO, NamedTuple
+
+from fastapi import HTTPException, status
+from fastapi.responses import JSONResponse
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class SavedUpload(NamedTuple):
+    path: str
+    size: int
+    digest: str  # SHA-256, in hexadecimal
+
+
+class RequestSizeLimit:
+    """
+    ASGI middleware rejecting the requests whose body is over `max_size` bytes with a 413 status,
+    before the body is read if it has a Content-Length.
+    """
+
+    def __init__(self, app, max_size: int):
+        self.app = app
+        self.max_size = max_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        error = f"Request too large. Maximum size is {self.max_size // (1024 * 1024)}MB."
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_size:
+            response = JSONResponse(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, content={"error": error})
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_size:
+                    # Raised while the form is parsed, FastAPI answers with its status
+                    raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=error)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+def save_upload(source: BinaryIO, destination: str, max_size: int) -> SavedUpload:
+    """
+    Copy a spooled uploaded file to `destination`, raises UploadTooLarge (and removes it) if it's over `max_size` bytes.
+    Blocking, to be run in a thread from async code.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(destination, "wb") as fd:
+            while True:
+                chunk = source.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_size:
+                    raise UploadTooLarge(f"File too large. Maximum size is {max_size // (1024 * 1024)}MB.")
+                digest.update(chunk)
+                fd.write(chunk)
+    except BaseException:
+        os.remove(destination)
+        raise
+    return SavedUpload(destination, size, digest.hexdigest())
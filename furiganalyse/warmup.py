@@ -0,0 +1,68 @@
+"""
+Warm up of the worker processes of the web app, before they get their first job: loading MeCab and its dictionary,
+and the bundled word lists, takes seconds that would otherwise be added to the first job of each process.
+
+The tokenizer is checked along the way, a worker that cannot read kanji fails to start instead of failing its jobs.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import Executor
+from typing import Set
+
+from furigana.furigana import split_furigana
+
+from furiganalyse.known_words import list_available_word_lists, word_list_digest
+
+# Text tokenized by the self-check, and the reading expected from it
+SELF_CHECK_TEXT = "漢字"
+SELF_CHECK_READING = "かんじ"
+
+# Seconds each warm up task holds its process, so that the next ones go to the other processes of the pool
+WARMUP_TASK_SECONDS = 0.05
+
+
+class WarmupError(Exception):
+    pass
+
+
+def init_app_worker():
+    """
+    Initialize a worker process of the web app: load MeCab and check its readings, then load the bundled word lists.
+    """
+    start = time.perf_counter()
+    tokens = split_furigana(SELF_CHECK_TEXT)
+    reading = "".join(token[1] for token in tokens if len(token) > 1)
+    if reading != SELF_CHECK_READING:
+        raise WarmupError(f"Unexpected reading of {SELF_CHECK_TEXT}: {tokens}")
+
+    # Each list is loaded once, and cached
+    for filename, _, _ in list_available_word_lists():
+        word_list_digest(filename)
+
+    logging.info("Worker %d warmed up in %.2fs", os.getpid(), time.perf_counter() - start)
+
+
+def warmup_task() -> int:
+    """
+    Run by each process of the pool once it is initialized, returns its pid.
+    """
+    time.sleep(WARMUP_TASK_SECONDS)
+    return os.getpid()
+
+
+async def warm_up_pool(executor: Executor, workers: int) -> Set[int]:
+    """
+    Wait until the `workers` processes of the pool are initialized, returns their pids.
+    A process only takes tasks once its initializer has run, so the pool is warm once all of them answered.
+    Raises BrokenProcessPool if the initializer failed.
+    """
+    loop = asyncio.get_event_loop()
+    pids = set()
+    while len(pids) < workers:
+        pids.update(await asyncio.gather(*[
+            loop.run_in_executor(executor, warmup_task) for _ in range(workers)
+        ]))
+    return pids
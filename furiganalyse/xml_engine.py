@@ -0,0 +1,61 @@
+"""
+Pluggable XML engines used to parse the XHTML documents.
+
+The engine is selected with the FURIGANALYSE_XML_ENGINE environment variable:
+- "stdlib" (default): xml.etree.ElementTree
+- "lxml": lxml.etree, faster parsing and serialization in C (requires `pip install lxml`)
+
+Both engines produce trees with the ElementTree API, so the processing and serialization code
+(`tree.write`, `makeelement`, `itertext`, ...) is the same for both.
+"""
+
+import logging
+import os
+from functools import lru_cache
+from xml.etree import ElementTree as ET
+
+
+class StdlibEngine:
+    name = "stdlib"
+
+    def parse(self, source):
+        return ET.parse(source)
+
+
+class LxmlEngine:
+    """
+    Keeps comments, processing instructions and the doctype, which the stdlib engine drops.
+    """
+    name = "lxml"
+
+    def __init__(self):
+        from lxml import etree
+
+        self._etree = etree
+        self._parser = etree.XMLParser(resolve_entities=False, huge_tree=True)
+
+    def parse(self, source):
+        return self._etree.parse(source, self._parser)
+
+
+XML_ENGINES = {
+    StdlibEngine.name: StdlibEngine,
+    LxmlEngine.name: LxmlEngine,
+}
+
+
+@lru_cache(maxsize=None)
+def get_xml_engine(name: str = None):
+    """
+    Get the XML engine by name (defaults to the configured one), falling back to the stdlib engine
+    if it's not available.
+    """
+    name = name or os.environ.get("FURIGANALYSE_XML_ENGINE", StdlibEngine.name)
+    if name not in XML_ENGINES:
+        raise ValueError(f"Unknown XML engine {name}, must be one of: {','.join(XML_ENGINES)}")
+
+    try:
+        return XML_ENGINES[name]()
+    except ImportError:
+        logging.warning("XML engine %s is not available, falling back to %s", name, StdlibEngine.name)
+        return StdlibEngine()
@@ -0,0 +1,143 @@
+import json
+import sqlite3
+import zipfile
+
+import pytest
+
+from furiganalyse import apkg_format
+from furiganalyse.apkg_format import AnkiDeckSink, Word, extract_sentences, split_sentences
+
+# IPADIC features of the words known by the fake tagger, the other characters are symbols
+FEATURES = {
+    "吾輩": "名詞,代名詞,一般,*,*,*,吾輩,ワガハイ,ワガハイ",
+    "名前": "名詞,一般,*,*,*,*,名前,ナマエ,ナマエ",
+    "漢字": "名詞,一般,*,*,*,*,漢字,カンジ,カンジ",
+    "無": "形容詞,自立,*,*,形容詞・アウオ段,ガル接続,無い,ナ,ナ",
+    "言っ": "動詞,自立,*,*,五段・ワ行促音便,連用タ接続,言う,イッ,イッ",
+    "三": "名詞,数,*,*,*,*,三,サン,サン",
+}
+
+
+class Node:
+    def __init__(self, surface, feature, next_node=None):
+        self.surface = surface
+        self.feature = feature
+        self.next = next_node
+
+
+class FakeTagger:
+    def parseToNode(self, text):
+        surfaces = []
+        while text:
+            surface = next((word for word in FEATURES if text.startswith(word)), text[0])
+            surfaces.append(surface)
+            text = text[len(surface):].lstrip()
+        node = Node("", "BOS/EOS,*,*,*,*,*,*,*,*")
+        for surface in reversed(surfaces):
+            node = Node(surface, FEATURES.get(surface, "記号,一般,*,*,*,*,*"), node)
+        return Node("", "BOS/EOS,*,*,*,*,*,*,*,*", node)
+
+
+@pytest.fixture(autouse=True)
+def tagger(monkeypatch):
+    monkeypatch.setattr(apkg_format, "get_tagger", FakeTagger)
+
+
+@pytest.mark.parametrize(("line", "expected"), [
+    ("吾輩は猫である。名前はまだ無い。\n", ["吾輩は猫である。", "名前はまだ無い。"]),
+    ("「元気？」「うん」と答えた！", ["「元気？」", "「うん」と答えた！"]),
+    ("「はい」と言った！『吾輩』は猫だ。", ["「はい」と言った！", "『吾輩』は猫だ。"]),
+    ("「どこで生れたか。」見当がつかぬ", ["「どこで生れたか。」", "見当がつかぬ"]),
+    ("   \n", []),
+    ("吾輩は猫である\n名前はまだ無い。\n", ["吾輩は猫である", "名前はまだ無い。"]),
+])
+def test_extract_sentences(line, expected):
+    assert list(extract_sentences(line)) == expected
+
+
+def test_split_sentences():
+    tokens = (("「",), ("吾輩", "わがはい"), ("は猫である。」",), ("名前", "なまえ"), ("は",), ("無", "な"), ("い。\n",))
+
+    assert list(split_sentences(tokens)) == [
+        ("「吾輩(わがはい)は猫である。」", Word("吾輩", "わがはい", "吾輩")),
+        ("名前(なまえ)は無(な)い。", Word("名前", "なまえ", "名前")),
+    ]
+
+
+def test_split_sentences_takes_the_whole_word():
+    tokens = (("猫だと",), ("言", "い"), ("った。",), ("無", "な"), ("い。",))
+
+    assert list(split_sentences(tokens)) == [
+        ("猫だと言(い)った。", Word("言っ", "いっ", "言う")),
+        ("無(な)い。", Word("無", "な", "無い")),
+    ]
+
+
+def test_split_sentences_without_mecab(monkeypatch):
+    monkeypatch.setattr(apkg_format, "get_tagger", lambda: None)
+    tokens = (("言", "い"), ("った。",))
+
+    assert list(split_sentences(tokens)) == [("言(い)った。", Word("言", "い", "言"))]
+
+
+def test_split_sentences_of_many_lines():
+    tokens = (("吾輩は",), ("漢字", "かんじ"), ("である\n",), ("三", "さん"), ("は",), ("漢字", "かんじ"), ("である",))
+
+    assert list(split_sentences(tokens)) == [
+        ("吾輩は漢字(かんじ)である", Word("漢字", "かんじ", "漢字")),
+        ("三(さん)は漢字(かんじ)である", Word("三", "さん", "三")),
+    ]
+
+
+def read_deck(filepath):
+    with zipfile.ZipFile(filepath) as zip_in:
+        assert json.loads(zip_in.read("media")) == {}
+        collection = filepath.parent / "collection.anki2"
+        collection.write_bytes(zip_in.read("collection.anki2"))
+    conn = sqlite3.connect(collection)
+    try:
+        decks, models = conn.execute("SELECT decks, models FROM col").fetchone()
+        notes = conn.execute("SELECT id, guid, flds FROM notes ORDER BY id").fetchall()
+        cards = conn.execute("SELECT nid, did, due FROM cards ORDER BY due").fetchall()
+        return json.loads(decks), json.loads(models), notes, cards
+    finally:
+        conn.close()
+
+
+def test_anki_deck_sink(tmp_path, monkeypatch):
+    monkeypatch.setattr(apkg_format, "NOTES_BATCH_SIZE", 2)
+
+    decks = []
+    for run in range(2):
+        filepath = tmp_path / f"deck{run}.apkg"
+        with AnkiDeckSink("本", str(filepath)) as sink:
+            sink.add_document("chapter1", [
+                (("漢字", "かんじ"), ("です。猫だ。\n",)),
+                (("漢字", "かんじ"), ("です。\n",)),
+            ])
+            sink.add_document("chapter2", [(("おわり",),)])
+        decks.append(read_deck(filepath))
+
+    deck_json, models, notes, cards = decks[0]
+    assert [fields for _, _, fields in notes] == [
+        "漢字(かんじ)です。\x1f漢字\x1fかんじ\x1f漢字", "猫だ。\x1f\x1f\x1f", "おわり\x1f\x1f\x1f"
+    ]
+    assert [note_id for note_id, _, _ in cards] == [note_id for note_id, _, _ in notes]
+    assert [due for _, _, due in cards] == [0, 1, 2]
+    deck_id = next(deck_id for deck_id, deck in deck_json.items() if deck["name"] == "本")
+    assert {did for _, did, _ in cards} == {int(deck_id)}
+
+    # Same deck, model and notes when converting again
+    assert decks[1][0].keys() == deck_json.keys()
+    assert decks[1][1].keys() == models.keys()
+    assert [guid for _, guid, _ in decks[1][2]] == [guid for _, guid, _ in notes]
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["collection.anki2", "deck0.apkg", "deck1.apkg"]
+
+
+def test_anki_deck_sink_abort(tmp_path):
+    with pytest.raises(ValueError):
+        with AnkiDeckSink("本", str(tmp_path / "deck.apkg")) as sink:
+            sink.add_document("chapter1", [(("漢字です。",),)])
+            raise ValueError()
+
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,59 @@
+import zipfile
+import zlib
+
+import pytest
+
+from furiganalyse.archive import ArchiveWriter, copy_raw_entry
+
+
+def test_copy_raw_entry(tmp_path):
+    inputfile = tmp_path / "input.zip"
+    with zipfile.ZipFile(inputfile, "w") as zip_out:
+        zip_out.writestr("mimetype", "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        zip_out.writestr("OEBPS/image.png", b"\x89PNG" + bytes(range(256)) * 100, compress_type=zipfile.ZIP_DEFLATED)
+    # Streamed entries are followed by a data descriptor
+    with zipfile.ZipFile(inputfile, "a") as zip_out:
+        with zip_out.open(zipfile.ZipInfo("OEBPS/font.otf"), "w") as fd:
+            fd.write(b"font" * 1000)
+
+    outputfile = tmp_path / "output.zip"
+    with zipfile.ZipFile(inputfile) as zip_in, open(inputfile, "rb") as raw_input, \
+            zipfile.ZipFile(outputfile, "w") as zip_out:
+        for info in zip_in.infolist():
+            copy_raw_entry(raw_input, zip_in, zip_out, info)
+
+    with zipfile.ZipFile(inputfile) as zip_in, zipfile.ZipFile(outputfile) as zip_out:
+        assert zip_out.testzip() is None
+        assert zip_out.namelist() == zip_in.namelist()
+        for info, out_info in zip(zip_in.infolist(), zip_out.infolist()):
+            assert out_info.compress_type == info.compress_type
+            assert out_info.compress_size == info.compress_size
+            assert zip_out.read(out_info) == zip_in.read(info)
+
+
+@pytest.mark.parametrize("compression_level", [1, 9])
+def test_archive_writer(tmp_path, compression_level):
+    files = {
+        "mimetype": b"application/epub+zip",
+        "OEBPS/chapter.xhtml": "<p>吾輩は猫である。</p>".encode("utf-8") * 1000,
+        "OEBPS/image.jpg": bytes(range(256)) * 100,
+    }
+
+    outputfile = tmp_path / "output.zip"
+    with ArchiveWriter(str(outputfile), compression_level=compression_level) as archive:
+        for arcname, content in files.items():
+            archive.add_bytes(arcname, content)
+
+    with zipfile.ZipFile(outputfile) as zip_in:
+        assert zip_in.testzip() is None
+        assert zip_in.namelist() == list(files)
+        assert [info.compress_type for info in zip_in.infolist()] == [
+            zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED, zipfile.ZIP_STORED
+        ]
+        for arcname, content in files.items():
+            assert zip_in.read(arcname) == content
+        # The mimetype must be readable at a fixed offset by EPUB readers
+        assert zip_in.infolist()[0].header_offset == 0
+        # The level is the one of the writer
+        expected_size = len(zlib.compress(files["OEBPS/chapter.xhtml"], compression_level)) - 6
+        assert zip_in.getinfo("OEBPS/chapter.xhtml").compress_size == expected_size
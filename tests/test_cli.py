@@ -0,0 +1,13 @@
+import typer
+from typer.testing import CliRunner
+
+from furiganalyse.__main__ import main
+
+
+def test_cli_help():
+    app = typer.Typer()
+    app.command()(main)
+    result = CliRunner().invoke(app, ["--help"])
+
+    assert result.exit_code == 0, result.output
+    assert "--furigana-mode" in result.output
@@ -0,0 +1,89 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+from furiganalyse.conversion import ConversionError, ConversionQueueFull, ConversionService, ConversionTimeout
+
+# Stands for calibre's conversion entry point, in the environment of the workers
+FAKE_CALIBRE_CLI = """
+import os, shutil, time
+
+def main(args):
+    print("Conversion started")  # calibre logs on stdout
+    _, inputfile, outputfile = args
+    name = os.path.basename(inputfile)
+    if name.startswith("slow"):
+        time.sleep(10)
+    if name.startswith("bad"):
+        raise ValueError("Not an ebook")
+    with open(outputfile, "w") as fd:
+        fd.write(f"{os.getpid()}")
+    return 0
+"""
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    cli = tmp_path / "env" / "calibre" / "ebooks" / "conversion"
+    cli.mkdir(parents=True)
+    for package in [cli, cli.parent, cli.parent.parent]:
+        (package / "__init__.py").touch()
+    (cli / "cli.py").write_text(FAKE_CALIBRE_CLI)
+    monkeypatch.setenv("PYTHONPATH", str(tmp_path / "env"))
+
+    service = ConversionService(workers=1, queue_limit=1, timeout=5, command=[sys.executable])
+    yield service
+    service.close()
+
+
+def convert(service, tmp_path, name, **kwargs):
+    inputfile = tmp_path / f"{name}.mobi"
+    inputfile.write_text("book")
+    outputfile = tmp_path / f"{name}.epub"
+    elapsed = service.convert(str(inputfile), str(outputfile), **kwargs)
+    assert elapsed >= 0
+    return outputfile.read_text()
+
+
+def test_conversions_reuse_the_worker(service, tmp_path):
+    service.start()
+    pid = convert(service, tmp_path, "book1")
+    assert pid != str(os.getpid())
+    assert convert(service, tmp_path, "book2") == pid
+
+
+def test_conversion_error(service, tmp_path):
+    with pytest.raises(ConversionError, match="Not an ebook"):
+        convert(service, tmp_path, "bad")
+    # The worker is replaced
+    assert convert(service, tmp_path, "book")
+
+
+def test_conversion_timeout(service, tmp_path):
+    pid = convert(service, tmp_path, "book1")
+    with pytest.raises(ConversionTimeout):
+        convert(service, tmp_path, "slow", timeout=0.5)
+    assert convert(service, tmp_path, "book2") != pid
+
+
+def test_conversion_queue_full(service, tmp_path):
+    def convert_slow_book(name):
+        with pytest.raises(ConversionTimeout):
+            convert(service, tmp_path, name, timeout=1)
+
+    service.start()
+    # One conversion in progress, one waiting for the worker
+    threads = [threading.Thread(target=convert_slow_book, args=(name,)) for name in ["slow1", "slow2"]]
+    for thread in threads:
+        thread.start()
+    while service._slots._value:
+        time.sleep(0.01)
+    try:
+        with pytest.raises(ConversionQueueFull):
+            convert(service, tmp_path, "book")
+    finally:
+        for thread in threads:
+            thread.join()
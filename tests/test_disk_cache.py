@@ -0,0 +1,73 @@
+import sys
+import types
+import weakref
+
+from furiganalyse import disk_cache
+from furiganalyse.disk_cache import PersistentReadingCache, get_persistent_reading_cache
+
+TOKENS = (("漢字", "かんじ"), ("の",))
+
+
+class TestPersistentReadingCache:
+    """Tests for the SQLite backed reading cache"""
+
+    def test_put_and_get(self, tmp_path):
+        cache = PersistentReadingCache(str(tmp_path), max_entries=10, dictionary="test")
+        cache.put_many({"漢字の": TOKENS}, fingerprint="")
+
+        assert cache.get_many(["漢字の", "missing"], fingerprint="") == {"漢字の": TOKENS}
+
+    def test_shared_between_connections(self, tmp_path):
+        PersistentReadingCache(str(tmp_path), max_entries=10, dictionary="test").put_many(
+            {"漢字の": TOKENS}, fingerprint=""
+        )
+        other_cache = PersistentReadingCache(str(tmp_path), max_entries=10, dictionary="test")
+
+        assert other_cache.get_many(["漢字の"], fingerprint="") == {"漢字の": TOKENS}
+
+    def test_keyed_on_fingerprint_and_dictionary(self, tmp_path):
+        cache = PersistentReadingCache(str(tmp_path), max_entries=10, dictionary="test")
+        cache.put_many({"漢字の": TOKENS}, fingerprint="")
+        other_dictionary_cache = PersistentReadingCache(str(tmp_path), max_entries=10, dictionary="other")
+
+        assert cache.get_many(["漢字の"], fingerprint="N5") == {}
+        assert other_dictionary_cache.get_many(["漢字の"], fingerprint="") == {}
+
+    def test_evicts_least_recently_used(self, tmp_path, monkeypatch):
+        clock = iter(range(1_000_000))
+        monkeypatch.setattr(disk_cache.time, "time", lambda: next(clock))
+        cache = PersistentReadingCache(str(tmp_path), max_entries=2, dictionary="test")
+        for text in ["一", "二", "三"]:
+            cache.put_many({text: ((text, "よみ"),)}, fingerprint="")
+
+        assert cache.evict() == 1
+        assert len(cache) == 2
+        assert cache.get_many(["一"], fingerprint="") == {}
+
+
+def test_disabled_without_directory(monkeypatch):
+    monkeypatch.delenv("FURIGANALYSE_READING_CACHE_DIR", raising=False)
+    assert get_persistent_reading_cache() is None
+
+
+def test_dictionary_identity_keeps_the_tagger_alive(monkeypatch):
+    class DictionaryInfo:
+        def __init__(self, tagger):
+            # Like the SWIG struct, which does not keep its tagger alive
+            self.tagger = weakref.ref(tagger)
+
+        def __getattr__(self, name):
+            if self.tagger() is None:
+                raise RuntimeError("use after free")
+            return {"filename": "sys.dic", "charset": "utf8", "version": 102}[name]
+
+    class Tagger:
+        def dictionary_info(self):
+            return DictionaryInfo(self)
+
+    monkeypatch.setitem(sys.modules, "MeCab", types.SimpleNamespace(Tagger=Tagger))
+    disk_cache.dictionary_identity.cache_clear()
+    try:
+        assert disk_cache.dictionary_identity().endswith("|sys.dic:utf8:102")
+    finally:
+        disk_cache.dictionary_identity.cache_clear()
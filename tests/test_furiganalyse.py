@@ -1,8 +1,19 @@
+import random
 import xml.etree.ElementTree as ET
+import zipfile
 
 import pytest
 
-from furiganalyse.parsing import process_tree
+from furiganalyse.disk_cache import get_persistent_reading_cache
+from furiganalyse import epub_format
+from furiganalyse.epub_format import process_epub_archive
+from furiganalyse.html_format import HtmlBookSink
+from furiganalyse.params import WritingMode
+from furiganalyse.parsing import (
+    convert_html_to_txt_lines, create_parsed_furigana_html, iter_paragraph_tokens, needs_processing, process_tree,
+    reading_cache,
+)
+from furiganalyse.txt_format import MultiTxtSink, SingleTxtSink, TxtArchiveSink
 
 
 @pytest.mark.parametrize(
@@ -126,4 +137,187 @@ def test_process_tree(test_case, xml_str, mode, expected_xml_str):
 
     expected_tree = ET.fromstring(template.format(expected_xml_str))
 
-    assert ET.tostring(tree, encoding='unicode') == ET.tostring(expected_tree, encoding='unicode')
\ No newline at end of file
+    assert ET.tostring(tree, encoding='unicode') == ET.tostring(expected_tree, encoding='unicode')
+
+def test_create_parsed_furigana_html_is_memoized():
+    reading_cache.clear()
+
+    head, children, tail = create_parsed_furigana_html("漢字")
+    head_2, children_2, tail_2 = create_parsed_furigana_html("漢字")
+
+    assert reading_cache.info().hits == 1
+    assert reading_cache.info().misses == 1
+    assert (head, tail) == (head_2, tail_2)
+    assert [ET.tostring(c) for c in children] == [ET.tostring(c) for c in children_2]
+    # Callers insert the children in their own trees, so they must not be shared
+    assert all(c is not c_2 for c, c_2 in zip(children, children_2))
+
+
+def test_reading_cache_is_keyed_on_exclude_words():
+    reading_cache.clear()
+
+    _, children, _ = create_parsed_furigana_html("漢字")
+    _, children_excluded, _ = create_parsed_furigana_html("漢字", exclude_words={"漢字"})
+
+    assert reading_cache.info().misses == 2
+    assert len(children) == 1
+    assert children_excluded == []
+
+
+def test_persistent_reading_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv("FURIGANALYSE_READING_CACHE_DIR", str(tmp_path))
+    reading_cache.clear()
+
+    create_parsed_furigana_html("漢字")
+    reading_cache.clear()
+    _, children, _ = create_parsed_furigana_html("漢字")
+
+    assert len(get_persistent_reading_cache()) == 1
+    assert len(children) == 1
+
+
+@pytest.mark.parametrize(
+    ("content", "mode", "expected"),
+    [
+        ("<p>ひらがなだけ</p>", "add", False),
+        ("<p>漢字</p>", "add", True),
+        ("<p>&#28450;</p>", "add", True),
+        ("<p><ruby>ねこ<rt>neko</rt></ruby></p>", "add", False),
+        ("<p>漢字</p>", "remove", False),
+        ("<p><ruby>ねこ<rt>neko</rt></ruby></p>", "remove", True),
+        ("<p><html:ruby>ねこ</html:ruby></p>", "remove", True),
+        ('<p class="ruby">ねこ</p>', "replace", False),
+        ("<p><ruby>ねこ<rt>neko</rt></ruby></p>", "replace", True),
+    ],
+)
+def test_needs_processing(content, mode, expected):
+    assert needs_processing(content.encode("utf-8"), mode) == expected
+
+
+def test_needs_processing_other_encodings():
+    content = "<?xml version='1.0' encoding='shift_jis'?><p>ひらがな</p>"
+    assert needs_processing(content.encode("shift_jis"), "add")
+    assert needs_processing(content.encode("utf-16"), "add")
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+@pytest.mark.parametrize("workers", [1, 2])
+def test_process_epub_archive(tmp_path, streaming, workers):
+    inputfile = tmp_path / "input.epub"
+    chapter = '<html xmlns="http://www.w3.org/1999/xhtml"><body><p>漢字</p></body></html>'
+    cover = '<html xmlns="http://www.w3.org/1999/xhtml"><body><img src="cover.png"/></body></html>'
+    with zipfile.ZipFile(inputfile, "w") as zip_out:
+        zip_out.writestr("mimetype", "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        zip_out.writestr("OEBPS/cover.xhtml", cover, compress_type=zipfile.ZIP_DEFLATED)
+        zip_out.writestr("OEBPS/chapter1.xhtml", chapter, compress_type=zipfile.ZIP_DEFLATED)
+        zip_out.writestr("OEBPS/chapter2.xhtml", chapter.replace("漢字", "漢字、漢字"), compress_type=zipfile.ZIP_DEFLATED)
+        zip_out.writestr("OEBPS/style.css", "p { writing-mode: horizontal-tb; }")
+        zip_out.writestr("OEBPS/cover.png", b"\x89PNG" * 100, compress_type=zipfile.ZIP_DEFLATED)
+
+    outputfile = tmp_path / "output.epub"
+    stats = process_epub_archive(
+        str(inputfile), str(outputfile), "add", WritingMode.vertical_rl, streaming=streaming, workers=workers
+    )
+
+    assert (stats.processed, stats.skipped) == (2, 1)
+    with zipfile.ZipFile(inputfile) as zip_in, zipfile.ZipFile(outputfile) as zip_out:
+        assert zip_out.namelist() == zip_in.namelist()
+        assert [info.compress_type for info in zip_out.infolist()] == [info.compress_type for info in zip_in.infolist()]
+        assert zip_out.read("OEBPS/cover.xhtml") == zip_in.read("OEBPS/cover.xhtml")
+        assert zip_out.read("OEBPS/cover.png") == zip_in.read("OEBPS/cover.png")
+        assert zip_out.read("OEBPS/style.css") == b"p { writing-mode: vertical-rl; }"
+        assert b"<ruby>" in zip_out.read("OEBPS/chapter1.xhtml")
+        assert b"<ruby>" in zip_out.read("OEBPS/chapter2.xhtml")
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_process_epub_archive_compression_level(tmp_path, monkeypatch, streaming):
+    inputfile = tmp_path / "input.epub"
+    words = ["漢字", "東京", "大学", "人生", "世界一", "成功体験", "自己", "理解", "です", "ました", "。"]
+    rng = random.Random(0)
+    body = "".join(f"<p>{''.join(rng.choice(words) for _ in range(20))}</p>" for _ in range(500))
+    with zipfile.ZipFile(inputfile, "w") as zip_out:
+        zip_out.writestr(
+            "OEBPS/chapter.xhtml",
+            f'<html xmlns="http://www.w3.org/1999/xhtml"><body>{body}</body></html>',
+            compress_type=zipfile.ZIP_DEFLATED,
+        )
+
+    sizes = []
+    for level in (1, 9):
+        monkeypatch.setattr(epub_format, "COMPRESSION_LEVEL", level)
+        outputfile = tmp_path / f"output{level}.epub"
+        process_epub_archive(str(inputfile), str(outputfile), "add", streaming=streaming)
+        with zipfile.ZipFile(outputfile) as zip_in:
+            sizes.append(zip_in.getinfo("OEBPS/chapter.xhtml").compress_size)
+
+    assert sizes[0] > sizes[1]
+
+
+def test_process_epub_archive_with_text_outputs(tmp_path):
+    inputfile = tmp_path / "input.epub"
+    with zipfile.ZipFile(inputfile, "w") as zip_out:
+        zip_out.writestr("OEBPS/chapter.xhtml", '<html xmlns="http://www.w3.org/1999/xhtml"><body><p>漢字</p></body></html>')
+        zip_out.writestr("OEBPS/afterword.xhtml", '<html xmlns="http://www.w3.org/1999/xhtml"><body><p>おわり</p></body></html>')
+
+    with MultiTxtSink([SingleTxtSink(str(tmp_path / "book.txt")), TxtArchiveSink(str(tmp_path / "book.zip"))]) as sink:
+        stats = process_epub_archive(str(inputfile), str(tmp_path / "output.epub"), "add", txt_sink=sink)
+
+    assert (stats.processed, stats.skipped) == (1, 1)
+    assert (tmp_path / "book.txt").read_text() == "漢字(かんじ)おわり"
+    with zipfile.ZipFile(tmp_path / "book.zip") as zip_in:
+        assert zip_in.namelist() == ["OEBPS/chapter.txt", "OEBPS/afterword.txt"]
+        assert zip_in.read("OEBPS/chapter.txt").decode("utf-8") == "漢字(かんじ)"
+    with zipfile.ZipFile(tmp_path / "output.epub") as zip_in:
+        assert b"<rt>" in zip_in.read("OEBPS/chapter.xhtml")
+
+
+def test_process_epub_archive_text_only(tmp_path):
+    inputfile = tmp_path / "input.epub"
+    with zipfile.ZipFile(inputfile, "w") as zip_out:
+        zip_out.writestr("OEBPS/chapter.xhtml", '<html xmlns="http://www.w3.org/1999/xhtml"><body><p>漢字</p></body></html>')
+
+    with SingleTxtSink(str(tmp_path / "book.txt")) as sink:
+        process_epub_archive(str(inputfile), None, "add", txt_sink=sink)
+
+    assert (tmp_path / "book.txt").read_text() == "漢字(かんじ)"
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["book.txt", "input.epub"]
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_process_epub_archive_html_only(tmp_path, workers):
+    inputfile = tmp_path / "input.epub"
+    with zipfile.ZipFile(inputfile, "w") as zip_out:
+        zip_out.writestr("OEBPS/afterword.xhtml", '<html xmlns="http://www.w3.org/1999/xhtml"><body><p>おわり</p></body></html>')
+        zip_out.writestr("OEBPS/chapter.xhtml", '<html xmlns="http://www.w3.org/1999/xhtml"><body><p>漢字</p></body></html>')
+
+    with HtmlBookSink(str(tmp_path / "book.html"), epub_filepath=str(inputfile)) as sink:
+        process_epub_archive(str(inputfile), None, "add", workers=workers, html_sink=sink)
+
+    html = (tmp_path / "book.html").read_text(encoding="utf-8")
+    # Without package document, the documents are in archive order
+    assert '<section id="doc0"><p>おわり</p></section>\n<section id="doc1"><p><ruby>漢字<rt>かんじ</rt></ruby></p>' in html
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["book.html", "input.epub"]
+
+
+def test_convert_html_to_txt_lines_leaves_the_tree_unchanged():
+    tree = ET.fromstring(
+        '<html xmlns="http://www.w3.org/1999/xhtml"><body>'
+        '<p><ruby>漢字<rt>かんじ</rt></ruby>と<b>本</b></p>\n<p>おわり</p></body></html>'
+    )
+    before = ET.tostring(tree)
+
+    assert list(convert_html_to_txt_lines(tree)) == ["漢字(かんじ)と本\n", "おわり"]
+    assert ET.tostring(tree) == before
+
+
+def test_iter_paragraph_tokens():
+    tree = ET.fromstring(
+        '<html xmlns="http://www.w3.org/1999/xhtml"><body><p>'
+        '<ruby>漢<rp>(</rp><rt>かん</rt><rp>)</rp>字<rp>(</rp><rt>じ</rt><rp>)</rp></ruby>と<b>'
+        '<ruby><rb>本</rb><rt>ほん</rt></ruby></b></p>\n</body></html>'
+    )
+
+    assert list(iter_paragraph_tokens(tree)) == [
+        (("漢", "かん"), ("字", "じ"), ("と",), ("本", "ほん"), ("\n",)),
+    ]
@@ -0,0 +1,90 @@
+import zipfile
+from xml.etree import ElementTree as ET
+
+import pytest
+
+from furiganalyse.html_format import HtmlBookSink, read_package
+
+CONTAINER = """<?xml version="1.0"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+<rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/></rootfiles>
+</container>"""
+
+PACKAGE = """<?xml version="1.0"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0">
+<metadata xmlns:dc="http://purl.org/dc/elements/1.1/"><dc:title>吾輩は猫である</dc:title><dc:language>ja</dc:language></metadata>
+<manifest>
+<item id="c2" href="text/chapter2.xhtml" media-type="application/xhtml+xml"/>
+<item id="c1" href="text/chapter1.xhtml" media-type="application/xhtml+xml"/>
+<item id="img" href="images/cat.png" media-type="image/png"/>
+</manifest>
+<spine><itemref idref="c1"/><itemref idref="c2"/></spine>
+</package>"""
+
+CHAPTER1 = """<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops"><body>
+<p id="start" epub:type="z3998:fiction"><ruby>吾輩<rt>わがはい</rt></ruby>は猫である。<br/><a href="chapter2.xhtml#end">次</a></p>
+<div></div><img src="../images/cat.png" alt="猫"/>
+</body></html>"""
+
+CHAPTER2 = """<html xmlns="http://www.w3.org/1999/xhtml"><body>
+<p id="end">名前は&lt;まだ&gt;無い。<a href="https://example.com">link</a></p>
+<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink"><image xlink:href="../images/cat.png"/></svg>
+</body></html>"""
+
+
+def write_epub(filepath):
+    with zipfile.ZipFile(filepath, "w") as zip_out:
+        zip_out.writestr("mimetype", "application/epub+zip")
+        zip_out.writestr("META-INF/container.xml", CONTAINER)
+        zip_out.writestr("OEBPS/content.opf", PACKAGE)
+        zip_out.writestr("OEBPS/text/chapter2.xhtml", CHAPTER2)
+        zip_out.writestr("OEBPS/text/chapter1.xhtml", CHAPTER1)
+        zip_out.writestr("OEBPS/images/cat.png", b"\x89PNG")
+
+
+def test_read_package(tmp_path):
+    write_epub(tmp_path / "book.epub")
+    with zipfile.ZipFile(tmp_path / "book.epub") as zip_in:
+        assert read_package(zip_in) == (
+            "吾輩は猫である", "ja", ["OEBPS/text/chapter1.xhtml", "OEBPS/text/chapter2.xhtml"]
+        )
+
+
+def write_html_book(epub_filepath, outputfile, documents):
+    with HtmlBookSink(str(outputfile), epub_filepath=str(epub_filepath)) as sink, \
+            zipfile.ZipFile(epub_filepath) as zip_in:
+        for document in documents:
+            sink.add_document(document, ET.fromstring(zip_in.read(document)))
+
+
+# The documents come in archive order, the sections are written in spine order
+@pytest.mark.parametrize("documents", [
+    ["OEBPS/text/chapter1.xhtml", "OEBPS/text/chapter2.xhtml"],
+    ["OEBPS/text/chapter2.xhtml", "OEBPS/text/chapter1.xhtml"],
+])
+def test_html_book_sink(tmp_path, documents):
+    write_epub(tmp_path / "book.epub")
+    write_html_book(tmp_path / "book.epub", tmp_path / "book.html", documents)
+    html = (tmp_path / "book.html").read_text(encoding="utf-8")
+
+    assert html.startswith("<!DOCTYPE html>\n<html lang=\"ja\">")
+    assert "<title>吾輩は猫である</title>" in html
+    # Spine order, ruby markup kept, ids made unique across documents and links pointing to them
+    assert html.index('<section id="doc0">') < html.index('<section id="doc1">')
+    assert '<p id="doc0-start"><ruby>吾輩<rt>わがはい</rt></ruby>は猫である。<br><a href="#doc1-end">次</a></p>' in html
+    assert "<div></div>" in html
+    assert '<p id="doc1-end">名前は&lt;まだ&gt;無い。<a href="https://example.com">link</a></p>' in html
+    # Images inlined
+    assert '<img src="data:image/png;base64,iVBORw==" alt="猫">' in html
+    assert '<svg xmlns="http://www.w3.org/2000/svg"><image href="data:image/png;base64,iVBORw=="/></svg>' in html
+    assert html.endswith("</body>\n</html>\n")
+
+
+def test_html_book_sink_missing_document(tmp_path):
+    write_epub(tmp_path / "book.epub")
+    write_html_book(tmp_path / "book.epub", tmp_path / "book.html", ["OEBPS/text/chapter2.xhtml"])
+    html = (tmp_path / "book.html").read_text(encoding="utf-8")
+
+    assert '<section id="doc0">' not in html
+    assert '<section id="doc1">' in html
+    assert html.endswith("</body>\n</html>\n")
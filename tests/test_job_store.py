@@ -0,0 +1,76 @@
+import pytest
+
+from furiganalyse.job_store import Job, JobStore, MemoryJobStore, SqliteJobStore
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemoryJobStore()
+    return SqliteJobStore(str(tmp_path / "jobs.sqlite3"))
+
+
+def test_put_and_get(store):
+    job = Job()
+    store.put(job)
+
+    stored = store.get(job.uid)
+    assert stored == job
+    # Changes are only seen once the job is put back
+    stored.status = "complete"
+    assert store.get(job.uid).status == "in_progress"
+    store.put(stored)
+    assert store.get(job.uid).status == "complete"
+    assert store.get(Job().uid) is None
+
+
+def test_delete_removes_the_jobs_sharing_the_results(store):
+    job, sharing_job, other_job = Job(), Job(), Job()
+    store.put(job)
+    store.put(sharing_job, source=job.uid)
+    store.put(other_job)
+
+    assert sorted(store.delete(job.uid)) == sorted([job.uid, sharing_job.uid])
+    assert store.get(sharing_job.uid) is None
+    assert store.get(other_job.uid) == other_job
+    assert len(store) == 1
+
+
+def test_incomplete_store_cannot_be_created():
+    class IncompleteJobStore(JobStore):
+        def get(self, uid):
+            return None
+
+    with pytest.raises(TypeError):
+        IncompleteJobStore()
+
+
+def test_sqlite_store_is_shared_between_connections(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    job = Job(status="complete", results={"epub": "result"})
+    SqliteJobStore(path).put(job)
+
+    # Another worker process, or the same one after a restart
+    assert SqliteJobStore(path).get(job.uid) == job
+
+
+def test_update_progress(store):
+    job, sharing_job = Job(), Job()
+    store.put(job)
+    store.put(sharing_job, source=job.uid)
+
+    store.update_progress(sharing_job.uid, "annotating", 50.0, None)
+    assert store.get(sharing_job.uid).model_dump(include={"stage", "progress_percent", "eta_seconds"}) == {
+        "stage": "annotating", "progress_percent": 50.0, "eta_seconds": None
+    }
+    store.update_progress(sharing_job.uid, "writing_output", 20.0, 3.5)
+    assert store.get(sharing_job.uid).eta_seconds == 3.5
+    # The source is kept
+    assert sorted(store.delete(job.uid)) == sorted([job.uid, sharing_job.uid])
+
+    # The jobs that are not in progress anymore are left as they are
+    store.put(job.model_copy(update={"status": "complete"}))
+    store.update_progress(job.uid, "annotating", 50.0, 1.0)
+    assert store.get(job.uid) == job.model_copy(update={"status": "complete"})
+    store.update_progress(Job().uid, "annotating", 50.0, 1.0)
+    assert len(store) == 1
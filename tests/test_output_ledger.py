@@ -0,0 +1,69 @@
+from uuid import uuid4
+
+from furiganalyse import output_ledger as output_ledger_module
+from furiganalyse.output_ledger import OutputLedger, folder_size
+
+
+def test_folder_size(tmp_path):
+    (tmp_path / "book.epub").write_bytes(b"x" * 10)
+    (tmp_path / "images").mkdir()
+    (tmp_path / "images" / "cover.jpg").write_bytes(b"x" * 5)
+
+    assert folder_size(str(tmp_path)) == 15
+
+
+def test_evicts_least_recently_used_over_budget(tmp_path, monkeypatch):
+    clock = iter(range(1_000_000))
+    monkeypatch.setattr(output_ledger_module.time, "time", lambda: next(clock))
+    ledger = OutputLedger(str(tmp_path / "outputs.sqlite3"))
+    first, second, third = uuid4(), uuid4(), uuid4()
+    for uid in [first, second, third]:
+        ledger.add(uid)
+        ledger.update(uid, 10, in_progress=False)
+    # Used again, the first folder is now the most recent one
+    ledger.touch(first)
+
+    assert ledger.total_size() == 30
+    assert ledger.evict(max_size=20, ttl=1000) == [second]
+    assert ledger.evict(max_size=20, ttl=1000) == []
+    assert ledger.total_size() == 20
+
+
+def test_evicts_expired(tmp_path, monkeypatch):
+    now = [0]
+    monkeypatch.setattr(output_ledger_module.time, "time", lambda: now[0])
+    ledger = OutputLedger(str(tmp_path / "outputs.sqlite3"))
+    old, recent = uuid4(), uuid4()
+    ledger.adopt(old, 10, last_used=0)
+    now[0] = 50
+    ledger.add(recent)
+    ledger.update(recent, 10, in_progress=False)
+
+    now[0] = 120
+    assert ledger.evict(max_size=1000, ttl=100) == [old]
+    assert old not in ledger and recent in ledger
+
+
+def test_keeps_the_jobs_in_progress(tmp_path, monkeypatch):
+    ledger = OutputLedger(str(tmp_path / "outputs.sqlite3"))
+    running, done = uuid4(), uuid4()
+    ledger.add(running)
+    ledger.update(running, 10)
+    ledger.add(done)
+    ledger.update(done, 10, in_progress=False)
+
+    assert ledger.evict(max_size=0, ttl=0) == [done]
+    assert ledger.done_uids() == set()
+
+    # Unless the process running them died
+    monkeypatch.setattr(output_ledger_module, "process_exists", lambda pid: False)
+    assert ledger.evict(max_size=0, ttl=0) == [running]
+
+
+def test_one_janitor_at_a_time(tmp_path):
+    path = str(tmp_path / "outputs.sqlite3")
+    ledger, other_ledger = OutputLedger(path), OutputLedger(path)
+
+    assert ledger.acquire_janitor()
+    assert ledger.acquire_janitor()
+    assert not other_ledger.acquire_janitor()
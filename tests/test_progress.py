@@ -0,0 +1,45 @@
+import zipfile
+
+from furiganalyse import progress as progress_module
+from furiganalyse.epub_format import process_epub_archive
+from furiganalyse.progress import Progress, ProgressReporter, Stage
+
+
+def test_progress_reporter(monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr(progress_module.time, "monotonic", lambda: clock[0])
+    published = []
+    reporter = ProgressReporter(published.append)
+
+    reporter.start_stage(Stage.annotating)
+    clock[0] = 10.0
+    reporter.advance(1, 2)
+    # Within the publication interval, only the end of the stage is published
+    clock[0] = 10.5
+    reporter.advance(1, 2)
+    clock[0] = 11.0
+    reporter.advance(2, 2)
+
+    assert published == [
+        Progress(Stage.annotating, 10.0, None),
+        Progress(Stage.annotating, 50.0, 10.0),
+        Progress(Stage.annotating, 90.0, 11.0 * 10 / 90),
+    ]
+
+
+def test_process_epub_archive_reports_progress(tmp_path):
+    inputfile = tmp_path / "input.epub"
+    with zipfile.ZipFile(inputfile, "w") as zip_out:
+        for i in range(3):
+            zip_out.writestr(
+                f"OEBPS/chapter{i}.xhtml", '<html xmlns="http://www.w3.org/1999/xhtml"><body><p>漢字</p></body></html>'
+            )
+    published = []
+    reporter = ProgressReporter(published.append)
+    reporter.start_stage(Stage.annotating)
+
+    process_epub_archive(str(inputfile), str(tmp_path / "output.epub"), "add", progress=reporter)
+
+    assert published[0].percent == 10.0
+    assert published[-1].stage == Stage.annotating
+    assert published[-1].percent == 90.0
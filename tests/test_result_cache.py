@@ -0,0 +1,85 @@
+from uuid import uuid4
+
+import pytest
+
+from furiganalyse import result_cache as result_cache_module
+from furiganalyse.result_cache import (
+    CachedResult, MemoryResultCache, ResultCache, SqliteResultCache, job_cache_key,
+)
+
+
+def test_job_cache_key():
+    key = job_cache_key("upload", "epub", "add", "vertical-rl", "words", 100)
+    assert key == job_cache_key("upload", "epub", "add", "vertical-rl", "words", 100)
+    assert key != job_cache_key("other upload", "epub", "add", "vertical-rl", "words", 100)
+    assert key != job_cache_key("upload", "epub", "replace", "vertical-rl", "words", 100)
+    assert key != job_cache_key("upload", "epub", "add", "vertical-rl", "other words", 100)
+    assert key != job_cache_key("upload", "epub", "add", "vertical-rl", "words", 200)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def cache(request, tmp_path):
+    if request.param == "memory":
+        return MemoryResultCache()
+    return SqliteResultCache(str(tmp_path / "jobs.sqlite3"))
+
+
+def test_incomplete_cache_cannot_be_created():
+    class IncompleteResultCache(ResultCache):
+        def get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        IncompleteResultCache()
+
+
+def test_result_cache_coalesces_in_flight_jobs(cache):
+    first, second = uuid4(), uuid4()
+
+    assert cache.get("key") is None
+    assert not cache.attach("key", first)
+    assert cache.attach("key", second)
+
+    cached = CachedResult(first, "result", {"epub": "result"}, 3, 1)
+    assert cache.complete("key", cached) == [second]
+    assert cache.get("key") == cached
+
+    # The output of the first job is removed
+    cache.invalidate(first)
+    assert cache.get("key") is None
+    assert len(cache) == 0
+
+
+def test_result_cache_does_not_keep_failures(cache):
+    first, second = uuid4(), uuid4()
+    assert not cache.attach("key", first)
+    assert cache.attach("key", second)
+
+    assert cache.complete("key", None) == [second]
+    assert cache.get("key") is None
+    # The next identical job is processed again
+    assert not cache.attach("key", uuid4())
+
+
+def test_sqlite_result_cache_is_shared(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    cache, other_cache = SqliteResultCache(path), SqliteResultCache(path)
+    first, second = uuid4(), uuid4()
+
+    assert not cache.attach("key", first)
+    assert other_cache.attach("key", second)
+    cached = CachedResult(first, "result", {"epub": "result"})
+    assert cache.complete("key", cached) == [second]
+    assert other_cache.get("key") == cached
+
+
+def test_sqlite_result_cache_takes_over_dead_jobs(tmp_path, monkeypatch):
+    cache = SqliteResultCache(str(tmp_path / "jobs.sqlite3"))
+    first, second, third = uuid4(), uuid4(), uuid4()
+    assert not cache.attach("key", first)
+    assert cache.attach("key", second)
+
+    # The process running the first job died, the next identical job is processed instead
+    monkeypatch.setattr(result_cache_module, "process_exists", lambda pid: False)
+    assert not cache.attach("key", third)
+    assert cache.complete("key", CachedResult(third, "result", {"epub": "result"})) == [second]
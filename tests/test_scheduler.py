@@ -0,0 +1,110 @@
+import asyncio
+import os
+from uuid import uuid4
+
+import pytest
+
+from furiganalyse import scheduler as scheduler_module
+from furiganalyse.scheduler import JobScheduler, QueueFull, QueuePosition, estimate_cost
+
+
+def test_estimate_cost():
+    assert estimate_cost(0, ".epub") == estimate_cost(0, ".txt")
+    assert estimate_cost(10_000_000, ".epub") < estimate_cost(10_000_000, ".mobi")
+    assert estimate_cost(1_000_000, ".EPUB") < estimate_cost(10_000_000, ".epub")
+
+
+def test_queue_is_bounded(tmp_path):
+    scheduler = JobScheduler(str(tmp_path / "scheduler.sqlite3"), max_running=1, max_queued=2)
+    first, second, third = uuid4(), uuid4(), uuid4()
+    scheduler.submit(first, 1)
+    scheduler.submit(second, 1)
+    with pytest.raises(QueueFull):
+        scheduler.submit(third, 1)
+
+    # Running jobs do not count in the queue
+    assert scheduler.try_start(first)
+    scheduler.submit(third, 1)
+
+
+def test_cheap_jobs_go_first(tmp_path, monkeypatch):
+    clock = iter(range(1_000_000))
+    monkeypatch.setattr(scheduler_module.time, "time", lambda: next(clock))
+    scheduler = JobScheduler(str(tmp_path / "scheduler.sqlite3"), max_running=1, max_queued=10)
+    running, big, small = uuid4(), uuid4(), uuid4()
+    scheduler.submit(running, 1)
+    assert scheduler.try_start(running)
+    scheduler.submit(big, 300)
+    scheduler.submit(small, 2)
+
+    # The slot is taken
+    assert not scheduler.try_start(small)
+    assert scheduler.position(running) == QueuePosition(0, 0.0)
+    assert scheduler.position(small).position == 1
+    assert scheduler.position(big).position == 2
+    assert scheduler.position(small).wait_seconds < scheduler.position(big).wait_seconds
+
+    scheduler.finish(running)
+    assert not scheduler.try_start(big)
+    assert scheduler.try_start(small)
+    scheduler.finish(small)
+    assert scheduler.try_start(big)
+    assert scheduler.position(uuid4()) is None
+
+
+def test_slots_are_shared_between_processes(tmp_path, monkeypatch):
+    monkeypatch.setattr(scheduler_module, "POLL_INTERVAL", 0.01)
+    path = str(tmp_path / "scheduler.sqlite3")
+    scheduler = JobScheduler(path, max_running=1, max_queued=10)
+    # Another worker process
+    other_scheduler = JobScheduler(path, max_running=1, max_queued=10)
+    first, second = uuid4(), uuid4()
+    scheduler.submit(first, 1)
+    other_scheduler.submit(second, 1)
+    assert scheduler.try_start(first)
+
+    async def run():
+        waiting = asyncio.ensure_future(other_scheduler.wait_turn(second))
+        await asyncio.sleep(0.1)
+        assert not waiting.done()
+        scheduler.finish(first)
+        await asyncio.wait_for(waiting, 1)
+
+    asyncio.run(run())
+    assert other_scheduler.position(second) == QueuePosition(0, 0.0)
+
+
+def test_jobs_of_dead_processes_are_removed(tmp_path, monkeypatch):
+    scheduler = JobScheduler(str(tmp_path / "scheduler.sqlite3"), max_running=1, max_queued=10)
+    first, second = uuid4(), uuid4()
+    scheduler.submit(first, 1)
+    assert scheduler.try_start(first)
+    scheduler.submit(second, 1)
+
+    monkeypatch.setattr(scheduler_module, "process_exists", lambda pid: False)
+    assert not scheduler.try_start(second)
+    assert scheduler.position(first) is None
+
+
+def test_jobs_of_a_busy_process_are_passed_over(tmp_path, monkeypatch):
+    clock = iter(range(1_000_000))
+    monkeypatch.setattr(scheduler_module.time, "time", lambda: next(clock))
+    scheduler = JobScheduler(
+        str(tmp_path / "scheduler.sqlite3"), max_running=3, max_queued=10, max_running_per_process=1
+    )
+    first, second = uuid4(), uuid4()
+    scheduler.submit(first, 1)
+    assert scheduler.try_start(first)
+    scheduler.submit(second, 1)
+
+    # The slot of this process is taken, while the machine has free ones
+    assert not scheduler.try_start(second)
+    # A job of another worker process, submitted later, takes one of them
+    other = uuid4()
+    with monkeypatch.context() as patch:
+        patch.setattr(scheduler_module.os, "getpid", os.getppid)
+        scheduler.submit(other, 1)
+        assert scheduler.try_start(other)
+
+    scheduler.finish(first)
+    assert scheduler.try_start(second)
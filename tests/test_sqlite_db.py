@@ -0,0 +1,36 @@
+import os
+import threading
+
+import pytest
+
+from furiganalyse.sqlite_db import SharedDatabase, process_exists
+
+
+def test_transaction_rolls_back_on_error(tmp_path):
+    database = SharedDatabase(str(tmp_path / "shared.sqlite3"))
+    database.connection().execute("CREATE TABLE items (name TEXT)")
+
+    with pytest.raises(ValueError):
+        with database.transaction() as connection:
+            connection.execute("INSERT INTO items VALUES ('lost')")
+            raise ValueError()
+    with database.transaction() as connection:
+        connection.execute("INSERT INTO items VALUES ('kept')")
+
+    assert database.connection().execute("SELECT name FROM items").fetchall() == [("kept",)]
+
+
+def test_connection_per_thread(tmp_path):
+    database = SharedDatabase(str(tmp_path / "shared.sqlite3"))
+    connections = []
+    thread = threading.Thread(target=lambda: connections.append(database.connection()))
+    thread.start()
+    thread.join()
+
+    assert connections[0] is not database.connection()
+    assert database.connection() is database.connection()
+
+
+def test_process_exists():
+    assert process_exists(os.getpid())
+    assert not process_exists(2 ** 22 + 1)
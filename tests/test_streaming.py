@@ -0,0 +1,67 @@
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from furiganalyse import streaming
+from furiganalyse.parsing import process_html
+from furiganalyse.streaming import process_html_streaming
+
+DOCUMENT = """<?xml version='1.0' encoding='utf-8'?>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops">
+<head><title>第一章</title></head>
+<body class="main">はじめに、
+<p id="1">吾輩は<ruby>猫<rt>ねこ</rt></ruby>である。</p>名前はまだ無い。
+<div><p epub:type="chapter">どこで<span>生</span>れたか</p></div>
+<p>No kanji around here<br class="main"/></p>
+</body>
+</html>
+"""
+
+
+@pytest.mark.parametrize("mode", ["add", "replace", "remove"])
+@pytest.mark.parametrize("batch_size", [1, 256])
+def test_streaming_matches_tree_mode(tmp_path, monkeypatch, mode, batch_size):
+    monkeypatch.setattr(streaming, "STREAM_BATCH_SIZE", batch_size)
+    inputfile = tmp_path / "input.xhtml"
+    inputfile.write_text(DOCUMENT, encoding="utf-8")
+    outputfile = tmp_path / "output.xhtml"
+
+    assert process_html_streaming(str(inputfile), str(outputfile), mode)
+
+    expected_tree = process_html(str(inputfile), mode)
+    # Namespace declarations may be placed differently, compare the re-serialized documents
+    streamed_tree = ET.parse(outputfile)
+    assert ET.tostring(streamed_tree.getroot()) == ET.tostring(expected_tree.getroot())
+
+
+def test_streaming_falls_back_without_body(tmp_path):
+    inputfile = tmp_path / "input.svg"
+    inputfile.write_text('<svg xmlns="http://www.w3.org/2000/svg"><text>漢字</text></svg>', encoding="utf-8")
+    outputfile = tmp_path / "output.svg"
+
+    assert not process_html_streaming(str(inputfile), str(outputfile), "add")
+    assert ET.tostring(ET.parse(outputfile).getroot()) == ET.tostring(process_html(str(inputfile), "add").getroot())
+
+
+# <ruby> elements right in the <body>: once replaced, their text is merged with the text around them
+BODY_RUBY_DOCUMENTS = [
+    '<body>はじめに東<ruby>京<rt>きょう</rt></ruby>です<p>漢字</p></body>',
+    '<body><p>漢字</p>東<ruby>京<rt>きょう</rt></ruby>です<p>漢字</p></body>',
+    '<body><p>漢字</p><p>人</p>大<ruby>学<rt>がく</rt></ruby><ruby>大<rt>だい</rt></ruby>学<p>自己</p>理</body>',
+    '<body><ruby>世<rt>せ</rt></ruby>界一<p>漢字</p></body>',
+]
+
+
+@pytest.mark.parametrize("document", BODY_RUBY_DOCUMENTS, ids=["first", "after_block", "many", "only_text"])
+@pytest.mark.parametrize("mode", ["add", "replace", "remove"])
+@pytest.mark.parametrize("batch_size", [1, 2, 256])
+def test_streaming_matches_tree_mode_with_rubies_in_body(tmp_path, monkeypatch, document, mode, batch_size):
+    monkeypatch.setattr(streaming, "STREAM_BATCH_SIZE", batch_size)
+    inputfile = tmp_path / "input.xhtml"
+    inputfile.write_text(f'<html xmlns="http://www.w3.org/1999/xhtml"><head/>{document}</html>', encoding="utf-8")
+    outputfile = tmp_path / "output.xhtml"
+
+    assert process_html_streaming(str(inputfile), str(outputfile), mode)
+
+    expected_tree = process_html(str(inputfile), mode)
+    assert ET.tostring(ET.parse(outputfile).getroot()) == ET.tostring(expected_tree.getroot())
@@ -0,0 +1,72 @@
+import zipfile
+
+import pytest
+
+from furiganalyse import txt_input
+from furiganalyse.html_format import HtmlBookSink, read_package
+from furiganalyse.params import FuriganaMode, WritingMode
+from furiganalyse.txt_format import TxtArchiveSink
+from furiganalyse.txt_input import detect_encoding, iter_paragraphs, process_txt_file
+
+TEXT = "漢字の本\n\n  漢字、漢字  \nひらがな\n"
+
+
+@pytest.mark.parametrize("encoding, expected", [
+    ("utf-8", "utf-8"),
+    ("utf-8-sig", "utf-8-sig"),
+    ("utf-16", "utf-16"),
+    ("shift_jis", "cp932"),
+    ("euc_jp", "euc_jp"),
+    ("iso2022_jp", "iso2022_jp"),
+])
+def test_detect_encoding(tmp_path, encoding, expected):
+    filepath = str(tmp_path / "book.txt")
+    with open(filepath, "w", encoding=encoding) as fd:
+        fd.write(TEXT)
+
+    assert detect_encoding(filepath) == expected
+    assert list(iter_paragraphs(filepath)) == ["漢字の本", "漢字、漢字", "ひらがな"]
+
+
+def test_process_txt_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(txt_input, "CHAPTER_PARAGRAPHS", 2)
+    inputfile = str(tmp_path / "book.txt")
+    with open(inputfile, "w", encoding="shift_jis") as fd:
+        fd.write(TEXT)
+    epub_filepath = str(tmp_path / "book.epub")
+
+    with TxtArchiveSink(str(tmp_path / "book.zip")) as sink:
+        stats = process_txt_file(inputfile, FuriganaMode.add, "本", epub_filepath, sink, WritingMode.vertical_rl)
+
+    assert stats.processed == 2
+    with zipfile.ZipFile(epub_filepath) as zip_in:
+        assert zip_in.namelist()[0] == "mimetype"
+        assert zip_in.getinfo("mimetype").compress_type == zipfile.ZIP_STORED
+        title, language, documents = read_package(zip_in)
+        assert (title, language) == ("本", "ja")
+        assert documents == ["OEBPS/chapter00000.xhtml", "OEBPS/chapter00001.xhtml"]
+        chapter = zip_in.read(documents[0]).decode("utf-8")
+        assert "<p><ruby>漢字<rt>かんじ</rt></ruby>の本</p>" in chapter
+        assert b"vertical-rl" in zip_in.read("OEBPS/style.css")
+        assert b'page-progression-direction="rtl"' in zip_in.read("OEBPS/content.opf")
+
+    with zipfile.ZipFile(tmp_path / "book.zip") as zip_in:
+        assert zip_in.namelist() == ["chapter00000.txt", "chapter00001.txt"]
+        assert zip_in.read("chapter00000.txt").decode("utf-8") == "漢字(かんじ)の本\n漢字(かんじ)、漢字(かんじ)\n"
+        assert zip_in.read("chapter00001.txt").decode("utf-8") == "ひらがな\n"
+
+
+def test_process_txt_file_html_output(tmp_path, monkeypatch):
+    monkeypatch.setattr(txt_input, "CHAPTER_PARAGRAPHS", 2)
+    inputfile = str(tmp_path / "book.txt")
+    with open(inputfile, "w", encoding="utf-8") as fd:
+        fd.write(TEXT)
+
+    with HtmlBookSink(str(tmp_path / "book.html"), title="本", language="ja") as sink:
+        process_txt_file(inputfile, FuriganaMode.add, "本", html_sink=sink)
+
+    html = (tmp_path / "book.html").read_text(encoding="utf-8")
+    assert "<title>本</title>" in html
+    assert html.index('<section id="doc0">') < html.index('<section id="doc1">')
+    assert "<p><ruby>漢字<rt>かんじ</rt></ruby>の本</p>" in html
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["book.html", "book.txt"]
@@ -0,0 +1,65 @@
+import hashlib
+import io
+
+import pytest
+from fastapi import FastAPI, UploadFile
+from fastapi.testclient import TestClient
+
+from furiganalyse import uploads
+from furiganalyse.uploads import RequestSizeLimit, UploadTooLarge, save_upload
+
+
+def test_save_upload(tmp_path, monkeypatch):
+    monkeypatch.setattr(uploads, "CHUNK_SIZE", 4)
+    contents = "漢字の本".encode("utf-8") * 10
+    destination = str(tmp_path / "book.txt")
+
+    upload = save_upload(io.BytesIO(contents), destination, max_size=len(contents))
+
+    assert upload.size == len(contents)
+    assert upload.digest == hashlib.sha256(contents).hexdigest()
+    with open(destination, "rb") as fd:
+        assert fd.read() == contents
+
+
+def test_save_upload_too_large(tmp_path, monkeypatch):
+    monkeypatch.setattr(uploads, "CHUNK_SIZE", 4)
+    destination = tmp_path / "book.txt"
+
+    with pytest.raises(UploadTooLarge):
+        save_upload(io.BytesIO(b"x" * 10), str(destination), max_size=9)
+    assert not destination.exists()
+
+
+def create_app(max_size):
+    app = FastAPI()
+    app.add_middleware(RequestSizeLimit, max_size=max_size)
+
+    @app.post("/submit")
+    async def submit(file: UploadFile):
+        return {"size": len(await file.read())}
+
+    return app
+
+
+def test_request_size_limit():
+    client = TestClient(create_app(max_size=1000))
+
+    assert client.post("/submit", files={"file": ("book.txt", b"x" * 100)}).json() == {"size": 100}
+    # Rejected from the Content-Length
+    assert client.post("/submit", files={"file": ("book.txt", b"x" * 1000)}).status_code == 413
+
+
+def test_request_size_limit_without_content_length():
+    client = TestClient(create_app(max_size=1000))
+    body = b"--boundary\r\nContent-Disposition: form-data; name=\"file\"; filename=\"book.txt\"\r\n\r\n"
+
+    def chunks():
+        yield body
+        for _ in range(10):
+            yield b"x" * 200
+
+    response = client.post(
+        "/submit", content=chunks(), headers={"Content-Type": "multipart/form-data; boundary=boundary"}
+    )
+    assert response.status_code == 413
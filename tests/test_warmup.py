@@ -0,0 +1,37 @@
+import asyncio
+from concurrent.futures.process import BrokenProcessPool, ProcessPoolExecutor
+
+import pytest
+
+from furiganalyse import known_words, warmup as warmup_module
+from furiganalyse.warmup import WarmupError, init_app_worker, warm_up_pool
+
+
+def test_init_app_worker_loads_the_word_lists():
+    known_words.load_word_list.cache_clear()
+    init_app_worker()
+
+    filenames = [filename for filename, _, _ in known_words.list_available_word_lists()]
+    assert filenames
+    assert known_words.load_word_list.cache_info().currsize == len(filenames)
+
+
+def test_init_app_worker_checks_the_tokenizer(monkeypatch):
+    monkeypatch.setattr(warmup_module, "split_furigana", lambda text: [(text,)])
+    with pytest.raises(WarmupError):
+        init_app_worker()
+
+
+def failing_initializer():
+    raise WarmupError("No dictionary")
+
+
+def test_warm_up_pool_waits_for_every_process():
+    with ProcessPoolExecutor(max_workers=2, initializer=init_app_worker) as executor:
+        assert len(asyncio.run(warm_up_pool(executor, 2))) == 2
+
+
+def test_warm_up_pool_fails_with_the_initializer():
+    with ProcessPoolExecutor(max_workers=1, initializer=failing_initializer) as executor:
+        with pytest.raises(BrokenProcessPool):
+            asyncio.run(warm_up_pool(executor, 1))
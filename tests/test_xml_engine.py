@@ -0,0 +1,61 @@
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from furiganalyse.parsing import convert_html_to_txt_lines, process_tree
+from furiganalyse.xml_engine import LxmlEngine, StdlibEngine, get_xml_engine
+
+DOCUMENT = """<?xml version='1.0' encoding='utf-8'?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops">
+<head><title>第一章</title></head>
+<body class="main">
+<p id="1">吾輩は<ruby>猫<rt>ねこ</rt></ruby>である。</p>名前はまだ無い。
+<div><p epub:type="chapter">どこで<span>生</span>れたか</p></div>
+<p>No kanji around here<br class="main"/></p>
+</body>
+</html>
+"""
+
+
+def test_unknown_engine():
+    with pytest.raises(ValueError):
+        get_xml_engine("unknown")
+
+
+def test_default_engine(monkeypatch):
+    monkeypatch.delenv("FURIGANALYSE_XML_ENGINE", raising=False)
+    get_xml_engine.cache_clear()
+    assert isinstance(get_xml_engine(), StdlibEngine)
+
+
+@pytest.mark.parametrize("mode", ["add", "replace", "remove"])
+def test_engines_output_equivalence(tmp_path, mode):
+    pytest.importorskip("lxml")
+    inputfile = tmp_path / "input.xhtml"
+    inputfile.write_text(DOCUMENT, encoding="utf-8")
+
+    outputs = []
+    for engine in (StdlibEngine(), LxmlEngine()):
+        tree = engine.parse(str(inputfile))
+        process_tree(tree, mode)
+        outputfile = tmp_path / f"output_{engine.name}.xhtml"
+        tree.write(str(outputfile), encoding="utf-8")
+        outputs.append(ET.canonicalize(from_file=str(outputfile), rewrite_prefixes=True))
+
+    assert outputs[0] == outputs[1]
+
+
+def test_lxml_comment_tail_is_processed(tmp_path):
+    pytest.importorskip("lxml")
+    inputfile = tmp_path / "input.xhtml"
+    inputfile.write_text(
+        '<html xmlns="http://www.w3.org/1999/xhtml"><body><p>漢字<!-- comment -->漢字</p></body></html>',
+        encoding="utf-8",
+    )
+
+    tree = LxmlEngine().parse(str(inputfile))
+    process_tree(tree, "add")
+
+    assert len(tree.findall(".//{http://www.w3.org/1999/xhtml}ruby")) == 2
+    assert list(convert_html_to_txt_lines(tree)) == ["漢字(かんじ)漢字(かんじ)"]